@@ -1,12 +1,42 @@
-from typing import Dict, List, Optional, Any
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Any
+import hashlib
+import warnings
 
-from scipy.signal import find_peaks
+from scipy.signal import find_peaks, lfilter
 import numpy as np
 import pandas as pd
+from pandas.api.indexers import BaseIndexer
+
+from panel import Panel, PanelWindow
+from peak_index import PeakIndex, PeakIndexStore
 
 
 # --------------------------- 通用指标 --------------------------- #
 
+def _kdj_recursion(rsv: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    K/D 平滑递推（沿 axis 0）：
+
+        K_t = 2/3·K_{t-1} + 1/3·RSV_t,  D_t = 2/3·D_{t-1} + 1/3·K_t
+
+    首行 K = D = 50。该递推即一阶 IIR 滤波，交由 ``lfilter`` 整列计算，
+    其运算顺序与逐行循环一致，结果逐位相同。
+    """
+    K = np.empty_like(rsv, dtype=float)
+    D = np.empty_like(rsv, dtype=float)
+    if len(rsv) == 0:
+        return K, D
+
+    b, a = [1 / 3], [1.0, -2 / 3]
+    zi = np.full((1,) + rsv.shape[1:], 2 / 3 * 50.0)
+    K[0] = D[0] = 50.0
+    K[1:], _ = lfilter(b, a, rsv[1:], axis=0, zi=zi)
+    D[1:], _ = lfilter(b, a, K[1:], axis=0, zi=zi)
+    return K, D
+
+
 def compute_kdj(df: pd.DataFrame, n: int = 9) -> pd.DataFrame:
     if df.empty:
         return df.assign(K=np.nan, D=np.nan, J=np.nan)
@@ -15,18 +45,51 @@ def compute_kdj(df: pd.DataFrame, n: int = 9) -> pd.DataFrame:
     high_n = df["high"].rolling(window=n, min_periods=1).max()
     rsv = (df["close"] - low_n) / (high_n - low_n + 1e-9) * 100
 
-    K = np.zeros_like(rsv, dtype=float)
-    D = np.zeros_like(rsv, dtype=float)
-    for i in range(len(df)):
-        if i == 0:
-            K[i] = D[i] = 50.0
-        else:
-            K[i] = 2 / 3 * K[i - 1] + 1 / 3 * rsv.iloc[i]
-            D[i] = 2 / 3 * D[i - 1] + 1 / 3 * K[i]
+    K, D = _kdj_recursion(rsv.to_numpy(dtype=float))
     J = 3 * K - 2 * D
     return df.assign(K=K, D=D, J=J)
 
 
+def compute_kdj_batch(
+    low: np.ndarray,
+    high: np.ndarray,
+    close: np.ndarray,
+    n: int = 9,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    批量 KDJ：输入为 (bars × stocks) 的二维数组，一次返回全部股票的 K/D/J。
+
+    每列按时间升序排列；列首 close 为 NaN 的行视为“尚未上市”的填充，
+    递推从该列第一根有效 K 线开始（K = D = 50），结果与对该列有效部分
+    单独调用 :func:`compute_kdj` 完全一致，填充行输出 NaN。
+    """
+    low = np.asarray(low, dtype=float)
+    high = np.asarray(high, dtype=float)
+    close = np.asarray(close, dtype=float)
+    if close.ndim != 2:
+        raise ValueError("compute_kdj_batch 需要 (bars × stocks) 二维数组")
+
+    low_n = _rolling_columns(low, n, "min", 1)
+    high_n = _rolling_columns(high, n, "max", 1)
+    rsv = (close - low_n) / (high_n - low_n + 1e-9) * 100
+
+    # 将每列上移，使第一根有效 K 线对齐到第 0 行，递推后再移回原位
+    T = close.shape[0]
+    valid = ~np.isnan(close)
+    first = np.where(valid.any(axis=0), valid.argmax(axis=0), T)
+    rows = np.arange(T)[:, None] + first[None, :]
+    inside = rows < T
+    rows = np.minimum(rows, T - 1)
+
+    K_al, D_al = _kdj_recursion(np.take_along_axis(rsv, rows, axis=0))
+    K = np.full_like(rsv, np.nan)
+    D = np.full_like(rsv, np.nan)
+    cols = np.broadcast_to(np.arange(close.shape[1]), rows.shape)
+    K[rows[inside], cols[inside]] = K_al[inside]
+    D[rows[inside], cols[inside]] = D_al[inside]
+    return K, D, 3 * K - 2 * D
+
+
 def compute_bbi(df: pd.DataFrame) -> pd.Series:
     ma3 = df["close"].rolling(3).mean()
     ma6 = df["close"].rolling(6).mean()
@@ -57,6 +120,163 @@ def compute_dif(df: pd.DataFrame, fast: int = 12, slow: int = 26) -> pd.Series:
     return ema_fast - ema_slow
 
 
+def _bbi_window_passes(seg: np.ndarray, q_threshold: float) -> bool:
+    """逐窗口的原始判定：归一化 → 一阶差分 → 分位数 ≥ 0。"""
+    norm = seg / seg[0]
+    diffs = np.diff(norm)
+    return bool(np.quantile(diffs, q_threshold) >= 0)
+
+
+def _bbi_uptrend_scan(
+    b: np.ndarray,
+    lengths: np.ndarray,
+    *,
+    min_window: int,
+    max_window: int | None,
+    q_threshold: float,
+) -> np.ndarray:
+    """
+    一次扫描求出每列 BBI 的最长通过窗口（0 表示不存在）。
+
+    *b* 为 (L × K) 数组，每列的有效值已右对齐（末行为最新值），
+    *lengths* 为各列有效值个数。
+
+    窗口 w 的判定只取决于差分分位数的符号：设窗口内 m = w-1 个差分中
+    负值个数为 c，分位数落在排序后第 lo、lo+1 个差分之间。c ≤ lo 时
+    两端均非负 → 通过；c ≥ lo+2 时两端均为负 → 不通过。负值个数用
+    后缀累加一次求出全部窗口，因此绝大多数窗口 O(1) 判定。
+
+    归一化（除以正数）不改变差分符号；仅在以下情况回退到原始判定
+    :func:`_bbi_window_passes`，以保证与逐窗口 ``np.quantile`` 完全一致：
+      • 分位数恰好跨越正负分界（c = lo+1）；
+      • 窗口内存在相对量级接近机器精度的负差分（归一化后可能变为 0）；
+      • 窗口首值 ≤ 0。
+    回退只针对比已知最长通过窗口更长的窗口，按从长到短顺序求值，
+    同一长度上的各列一次向量化计算。
+    """
+    L, K = b.shape
+    longest = np.zeros(K, dtype=int)
+    w_max = min(L, max_window or L)
+    if w_max < min_window or K == 0:
+        return longest
+
+    ws = np.arange(min_window, w_max + 1)
+    m = ws - 1
+
+    d = np.diff(b, axis=0)
+    neg = d < 0
+    amb = neg & (-d <= 8 * np.finfo(float).eps * np.abs(b[:-1]))
+
+    # 后缀计数：S[j] = Σ_{i ≥ j} x[i]，末行补 0 对应 w = 1（无差分）
+    def _suffix(x: np.ndarray) -> np.ndarray:
+        out = np.zeros((L, K), dtype=int)
+        out[:-1] = np.cumsum(x[::-1], axis=0)[::-1]
+        return out
+
+    rows = L - ws
+    cnt = _suffix(neg)[rows]
+    amb_cnt = _suffix(amb)[rows]
+    b0 = b[rows]
+
+    h = q_threshold * np.maximum(m - 1, 0)
+    lo_low = np.maximum(np.floor(h - 1e-9), 0)[:, None]
+    lo_high = np.minimum(np.floor(h + 1e-9), np.maximum(m - 1, 0))[:, None]
+
+    valid = ws[:, None] <= lengths[None, :]
+    undecidable = (m[:, None] == 0) | (amb_cnt > 0) | ~(b0 > 0)
+    hi = np.minimum(lo_high + 2, m[:, None])       # 上端下标被截断到 m-1 时取 m
+    state = np.where(cnt <= lo_low, 1, np.where(cnt >= hi, 0, -1))
+    state = np.where(undecidable, -1, state)
+    state = np.where(valid, state, 0)
+
+    # 最长的确定通过窗口
+    passed = state == 1
+    has_pass = passed.any(axis=0)
+    best_idx = np.where(has_pass, len(ws) - 1 - np.argmax(passed[::-1], axis=0), -1)
+    longest = np.where(has_pass, ws[np.maximum(best_idx, 0)], 0)
+
+    # 仅对“比最长通过窗口更长”的待定窗口回退到原始判定：
+    # 按窗口长度从长到短，每个长度上对尚未找到通过窗口的列整体求分位数
+    pending = (state == -1) & (np.arange(len(ws))[:, None] > best_idx[None, :])
+    resolved = np.zeros(K, dtype=bool)
+    for i in np.flatnonzero(pending.any(axis=1))[::-1]:
+        cols = np.flatnonzero(pending[i] & ~resolved)
+        if len(cols) == 0:
+            continue
+        w = ws[i]
+        seg = b[L - w:, cols]
+        if w < 2:
+            passed = np.array([_bbi_window_passes(seg[:, j], q_threshold) for j in range(len(cols))])
+        else:
+            diffs = np.diff(seg / seg[0], axis=0)
+            passed = np.quantile(diffs, q_threshold, axis=0) >= 0
+        longest[cols[passed]] = w
+        resolved[cols[passed]] = True
+    return longest
+
+
+def bbi_uptrend_window(
+    bbi: pd.Series,
+    *,
+    min_window: int,
+    max_window: int | None = None,
+    q_threshold: float = 0.0,
+) -> int | None:
+    """
+    返回 BBI 满足“整体上升”的最长窗口长度；不存在时返回 None。
+
+    判定规则见 :func:`bbi_deriv_uptrend`，所有窗口长度在一次扫描中求出。
+    """
+    if not 0.0 <= q_threshold <= 1.0:
+        raise ValueError("q_threshold 必须位于 [0, 1] 区间内")
+
+    values = bbi.dropna().to_numpy(dtype=float)
+    if len(values) < min_window:
+        return None
+
+    longest = _bbi_uptrend_scan(
+        values[:, None],
+        np.array([len(values)]),
+        min_window=min_window,
+        max_window=max_window,
+        q_threshold=q_threshold,
+    )
+    return int(longest[0]) or None
+
+
+def bbi_uptrend_window_batch(
+    bbi: np.ndarray,
+    *,
+    min_window: int,
+    max_window: int | None = None,
+    q_threshold: float = 0.0,
+) -> np.ndarray:
+    """
+    :func:`bbi_uptrend_window` 的批量版本。
+
+    *bbi* 为 (bars × stocks) 数组，每列按时间升序，NaN 视为缺失（等价于
+    ``dropna``）。返回每列最长通过窗口，0 表示不存在。
+    """
+    if not 0.0 <= q_threshold <= 1.0:
+        raise ValueError("q_threshold 必须位于 [0, 1] 区间内")
+
+    bbi = np.asarray(bbi, dtype=float)
+    valid = ~np.isnan(bbi)
+    # 稳定排序把 NaN 挪到列首，有效值保持原顺序右对齐
+    order = np.argsort(valid, axis=0, kind="stable")
+    packed = np.take_along_axis(bbi, order, axis=0)
+    lengths = valid.sum(axis=0)
+
+    longest = _bbi_uptrend_scan(
+        packed,
+        lengths,
+        min_window=min_window,
+        max_window=max_window,
+        q_threshold=q_threshold,
+    )
+    return np.where(lengths >= min_window, longest, 0)
+
+
 def bbi_deriv_uptrend(
     bbi: pd.Series,
     *,
@@ -75,6 +295,9 @@ def bbi_deriv_uptrend(
     **最长** 满足条件的窗口即可返回 True。q_threshold=0 时退化为
     “全程单调不降”（旧版行为）。
 
+    全部窗口长度的判定由 :func:`bbi_uptrend_window` 一次扫描完成，
+    需要具体窗口长度时直接调用该函数。
+
     Parameters
     ----------
     bbi : pd.Series
@@ -86,23 +309,178 @@ def bbi_deriv_uptrend(
     q_threshold : float, default 0.0
         允许一阶差分为负的比例（0 ≤ q_threshold ≤ 1）。
     """
-    if not 0.0 <= q_threshold <= 1.0:
-        raise ValueError("q_threshold 必须位于 [0, 1] 区间内")
+    return bbi_uptrend_window(
+        bbi,
+        min_window=min_window,
+        max_window=max_window,
+        q_threshold=q_threshold,
+    ) is not None
+
+
+# --------------------------- as-of 切片 --------------------------- #
+
+def asof_bounds(df: pd.DataFrame, date, n: Optional[int] = None) -> Optional[tuple[int, int]]:
+    """
+    截至 *date*（含）最近 *n* 根 K 线在 *df* 中的行号区间 ``[start, end)``。
+
+    要求 ``date`` 列为按升序排列的 datetime64；此时二分查找定位，不扫描其余行。
+    不满足时返回 None，由调用方回退到布尔过滤。
+    """
+    dates = df["date"].to_numpy()
+    if dates.dtype.kind != "M":
+        return None
+    if not df.attrs.get("date_sorted") and not (dates[1:] >= dates[:-1]).all():
+        return None
+    end = int(np.searchsorted(dates, pd.Timestamp(date).to_datetime64(), side="right"))
+    start = 0 if n is None else max(0, end - n)
+    return start, end
 
-    bbi = bbi.dropna()
-    if len(bbi) < min_window:
-        return False
 
-    longest = min(len(bbi), max_window or len(bbi))
+def asof_tail(df: pd.DataFrame, date, n: Optional[int] = None) -> pd.DataFrame:
+    """
+    等价于 ``df[df["date"] <= date].tail(n)``（*n* 为 None 时不截取）。
+
+    日期有序时返回 ``iloc`` 切片视图，不复制数据；调用方不得原地修改。
+    """
+    bounds = asof_bounds(df, date, n)
+    if bounds is not None:
+        return df.iloc[bounds[0] : bounds[1]]
+    hist = df[df["date"] <= date]
+    return hist if n is None else hist.tail(n)
 
-    # 自最长窗口向下搜索，找到任一满足条件的区间即通过
-    for w in range(longest, min_window - 1, -1):
-        seg = bbi.iloc[-w:]                # 区间 [T-w+1, T]
-        norm = seg / seg.iloc[0]           # 归一化
-        diffs = np.diff(norm.values)       # 一阶差分
-        if np.quantile(diffs, q_threshold) >= 0:
-            return True
-    return False
+
+# --------------------------- 指标缓存 --------------------------- #
+
+class IndicatorCache:
+    """
+    单次运行内供所有 Selector 共享的指标缓存。
+
+    键为 ``(code, indicator, params, 数据指纹, 切片起始日期)``。BBI / KDJ /
+    DIF / RSV 都是因果指标：起点相同的切片，较短者的结果恰为较长者的前缀。
+    因此每个键只保存已计算过的最长区间，行标签与请求一致的更短切片直接取前缀，无需重算。
+    KDJ / DIF 等递推指标依赖起算点，起点不同的切片结果不同，不能互相复用；
+    缓存命中与否都不改变计算结果。
+
+    超出 *max_bytes* 时按 LRU 淘汰。缓存的 Series / DataFrame 为共享对象，
+    调用方只读、不得原地修改。
+    """
+
+    def __init__(self, max_bytes: int = 256 * 1024 ** 2) -> None:
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: "OrderedDict[tuple, Any]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @staticmethod
+    def _sizeof(value: Any) -> int:
+        usage = value.memory_usage(index=True, deep=False)
+        return int(usage.sum()) if isinstance(usage, pd.Series) else int(usage)
+
+    def get(
+        self,
+        key: tuple,
+        hist: pd.DataFrame,
+        compute: Callable[[pd.DataFrame], Any],
+    ) -> Any:
+        n = len(hist)
+        cached = self._entries.get(key)
+        if cached is not None and len(cached) >= n and cached.index[:n].equals(hist.index):
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return cached if len(cached) == n else cached.iloc[:n]
+
+        self.misses += 1
+        value = compute(hist)
+        if cached is not None:
+            self.nbytes -= self._sizeof(cached)
+            del self._entries[key]
+        size = self._sizeof(value)
+        if size <= self.max_bytes:
+            self._entries[key] = value
+            self.nbytes += size
+            while self.nbytes > self.max_bytes:
+                _, old = self._entries.popitem(last=False)
+                self.nbytes -= self._sizeof(old)
+                self.evictions += 1
+        return value
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "entries": len(self._entries),
+            "bytes": self.nbytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+_indicator_cache: Optional[IndicatorCache] = None
+
+
+@contextmanager
+def use_indicator_cache(cache: Optional[IndicatorCache]) -> Iterator[Optional[IndicatorCache]]:
+    """在 ``with`` 块内让所有 Selector 的指标计算经过 *cache*。"""
+    global _indicator_cache
+    prev, _indicator_cache = _indicator_cache, cache
+    try:
+        yield cache
+    finally:
+        _indicator_cache = prev
+
+
+# 持久化峰值索引（见 peak_index.py），供 PeakKDJSelector 复用全历史峰值检测结果
+_peak_store: Optional[PeakIndexStore] = None
+
+
+@contextmanager
+def use_peak_index(store: Optional[PeakIndexStore]) -> Iterator[Optional[PeakIndexStore]]:
+    """在 ``with`` 块内让 PeakKDJSelector 从 *store* 读取 / 续算峰值索引。"""
+    global _peak_store
+    prev, _peak_store = _peak_store, store
+    try:
+        yield store
+    finally:
+        _peak_store = prev
+
+
+def frame_fingerprint(df: pd.DataFrame) -> str:
+    """行情数据的内容指纹（日期 + OHLCV），用于区分同一代码的不同数据版本。"""
+    h = hashlib.blake2b(digest_size=16)
+    h.update(df["date"].to_numpy(dtype="datetime64[ns]").tobytes())
+    for col in ("open", "close", "high", "low", "volume"):
+        if col in df.columns:
+            h.update(np.ascontiguousarray(df[col].to_numpy(dtype=float)).tobytes())
+    return h.hexdigest()
+
+
+def tag_frame(df: pd.DataFrame, code: str) -> pd.DataFrame:
+    """为行情表写入 code、数据指纹与日期是否有序，其切片会经由 ``attrs`` 继承。"""
+    df.attrs["code"] = code
+    df.attrs["fingerprint"] = frame_fingerprint(df)
+    dates = df["date"].to_numpy()
+    df.attrs["date_sorted"] = bool(dates.dtype.kind == "M" and (dates[1:] >= dates[:-1]).all())
+    return df
+
+
+def _indicator(hist: pd.DataFrame, name: str, fn: Callable[..., Any], **params: Any) -> Any:
+    """计算（或从当前缓存读取）*hist* 上的指标 ``fn(hist, **params)``。"""
+    cache = _indicator_cache
+    code = hist.attrs.get("code")
+    fingerprint = hist.attrs.get("fingerprint")
+    if cache is None or code is None or fingerprint is None or hist.empty:
+        return fn(hist, **params)
+
+    key = (code, name, tuple(sorted(params.items())), fingerprint, hist["date"].iloc[0])
+    return cache.get(key, hist, lambda h: fn(h, **params))
+
+
+def _kdj_columns(df: pd.DataFrame, n: int = 9) -> pd.DataFrame:
+    return compute_kdj(df, n)[["K", "D", "J"]]
 
 
 def _find_peaks(
@@ -143,8 +521,166 @@ def _find_peaks(
     return peaks_df
 
 
+# --------------------------- 批量（面板）指标 --------------------------- #
+# 输入均为 (bars × stocks) 的右对齐窗口（见 panel.PanelWindow），列首 NaN 为填充。
+# 各函数与对应的单股票版本逐位一致。DataFrame.rolling / ewm 对宽表逐列调用，
+# 列数上万时解释器开销占主导，因此这里把全部列展平后一次性交给 pandas 的
+# 一维实现（滚动窗口不跨列），或按行递推、整行向量化。
+
+class _ColumnWindowIndexer(BaseIndexer):
+    """展平后（按列首尾相接）的定长滚动窗口，窗口起点不越过所在列的第一行。"""
+
+    def get_window_bounds(self, num_values=0, min_periods=None, center=None, closed=None, step=None):
+        i = np.arange(num_values, dtype=np.int64)
+        start = np.maximum(i - self.window_size + 1, i - i % self.column_length)
+        return start, i + 1
+
+
+def _rolling_columns(x: np.ndarray, window: int, how: str, min_periods: int) -> np.ndarray:
+    """逐列 ``Series.rolling(window, min_periods).<how>()``，一次调用完成。"""
+    L, K = x.shape
+    if L == 0 or K == 0:
+        return np.full_like(x, np.nan, dtype=float)
+    flat = pd.Series(np.ascontiguousarray(x.T, dtype=float).ravel())
+    indexer = _ColumnWindowIndexer(window_size=window, column_length=L)
+    out = getattr(flat.rolling(indexer, min_periods=min_periods), how)()
+    return out.to_numpy().reshape(K, L).T
+
+
+def _ewm_columns(x: np.ndarray, span: int) -> np.ndarray:
+    """
+    逐列 ``Series.ewm(span=span, adjust=False).mean()``。
+
+    按 pandas 的递推逐步复现（含 NaN 处理与 ``(old·w + α·x) / (old + α)``
+    的归一化写法），每步对整行向量化，结果逐位一致。
+    """
+    alpha = 1.0 / (1.0 + (span - 1) / 2.0)
+    factor = 1.0 - alpha
+    out = np.empty_like(x, dtype=float)
+    if len(x) == 0:
+        return out
+
+    weighted = x[0].astype(float)
+    old_wt = np.ones(x.shape[1])
+    out[0] = weighted
+    for i in range(1, len(x)):
+        cur = x[i]
+        obs = cur == cur
+        has = weighted == weighted
+        old_wt = np.where(has, old_wt * factor, old_wt)
+        with np.errstate(invalid="ignore"):
+            blended = (old_wt * weighted + alpha * cur) / (old_wt + alpha)
+        weighted = np.where(has & obs & (weighted != cur), blended, weighted)
+        old_wt = np.where(has & obs, 1.0, old_wt)
+        weighted = np.where(~has & obs, cur, weighted)
+        out[i] = weighted
+    return out
+
+
+def _bbi_batch(close: np.ndarray) -> np.ndarray:
+    ma3, ma6, ma12, ma24 = (_rolling_columns(close, w, "mean", w) for w in (3, 6, 12, 24))
+    return (ma3 + ma6 + ma12 + ma24) / 4
+
+
+def _rsv_batch(low: np.ndarray, close: np.ndarray, n: int) -> np.ndarray:
+    low_n = _rolling_columns(low, n, "min", 1)
+    high_close_n = _rolling_columns(close, n, "max", 1)
+    return (close - low_n) / (high_close_n - low_n + 1e-9) * 100.0
+
+
+def _dif_batch(close: np.ndarray, fast: int = 12, slow: int = 26) -> np.ndarray:
+    return _ewm_columns(close, fast) - _ewm_columns(close, slow)
+
+
+def _quantile_batch(x: np.ndarray, q: float) -> np.ndarray:
+    """
+    逐列 ``Series.dropna().quantile(q)``；全 NaN 列返回 NaN。
+
+    有效值恰为末尾连续 m 行的列按 m 分组，整块交给 ``np.percentile``；
+    其余（中间夹有 NaN）的列才逐列处理。
+    """
+    L, K = x.shape
+    out = np.full(K, np.nan)
+    valid = ~np.isnan(x)
+    n = valid.sum(axis=0)
+    dense = (valid == (np.arange(L)[:, None] >= (L - n)[None, :])).all(axis=0)
+
+    for m in np.unique(n[dense & (n > 0)]):
+        cols = np.flatnonzero(dense & (n == m))
+        out[cols] = np.percentile(x[L - m :, cols], q * 100.0, axis=0)
+    for k in np.flatnonzero(~dense & (n > 0)):
+        out[k] = np.percentile(x[valid[:, k], k], q * 100.0)
+    return out
+
+
+def _j_filter_batch(J: np.ndarray, tail: int, j_threshold: float, j_q_threshold: float) -> np.ndarray:
+    """J < j_threshold 或 J ≤ 最近 *tail* 根 J 的 j_q_threshold 分位；窗口为空时不通过。"""
+    j_window = J[-tail:]
+    j_today = J[-1]
+    j_quantile = _quantile_batch(j_window, j_q_threshold)
+    nonempty = (~np.isnan(j_window)).any(axis=0)
+    return nonempty & ((j_today < j_threshold) | (j_today <= j_quantile))
+
+
+def _price_range_ok(close: np.ndarray, pct: float) -> np.ndarray:
+    """收盘价波动幅度 high/low-1 ≤ pct（与 ``low <= 0 or ... > pct`` 取反一致）。"""
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        high, low = np.nanmax(close, axis=0), np.nanmin(close, axis=0)
+    return ~((low <= 0) | (high / low - 1 > pct))
+
+
+# select_dates() 每批处理的窗口单元数上限（行 × 列），控制中间数组的内存占用
+_SCAN_CELLS = 4_000_000
+
+
+class _PanelSelectorMixin:
+    """
+    面板批量选股入口。子类提供：
+
+    * ``_panel_window()`` —— ``select()`` 中每只股票截取的 K 线根数；
+    * ``_passes_batch(win)`` —— 对 :class:`panel.PanelWindow` 的每一列给出
+      与 ``_passes_filters`` 相同的判定。
+    """
+
+    def select_panel(self, date: pd.Timestamp, panel: Panel) -> List[str]:
+        win = panel.window(date, self._panel_window())
+        ok = self._passes_batch(win)
+        return [panel.codes[c] for c in win.columns[ok]]
+
+    def select_dates(
+        self,
+        start: pd.Timestamp,
+        end: pd.Timestamp,
+        data: Dict[str, pd.DataFrame] | Panel,
+    ) -> pd.DataFrame:
+        """
+        逐日选股：返回 [start, end] 内每个交易日 × 每只股票的布尔矩阵，
+        第 d 行与 ``select(d, data)`` 的结果一致。
+
+        数据只对齐一次；各日期的 as-of 窗口整体拼成 (L × 日期·股票) 数组，
+        分批交给 ``_passes_batch`` 判定，省去的是逐日过滤 DataFrame 与逐股票调用的开销。
+        指标仍在每个窗口上各算一次，计算量与逐日调用 ``select_panel`` 相同：
+        KDJ / DIF 为递推指标，结果取决于窗口起点，在全历史上只算一遍会改变窗口开头
+        预热段的取值，进而改变选股结果（见 :class:`IndicatorCache`）。
+        """
+        panel = data if isinstance(data, Panel) else Panel.from_frames(data)
+        cal = panel.dates
+        dates = cal[(cal >= pd.Timestamp(start)) & (cal <= pd.Timestamp(end))]
+        K = len(panel.codes)
+        L = self._panel_window()
+
+        signals = np.zeros((len(dates), K), dtype=bool)
+        step = max(1, _SCAN_CELLS // max(L * K, 1))
+        for i in range(0, len(dates), step):
+            chunk = dates[i : i + step]
+            win = panel.windows(chunk, L)
+            signals[i : i + len(chunk)] = self._passes_batch(win).reshape(len(chunk), K)
+        return pd.DataFrame(signals, index=dates, columns=panel.codes)
+
+
 # --------------------------- Selector 类 --------------------------- #
-class BBIKDJSelector:
+class BBIKDJSelector(_PanelSelectorMixin):
     """
     自适应 *BBI(导数)* + *KDJ* 选股器
         • BBI: 允许 bbi_q_threshold 比例的回撤
@@ -171,8 +707,7 @@ class BBIKDJSelector:
 
     # ---------- 单支股票过滤 ---------- #
     def _passes_filters(self, hist: pd.DataFrame) -> bool:
-        hist = hist.copy()
-        hist["BBI"] = compute_bbi(hist)
+        bbi = _indicator(hist, "bbi", compute_bbi)
 
         # 0. 收盘价波动幅度约束（最近 max_window 根 K 线）
         win = hist.tail(self.max_window)
@@ -182,7 +717,7 @@ class BBIKDJSelector:
 
         # 1. BBI 上升（允许部分回撤）
         if not bbi_deriv_uptrend(
-            hist["BBI"],
+            bbi,
             min_window=self.bbi_min_window,
             max_window=self.max_window,
             q_threshold=self.bbi_q_threshold,
@@ -190,7 +725,7 @@ class BBIKDJSelector:
             return False
 
         # 2. KDJ 过滤 —— 双重条件
-        kdj = compute_kdj(hist)
+        kdj = _indicator(hist, "kdj", _kdj_columns)
         j_today = float(kdj.iloc[-1]["J"])
 
         # 最近 max_window 根 K 线的 J 分位
@@ -204,8 +739,78 @@ class BBIKDJSelector:
             return False
 
         # 3. MACD：DIF > 0
-        hist["DIF"] = compute_dif(hist)
-        return hist["DIF"].iloc[-1] > 0
+        dif = _indicator(hist, "dif", compute_dif)
+        return dif.iloc[-1] > 0
+
+    # ---------- 面板批量过滤 ---------- #
+    def _panel_window(self) -> int:
+        return self.max_window + 20
+
+    def _passes_batch(self, win: PanelWindow) -> np.ndarray:
+        close = win["close"]
+        _, _, J = compute_kdj_batch(win["low"], win["high"], close)
+        hit = self._passes_at(close, _bbi_batch(close), J, _dif_batch(close), [win.rows - 1])
+        return (win.length > 0) & hit[0]
+
+    def _passes_at(
+        self,
+        close: np.ndarray,
+        bbi: np.ndarray,
+        J: np.ndarray,
+        dif: np.ndarray,
+        ends: List[int] | np.ndarray,
+    ) -> np.ndarray:
+        """
+        在同一组指标序列 (bars × stocks) 上，判定“截止到第 p 行”的 BBIKDJ 条件，
+        p 取遍 *ends*；返回 (len(ends) × stocks) 布尔矩阵。
+
+        指标均为因果计算，前缀上的指标等于整段指标的前缀，因此第 p 行的结果与
+        对 ``hist.iloc[:p+1]`` 调用 :meth:`_passes_filters` 完全一致。
+        各截止行的尾部窗口横向拼接后一次判定。
+        """
+        if not 0.0 <= self.bbi_q_threshold <= 1.0:
+            raise ValueError("q_threshold 必须位于 [0, 1] 区间内")
+
+        W = self.max_window
+        L, K = close.shape
+        ends = np.asarray(ends, dtype=int)
+        P = len(ends)
+
+        # 每个截止行的最近 W 行，拼成 (W × P·K)；越过序列起点处为 NaN
+        rows = ends[:, None] - W + 1 + np.arange(W)[None, :]          # (P, W)
+
+        def _tails(x: np.ndarray) -> np.ndarray:
+            t = np.where((rows >= 0)[:, :, None], x[np.maximum(rows, 0)], np.nan)
+            return t.transpose(1, 0, 2).reshape(W, P * K)
+
+        # 0. 收盘价波动幅度
+        ok = _price_range_ok(_tails(close), self.price_range_pct)
+
+        # 1. BBI 上升：与 dropna 语义一致，先把各列有效值压紧（右对齐）再取尾部
+        valid = ~np.isnan(bbi)
+        n_valid = valid.sum(axis=0)
+        packed = np.take_along_axis(bbi, np.argsort(valid, axis=0, kind="stable"), axis=0)
+        cnt = np.cumsum(valid, axis=0)[ends]                           # (P, K) 前缀内有效值个数
+        last = (L - n_valid)[None, :] + cnt - 1                        # 前缀末个有效值在 packed 中的行
+        prow = last[:, :, None] - W + 1 + np.arange(W)                 # (P, K, W)
+        inside = prow >= (L - n_valid)[None, :, None]
+        b = np.where(inside, packed[np.maximum(prow, 0), np.arange(K)[None, :, None]], np.nan)
+        b = b.reshape(P * K, W).T
+        longest = _bbi_uptrend_scan(
+            b,
+            np.minimum(cnt, W).ravel(),
+            min_window=self.bbi_min_window,
+            max_window=W,
+            q_threshold=self.bbi_q_threshold,
+        )
+        ok &= (longest > 0) & (cnt.ravel() >= self.bbi_min_window)
+
+        # 2. KDJ 过滤 —— 双重条件
+        ok &= _j_filter_batch(_tails(J), W, self.j_threshold, self.j_q_threshold)
+
+        # 3. MACD：DIF > 0
+        ok &= (dif[ends] > 0).ravel()
+        return ok.reshape(P, K)
 
     # ---------- 多股票批量 ---------- #
     def select(
@@ -213,17 +818,16 @@ class BBIKDJSelector:
     ) -> List[str]:
         picks: List[str] = []
         for code, df in data.items():
-            hist = df[df["date"] <= date]
+            # 额外预留 20 根 K 线缓冲
+            hist = asof_tail(df, date, self.max_window + 20)
             if hist.empty:
                 continue
-            # 额外预留 20 根 K 线缓冲
-            hist = hist.tail(self.max_window + 20)
             if self._passes_filters(hist):
                 picks.append(code)
         return picks
     
     
-class SuperB1Selector:
+class SuperB1Selector(_PanelSelectorMixin):
     """SuperB1 选股器
 
     过滤逻辑概览
@@ -289,25 +893,13 @@ class SuperB1Selector:
             return False
 
         # ---------- Step-1: 搜索满足 BBIKDJ 的 t_m ----------
-        lb_hist = hist.tail(self.lookback_n + 1)  # +1 以排除自身
-        tm_idx: int | None = None
-        # 遍历回溯窗口
-        for idx in lb_hist.index[:-1]:            
-            if self.bbi_selector._passes_filters(hist.loc[:idx]):
-                tm_idx = idx
-                stable_seg = hist.loc[tm_idx : hist.index[-2], "close"]
-                if len(stable_seg) < 3:
-                    tm_idx = None
-                    break
-                high, low = stable_seg.max(), stable_seg.min()
-                if low <= 0 or (high / low - 1) > self.close_vol_pct:                                      
-                    tm_idx = None
-                    continue
-                else:
-                    break
-        if tm_idx is None:            
-            return False        
-        
+        close = hist["close"].to_numpy(dtype=float)[:, None]
+        kdj = _indicator(hist, "kdj", _kdj_columns)
+        bbi = _indicator(hist, "bbi", compute_bbi).to_numpy(dtype=float)[:, None]
+        dif = _indicator(hist, "dif", compute_dif).to_numpy(dtype=float)[:, None]
+        J = kdj["J"].to_numpy(dtype=float)[:, None]
+        if not self._find_tm(close, bbi, J, dif)[0]:
+            return False
 
         # ---------- Step-3: 当日相对前一日跌幅 ----------
         close_today, close_prev = hist["close"].iloc[-1], hist["close"].iloc[-2]
@@ -315,7 +907,6 @@ class SuperB1Selector:
             return False
 
         # ---------- Step-4: J 值极低 ----------
-        kdj = compute_kdj(hist)
         j_today = float(kdj["J"].iloc[-1])
         j_window = kdj["J"].iloc[-self.lookback_n:].dropna()
         j_q_val = float(j_window.quantile(self.j_q_threshold)) if not j_window.empty else np.nan
@@ -324,13 +915,63 @@ class SuperB1Selector:
 
         return True
 
+    def _find_tm(
+        self, close: np.ndarray, bbi: np.ndarray, J: np.ndarray, dif: np.ndarray
+    ) -> np.ndarray:
+        """
+        回溯窗口内是否存在 t_m：当日满足 BBIKDJ，且 ``[t_m, date-1]`` 至少 3 根、
+        收盘价波动率不超过 ``close_vol_pct``。
+
+        原逐日搜索在首个满足 BBIKDJ 但盘整区间不足 3 根的日子终止；由于区间长度
+        随 t_m 后移单调递减，这等价于只在区间 ≥ 3 根的日子中找任一同时满足两项的日子。
+        所有候选日的 BBIKDJ 判定共用同一组指标序列（见 :meth:`BBIKDJSelector._passes_at`），
+        区间高低点由后缀最值一次求出。
+        """
+        L = close.shape[0]
+        ends = np.arange(L - self.lookback_n - 1, L - 3)          # 区间 [p, L-2] ≥ 3 根
+        if len(ends) == 0:
+            return np.zeros(close.shape[1], dtype=bool)
+
+        hit = self.bbi_selector._passes_at(close, bbi, J, dif, ends)
+
+        prior = close[: L - 1][::-1]
+        seg_high = np.fmax.accumulate(prior, axis=0)[::-1][ends]
+        seg_low = np.fmin.accumulate(prior, axis=0)[::-1][ends]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            stable = ~((seg_low <= 0) | (seg_high / seg_low - 1 > self.close_vol_pct))
+        return (hit & stable).any(axis=0)
+
+    # 面板批量过滤
+    def _panel_window(self) -> int:
+        return self.lookback_n + self._extra_for_bbi
+
+    def _passes_batch(self, win: PanelWindow) -> np.ndarray:
+        L = win.rows
+        ok = win.count >= L                       # 与 select() 的 min_len 要求一致
+        sub = win.take(ok)
+        close = sub["close"]
+
+        # Step-1: 回溯窗口内的 t_m
+        _, _, J = compute_kdj_batch(sub["low"], sub["high"], close)
+        found = self._find_tm(close, _bbi_batch(close), J, _dif_batch(close))
+
+        # Step-3: 当日相对前一日跌幅
+        close_today, close_prev = close[-1], close[-2]
+        found &= ~((close_prev <= 0) | ((close_prev - close_today) / close_prev < self.price_drop_pct))
+
+        # Step-4: J 值极低
+        found &= _j_filter_batch(J, self.lookback_n, self.j_threshold, self.j_q_threshold)
+
+        ok[ok] = found
+        return ok
+
     # 批量选股接口
     def select(self, date: pd.Timestamp, data: Dict[str, pd.DataFrame]) -> List[str]:        
         picks: List[str] = []
         min_len = self.lookback_n + self._extra_for_bbi
 
         for code, df in data.items():
-            hist = df[df["date"] <= date].tail(min_len)
+            hist = asof_tail(df, date, min_len)
             if len(hist) < min_len:
                 continue
             if self._passes_filters(hist):
@@ -339,7 +980,7 @@ class SuperB1Selector:
         return picks
 
 
-class PeakKDJSelector:
+class PeakKDJSelector(_PanelSelectorMixin):
     """
     Peaks + KDJ 选股器    
     """
@@ -359,71 +1000,34 @@ class PeakKDJSelector:
         self.j_q_threshold = j_q_threshold
 
     # ---------- 单支股票过滤 ---------- #
-        # ---------- 单支股票过滤 ---------- #
-    def _passes_filters(self, hist: pd.DataFrame) -> bool:
+    def _passes_filters(self, hist: pd.DataFrame, target_close: Optional[float] = None) -> bool:
+        """
+        *target_close* 为 peak_(t-n) 的收盘价；由调用方从全历史峰值索引查得时传入，
+        否则在 *hist* 上现场检测峰值。
+        """
         if hist.empty:
             return False
 
-        hist = hist.copy().sort_values("date")
-        hist["oc_max"] = hist[["open", "close"]].max(axis=1)
-
-        # 1. 提取 peaks
-        peaks_df = _find_peaks(
-            hist,
-            column="oc_max",
-            distance=6,
-            prominence=0.5,
-        )
-        
-        # 至少两个峰      
-        date_today = hist.iloc[-1]["date"]
-        peaks_df = peaks_df[peaks_df["date"] < date_today]
-        if len(peaks_df) < 2:               
-            return False
+        if not hist["date"].is_monotonic_increasing:
+            hist = hist.sort_values("date")
 
-        peak_t = peaks_df.iloc[-1]          # 最新一个峰
-        peaks_list = peaks_df.reset_index(drop=True)
-        oc_t = peak_t.oc_max
-        total_peaks = len(peaks_list)
-
-        # 2. 回溯寻找 peak_(t-n)
-        target_peak = None        
-        for idx in range(total_peaks - 2, -1, -1):
-            peak_prev = peaks_list.loc[idx]
-            oc_prev = peak_prev.oc_max
-            if oc_t <= oc_prev:             # 要求 peak_t > peak_(t-n)
-                continue
-
-            # 只有当“总峰数 ≥ 3”时才检查区间内其他峰 oc_max
-            if total_peaks >= 3 and idx < total_peaks - 2:
-                inter_oc = peaks_list.loc[idx + 1 : total_peaks - 2, "oc_max"]
-                if not (inter_oc < oc_prev).all():
-                    continue
-
-            # 新增： oc_prev 高于区间最低收盘价 gap_threshold
-            date_prev = peak_prev.date
-            mask = (hist["date"] > date_prev) & (hist["date"] < peak_t.date)
-            min_close = hist.loc[mask, "close"].min()
-            if pd.isna(min_close):
-                continue                    # 区间无数据
-            if oc_prev <= min_close * (1 + self.gap_threshold):
-                continue
-
-            target_peak = peak_prev
-            
-            break
-
-        if target_peak is None:
-            return False
+        # 1~2. 峰值检测并回溯 peak_(t-n)
+        if target_close is None:
+            close = hist["close"].to_numpy(dtype=float)
+            oc_max = np.fmax(hist["open"].to_numpy(dtype=float), close)
+            pos = PeakIndex.build(oc_max).target(oc_max, close, 0, len(hist) - 1, self.gap_threshold)
+            if pos < 0:
+                return False
+            target_close = close[pos]
 
         # 3. 当日收盘价波动率
         close_today = hist.iloc[-1]["close"]
-        fluc_pct = abs(close_today - target_peak.close) / target_peak.close
+        fluc_pct = abs(close_today - target_close) / target_close
         if fluc_pct > self.fluc_threshold:
             return False
 
         # 4. KDJ 过滤
-        kdj = compute_kdj(hist)
+        kdj = _indicator(hist, "kdj", _kdj_columns)
         j_today = float(kdj.iloc[-1]["J"])
         j_window = kdj["J"].tail(self.max_window).dropna()
         if j_window.empty:
@@ -434,6 +1038,44 @@ class PeakKDJSelector:
 
         return True
 
+    # ---------- 面板批量过滤 ---------- #
+    def _panel_window(self) -> int:
+        return self.max_window + 20
+
+    def _passes_batch(self, win: PanelWindow) -> np.ndarray:
+        L = win.rows
+        close = win["close"]
+        oc_max = np.fmax(win["open"], close)
+        n = win.length
+
+        # 1~2. 峰值：来自面板时查全历史索引，否则在窗口上现场检测
+        target_close = np.full(close.shape[1], np.nan)
+        found = np.zeros(close.shape[1], dtype=bool)
+        for k in np.flatnonzero(n > 0):
+            if win.panel is not None:
+                col = int(win.columns[k])
+                index, oc_full, close_full = self._panel_peak_index(win.panel, col)
+                end = int(win.count[k]) - 1
+                pos = index.target(oc_full, close_full, end - int(n[k]) + 1, end, self.gap_threshold)
+                if pos >= 0:
+                    found[k] = True
+                    target_close[k] = close_full[pos]
+            else:
+                oc_k, close_k = oc_max[L - n[k]:, k], close[L - n[k]:, k]
+                pos = PeakIndex.build(oc_k).target(oc_k, close_k, 0, int(n[k]) - 1, self.gap_threshold)
+                if pos >= 0:
+                    found[k] = True
+                    target_close[k] = close_k[pos]
+
+        # 3. 当日收盘价波动率
+        fluc_pct = np.abs(close[-1] - target_close) / target_close
+        ok = found & ~(fluc_pct > self.fluc_threshold)
+
+        # 4. KDJ 过滤
+        _, _, J = compute_kdj_batch(win["low"], win["high"], close)
+        ok &= _j_filter_batch(J, self.max_window, self.j_threshold, self.j_q_threshold)
+        return ok
+
     # ---------- 多股票批量 ---------- #
     def select(
         self,
@@ -441,17 +1083,40 @@ class PeakKDJSelector:
         data: Dict[str, pd.DataFrame],
     ) -> List[str]:
         picks: List[str] = []
+        store = _peak_store
         for code, df in data.items():
-            hist = df[df["date"] <= date]
+            bounds = asof_bounds(df, date, self.max_window + 20)  # 额外缓冲
+            hist = df.iloc[bounds[0] : bounds[1]] if bounds else asof_tail(df, date, self.max_window + 20)
             if hist.empty:
                 continue
-            hist = hist.tail(self.max_window + 20)  # 额外缓冲
-            if self._passes_filters(hist):
+
+            # 有峰值索引且行情按日期升序时，直接在全历史索引上查 peak_(t-n)
+            if store is not None and bounds is not None:
+                end = bounds[1] - 1
+                close = df["close"].to_numpy(dtype=float)
+                oc_max = np.fmax(df["open"].to_numpy(dtype=float), close)
+                index = store.get(code, oc_max, key=df.attrs.get("fingerprint"))
+                pos = index.target(oc_max, close, end - len(hist) + 1, end, self.gap_threshold)
+                if pos >= 0 and self._passes_filters(hist, target_close=close[pos]):
+                    picks.append(code)
+            elif self._passes_filters(hist):
                 picks.append(code)
         return picks
+
+    @staticmethod
+    def _panel_peak_index(panel: Panel, col: int):
+        """面板中第 *col* 只股票的全历史峰值索引及其 oc_max / close（每个面板只取一次）。"""
+        key = ("peak_index", col)
+        if key not in panel.cache:
+            close = panel.series(col, "close")
+            oc_max = np.fmax(panel.series(col, "open"), close)
+            store = _peak_store
+            index = store.get(panel.codes[col], oc_max) if store is not None else PeakIndex.build(oc_max)
+            panel.cache[key] = (index, oc_max, close)
+        return panel.cache[key]
     
 
-class BBIShortLongSelector:
+class BBIShortLongSelector(_PanelSelectorMixin):
     """
     BBI 上升 + 短/长期 RSV 条件 + DIF > 0 选股器
     """
@@ -475,12 +1140,11 @@ class BBIShortLongSelector:
 
     # ---------- 单支股票过滤 ---------- #
     def _passes_filters(self, hist: pd.DataFrame) -> bool:
-        hist = hist.copy()
-        hist["BBI"] = compute_bbi(hist)
+        bbi = _indicator(hist, "bbi", compute_bbi)
 
         # 1. BBI 上升（允许部分回撤）
         if not bbi_deriv_uptrend(
-            hist["BBI"],
+            bbi,
             min_window=self.bbi_min_window,
             max_window=self.max_window,
             q_threshold=self.bbi_q_threshold,
@@ -488,16 +1152,15 @@ class BBIShortLongSelector:
             return False
 
         # 2. 计算短/长期 RSV -----------------
-        hist["RSV_short"] = compute_rsv(hist, self.n_short)
-        hist["RSV_long"] = compute_rsv(hist, self.n_long)
+        rsv_short = _indicator(hist, "rsv", compute_rsv, n=self.n_short)
+        rsv_long = _indicator(hist, "rsv", compute_rsv, n=self.n_long)
 
         if len(hist) < self.m:
             return False                        # 数据不足
 
-        win = hist.iloc[-self.m :]              # 最近 m 天
-        long_ok = (win["RSV_long"] >= 80).all() # 长期 RSV 全 ≥ 80
+        long_ok = (rsv_long.iloc[-self.m :] >= 80).all()  # 最近 m 天长期 RSV 全 ≥ 80
 
-        short_series = win["RSV_short"]
+        short_series = rsv_short.iloc[-self.m :]
         short_start_end_ok = (
             short_series.iloc[0] >= 80 and short_series.iloc[-1] >= 80
         )
@@ -507,8 +1170,32 @@ class BBIShortLongSelector:
             return False
 
         # 3. MACD：DIF > 0 -------------------
-        hist["DIF"] = compute_dif(hist)
-        return hist["DIF"].iloc[-1] > 0
+        dif = _indicator(hist, "dif", compute_dif)
+        return dif.iloc[-1] > 0
+
+    # ---------- 面板批量过滤 ---------- #
+    def _panel_window(self) -> int:
+        need_len = max(self.n_short, self.n_long) + self.bbi_min_window + self.m
+        return max(need_len, self.max_window)
+
+    def _passes_batch(self, win: PanelWindow) -> np.ndarray:
+        close, low, m = win["close"], win["low"], self.m
+        ok = win.length >= max(m, 1)
+        ok &= bbi_uptrend_window_batch(
+            _bbi_batch(close),
+            min_window=self.bbi_min_window,
+            max_window=self.max_window,
+            q_threshold=self.bbi_q_threshold,
+        ) > 0
+
+        rsv_short = _rsv_batch(low, close, self.n_short)[-m:]
+        rsv_long = _rsv_batch(low, close, self.n_long)[-m:]
+        ok &= (rsv_long >= 80).all(axis=0)
+        ok &= (rsv_short[0] >= 80) & (rsv_short[-1] >= 80)
+        ok &= (rsv_short < 20).any(axis=0)
+
+        ok &= _dif_batch(close)[-1] > 0
+        return ok
 
     # ---------- 多股票批量 ---------- #
     def select(
@@ -517,23 +1204,22 @@ class BBIShortLongSelector:
         data: Dict[str, pd.DataFrame],
     ) -> List[str]:
         picks: List[str] = []
+        # 预留足够长度：RSV 计算窗口 + BBI 检测窗口 + m
+        need_len = (
+            max(self.n_short, self.n_long)
+            + self.bbi_min_window
+            + self.m
+        )
         for code, df in data.items():
-            hist = df[df["date"] <= date]
+            hist = asof_tail(df, date, max(need_len, self.max_window))
             if hist.empty:
                 continue
-            # 预留足够长度：RSV 计算窗口 + BBI 检测窗口 + m
-            need_len = (
-                max(self.n_short, self.n_long)
-                + self.bbi_min_window
-                + self.m
-            )
-            hist = hist.tail(max(need_len, self.max_window))
             if self._passes_filters(hist):
                 picks.append(code)
         return picks
 
 
-class BreakoutVolumeKDJSelector:
+class BreakoutVolumeKDJSelector(_PanelSelectorMixin):
     """
     放量突破 + KDJ + DIF>0 + 收盘价波动幅度 选股器   
     """
@@ -561,7 +1247,7 @@ class BreakoutVolumeKDJSelector:
         if len(hist) < self.offset + 2:
             return False
 
-        hist = hist.tail(self.max_window).copy()
+        hist = hist.tail(self.max_window)
 
         # ---- 收盘价波动幅度约束 ----
         high, low = hist["close"].max(), hist["close"].min()
@@ -569,14 +1255,13 @@ class BreakoutVolumeKDJSelector:
             return False
 
         # ---- 技术指标 ----
-        hist = compute_kdj(hist)
-        hist["pct_chg"] = hist["close"].pct_change() * 100
-        hist["DIF"] = compute_dif(hist)
+        J = _indicator(hist, "kdj", _kdj_columns)["J"]
+        dif = _indicator(hist, "dif", compute_dif)
 
         # 0) 指定日约束：J < j_threshold 或位于历史分位；且 DIF > 0
-        j_today = float(hist["J"].iloc[-1])
+        j_today = float(J.iloc[-1])
 
-        j_window = hist["J"].tail(self.max_window).dropna()
+        j_window = J.tail(self.max_window).dropna()
         if j_window.empty:
             return False
         j_quantile = float(j_window.quantile(self.j_q_threshold))
@@ -584,48 +1269,111 @@ class BreakoutVolumeKDJSelector:
         # 若不满足任一 J 条件，则淘汰
         if not (j_today < self.j_threshold or j_today <= j_quantile):
             return False
-        if hist["DIF"].iloc[-1] <= 0:
+        if dif.iloc[-1] <= 0:
             return False
 
         # ---- 放量突破条件 ----
-        n = len(hist)
-        wnd_start = max(0, n - self.offset - 1)
-        last_idx = n - 1
-
-        for t_idx in range(wnd_start, last_idx):  # 探索突破日 T
-            row = hist.iloc[t_idx]
-
-            # 1) 单日涨幅
-            if row["pct_chg"] < self.up_threshold:
-                continue
-
-            # 2) 相对放量
-            vol_T = row["volume"]
-            if vol_T <= 0:
-                continue
-            vols_except_T = hist["volume"].drop(index=hist.index[t_idx])
-            if not (vols_except_T <= self.volume_threshold * vol_T).all():
-                continue
-
-            # 3) 创新高
-            if row["close"] <= hist["close"].iloc[:t_idx].max():
-                continue
-
-            # 4) T 之后 J 值维持高位
-            if not (hist["J"].iloc[t_idx:last_idx] > hist["J"].iloc[-1] - 10).all():
-                continue
-
-            return True  # 满足所有条件
+        return bool(
+            self._breakout_found(
+                hist["close"].to_numpy(dtype=float)[:, None],
+                hist["volume"].to_numpy(dtype=float)[:, None],
+                J.to_numpy(dtype=float)[:, None],
+                np.array([len(hist)]),
+            )[0]
+        )
 
-        return False
+    def _breakout_found(
+        self,
+        close: np.ndarray,
+        volume: np.ndarray,
+        J: np.ndarray,
+        length: np.ndarray,
+    ) -> np.ndarray:
+        """
+        最近 *offset* 日内是否存在放量突破日 T（数组为右对齐的 bars × stocks，
+        *length* 为各列有效行数）。对每个候选 T：
+
+        1) 单日涨幅 ≥ up_threshold；
+        2) 其余各日成交量 ≤ volume_threshold × vol_T —— 只需与“除 T 外的最大量”
+           比较：T 为最大量所在行时取次大量，否则取最大量；
+        3) 收盘价创新高 —— 与 T 之前的前缀最大值比较；
+        4) T 至昨日的 J 均高于今日 J - 10 —— 后缀判定。
+
+        全部统计量一次扫描求出，所有候选日同时判定，单只股票 O(max_window)。
+        NaN 的取舍与逐日比较写法一致（比较为 False 即视为“未触发淘汰”或“不满足”）。
+        """
+        L, K = close.shape
+        cols = np.arange(K)
+        in_window = np.arange(L)[:, None] >= (L - length)[None, :]
+
+        # 涨幅：与 pct_change 一致，先在窗口内前向填充
+        pos = np.where(~np.isnan(close), np.arange(L)[:, None], 0)
+        filled = close[np.maximum.accumulate(pos, axis=0), cols]
+        pct_chg = np.full_like(close, np.nan)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            pct_chg[1:] = (filled[1:] / filled[:-1] - 1) * 100
+        pct_chg[np.isnan(filled)] = np.nan
+
+        # 成交量：最大、次大（重复最大值时二者相等）及窗口内 NaN 个数
+        vol = np.where(in_window & ~np.isnan(volume), volume, -np.inf)
+        top_row = np.argmax(vol, axis=0)
+        top1 = vol[top_row, cols]
+        rest = vol.copy()
+        rest[top_row, cols] = -np.inf
+        top2 = rest.max(axis=0) if L > 1 else np.full(K, -np.inf)
+        vol_nan = (in_window & np.isnan(volume)).sum(axis=0)
+
+        # 收盘价前缀最大值（T 之前）
+        prior_max = np.full_like(close, np.nan)
+        prior_max[1:] = np.fmax.accumulate(close, axis=0)[:-1]
+
+        # J 后缀：rows[t : L-1] 中是否存在 J ≤ 今日 J - 10（NaN 同样视为不满足）
+        j_floor = J[-1] - 10
+        with np.errstate(invalid="ignore"):
+            j_bad = ~(J[: L - 1] > j_floor)
+        j_bad_suffix = np.logical_or.accumulate(j_bad[::-1], axis=0)[::-1]
+
+        # 候选突破日：距今 1..offset 天且在窗口内
+        rows = np.arange(max(0, L - 1 - self.offset), L - 1)
+        if len(rows) == 0:
+            return np.zeros(K, dtype=bool)
+        cand = rows[:, None] >= (L - length)[None, :]
+
+        vol_T = volume[rows]
+        others_max = np.where(rows[:, None] == top_row[None, :], top2, top1)
+        others_nan = vol_nan - np.isnan(vol_T)
+        with np.errstate(invalid="ignore"):
+            hit = cand & ~(pct_chg[rows] < self.up_threshold)
+            hit &= ~(vol_T <= 0)
+            hit &= (others_nan == 0) & (others_max <= self.volume_threshold * vol_T)
+            hit &= ~(close[rows] <= prior_max[rows])
+        hit &= ~j_bad_suffix[rows]
+        return hit.any(axis=0)
+
+    # ---------- 面板批量过滤 ---------- #
+    def _panel_window(self) -> int:
+        return self.max_window
+
+    def _passes_batch(self, win: PanelWindow) -> np.ndarray:
+        close = win["close"]
+        ok = win.count >= self.offset + 2
+        ok &= _price_range_ok(close, self.price_range_pct)
+
+        _, _, J = compute_kdj_batch(win["low"], win["high"], close)
+        ok &= _j_filter_batch(J, self.max_window, self.j_threshold, self.j_q_threshold)
+        ok &= ~(_dif_batch(close)[-1] <= 0)
+
+        return ok & self._breakout_found(close, win["volume"], J, win.length)
 
     # ---------- 多股票批量 ---------- #
     def select(
         self, date: pd.Timestamp, data: Dict[str, pd.DataFrame]
     ) -> List[str]:
         picks: List[str] = []
+        # 只需最近 max_window 根；offset+2 用于保留“历史长度不足”的判定
+        need_len = max(self.max_window, self.offset + 2)
         for code, df in data.items():
-            hist = df[df["date"] <= date]
+            hist = asof_tail(df, date, need_len)
             if hist.empty:
                 continue
             if self._passes_filters(hist):
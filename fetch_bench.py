@@ -0,0 +1,203 @@
+from __future__ import annotations
+
+import argparse
+import datetime as dt
+import json
+import logging
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict, List
+
+os.environ.setdefault("TQDM_DISABLE", "1")      # 压测时关闭进度条
+
+import pandas as pd
+
+import fetch_kline as fk
+from kline_store import STORE_FORMATS, open_store
+from rate_limit import configure_breakers, configure_limiter
+from replay_source import configure_replay
+
+# --------------------------- 抓取吞吐压测 --------------------------- #
+#
+# 以回放数据源（replay_source.py）跑完整的抓取流水线：增量准备 → 限流 → 请求 → 清洗 → 校验 → 落盘与清单。
+# 每组参数（模式 × 股票数 × 并发上限）在新目录里跑两轮：
+#   * full   —— 空目录全量下载到倒数第二个交易日；
+#   * update —— 按交易日历规划后增量追加最后一个交易日（日常更新的情形）。
+# 每轮输出吞吐（codes/s）、请求延迟分位数、重试次数、熔断状态切换与各阶段耗时（各线程合计；limiter_wait 为
+# 各请求排队等待限流名额的合计，异步模式下所有任务同时排队，数值远大于墙钟时间），
+# 可写成 JSON 供不同版本、不同参数之间比较。
+
+
+def _int_list(text: str) -> List[int]:
+    return [int(x) for x in text.split(",") if x]
+
+
+def _run_round(
+    scenario: str,
+    plan: Dict[str, Any],
+    start: str,
+    end: str,
+    store,
+    mode: str,
+    concurrency: int,
+    rate: float,
+) -> Dict[str, Any]:
+    limits = dict(fk.RATE_LIMITS["replay"], max_concurrency=concurrency)
+    if rate:
+        limits.update(rate=rate, max_rate=max(rate, limits["max_rate"]))
+    limiter = configure_limiter("replay", **limits)      # 熔断器随限流器重建，每轮从 closed 开始
+    hedge_limiter = configure_limiter("replay2", **limits)
+    replay = fk.get_replay()
+    replay.counts.clear()
+    fk.get_replay("replay2").counts.clear()
+    fk.TIMINGS.reset()
+
+    t0, t0_wall = time.perf_counter(), time.time()
+    if mode == "async":
+        stats = fk.fetch_all_async(plan, start, end, store, "replay", 4, concurrency)
+    else:
+        stats = fk.fetch_all_threaded(plan, start, end, store, "replay", 4, concurrency)
+    store.manifest.save()
+    elapsed = time.perf_counter() - t0
+
+    timings = fk.TIMINGS
+    return {
+        "scenario": scenario,
+        "codes": len(plan),
+        "elapsed_s": round(elapsed, 3),
+        "codes_per_s": round(len(plan) / elapsed, 2) if elapsed > 0 else None,
+        "requests": timings.counts["network"],
+        "latency_ms": timings.percentiles(),
+        "retries": timings.counts["retry"],
+        "hedges": {k: timings.counts[k] for k in ("hedge", "failover", "hedge_win")},
+        "circuit_open": timings.counts["circuit_open"],
+        "breaker": [
+            {**t, "time": round(t["time"] - t0_wall, 3)} for t in limiter.breaker.transitions
+        ],
+        "status": dict(stats),
+        "time_s": {"limiter_wait": round(limiter.waited, 3), **timings.summary()},
+        "injected": {k: replay.counts[k] for k in ("error", "throttled")},
+        "limiter": limiter.summary(),
+        "hedge_limiter": hedge_limiter.summary() if fk.HEDGE_TO else None,
+    }
+
+
+def run_case(args: argparse.Namespace, mode: str, size: int, concurrency: int, work_dir: Path) -> List[Dict[str, Any]]:
+    """一组参数：新目录中依次跑 full 与 update 两轮。"""
+    data = dict(fixture_dir=args.fixture_dir, codes=size, seed=args.seed, jitter=args.jitter)
+    replay = configure_replay(
+        "replay",
+        **data,
+        latency=args.latency,
+        error_rate=args.error_rate,
+        throttle_rate=args.throttle_rate,
+        quota=args.quota,
+    )
+    fk.HEDGE_TO.clear()
+    if args.hedge:
+        # 对冲到另一个回放实例：数据相同，延迟与故障独立
+        latency = args.latency if args.hedge_latency is None else args.hedge_latency
+        configure_replay(
+            "replay2", **data, fault_seed=args.seed + 1, latency=latency, error_rate=args.hedge_error_rate
+        )
+        fk.configure_hedge("replay", "replay2", concurrency)
+    codes = replay.universe()[:size]
+    calendar = replay.calendar()
+    calendar = calendar[
+        (calendar >= pd.to_datetime(args.start, format="%Y%m%d")) & (calendar <= pd.Timestamp.today().normalize())
+    ]
+    prev_end, end = (d.strftime("%Y%m%d") for d in calendar[-2:])
+
+    out = work_dir / f"{mode}-{size}-{concurrency}"
+    shutil.rmtree(out, ignore_errors=True)
+    out.mkdir(parents=True)
+    store = open_store(out, args.format, manifest=True)
+
+    base = {"mode": mode, "size": len(codes), "concurrency": concurrency, "format": store.name}
+    full = _run_round("full", dict.fromkeys(codes), args.start, prev_end, store, mode, concurrency, args.rate)
+    plan = fk.plan_fetch(codes, store, calendar, end)
+    update = _run_round("update", plan, args.start, end, store, mode, concurrency, args.rate)
+    if not args.keep:
+        shutil.rmtree(out, ignore_errors=True)
+    return [{**base, **full}, {**base, **update}]
+
+
+def _report(r: Dict[str, Any]) -> str:
+    lat = r["latency_ms"]
+    t = r["time_s"]
+    return (
+        f"{r['mode']:<6} {r['scenario']:<6} codes={r['size']:<5} conc={r['concurrency']:<4} "
+        f"{r['codes_per_s']:>8} codes/s  p50/p95/p99={lat.get('p50')}/{lat.get('p95')}/{lat.get('p99')}ms  "
+        f"retries={r['retries']} hedges={r['hedges']['hedge']} trips={r['limiter']['trips']}  wait={t['limiter_wait']:.1f}s net={t['network']:.1f}s "
+        f"parse={t['parse']:.1f}s validate={t['validate']:.1f}s write={t['write']:.1f}s"
+    )
+
+
+def main() -> None:
+    p = argparse.ArgumentParser(description="以回放数据源压测 fetch_kline 抓取流水线的吞吐")
+    p.add_argument("--sizes", type=_int_list, default=[500, 2000], help="股票数，逗号分隔")
+    p.add_argument("--concurrency", type=_int_list, default=[8, 32, 64], help="并发上限，逗号分隔")
+    p.add_argument("--modes", default="thread,async", help="抓取模式，逗号分隔：thread / async")
+    p.add_argument("--format", choices=STORE_FORMATS, default="csv", help="K 线存储格式")
+    p.add_argument("--start", default="20190101", help="全量下载的起始日期")
+    p.add_argument("--fixture-dir", help="回放夹具目录；缺省时合成数据")
+    p.add_argument("--seed", type=int, default=0, help="合成数据与故障注入的随机种子")
+    p.add_argument("--latency", type=float, default=0.02, help="每个请求的平均延迟，单位秒")
+    p.add_argument("--jitter", type=float, default=0.5, help="延迟的对数正态抖动 σ；越大长尾越重")
+    p.add_argument("--error-rate", type=float, default=0.0, help="请求随机失败的概率")
+    p.add_argument("--throttle-rate", type=float, default=0.0, help="请求随机返回限流的概率")
+    p.add_argument("--quota", type=float, default=0.0, help="每秒请求配额，超出即返回限流；0 为不限")
+    p.add_argument("--hedge", action="store_true", help="启用对冲请求（对冲到第二个回放实例 replay2）")
+    p.add_argument("--hedge-latency", type=float, help="replay2 的平均延迟，单位秒；缺省同 --latency")
+    p.add_argument("--hedge-error-rate", type=float, default=0.0, help="replay2 请求随机失败的概率")
+    p.add_argument("--breaker-threshold", type=float, default=0.5, help="熔断的失败率阈值；0 为关闭")
+    p.add_argument("--breaker-cooldown", type=float, default=30.0, help="熔断后的探测等待，单位秒")
+    p.add_argument("--rate", type=float, default=0.0, help="限流器初始速率（次/秒）；缺省见 RATE_LIMITS")
+    p.add_argument("--work-dir", help="压测输出目录；缺省为临时目录，结束后删除")
+    p.add_argument("--keep", action="store_true", help="保留每组参数下载的数据")
+    p.add_argument("--json", help="结果写入该 JSON 文件")
+    p.add_argument("--verbose", action="store_true", help="保留抓取过程中的警告与错误日志")
+    args = p.parse_args()
+
+    if not args.verbose:
+        # 注入的错误会让每次失败都打印堆栈，压测时只看汇总
+        for name in ("fetch_mktcap", "replay_source", "rate_limit"):
+            logging.getLogger(name).setLevel(logging.CRITICAL)
+
+    configure_breakers(failure_rate=args.breaker_threshold, cooldown=args.breaker_cooldown)
+    work_dir = Path(args.work_dir) if args.work_dir else Path(tempfile.mkdtemp(prefix="fetch_bench_"))
+    work_dir.mkdir(parents=True, exist_ok=True)
+    results: List[Dict[str, Any]] = []
+    try:
+        for mode in args.modes.split(","):
+            for size in args.sizes:
+                for conc in args.concurrency:
+                    for r in run_case(args, mode, size, conc, work_dir):
+                        results.append(r)
+                        print(_report(r), flush=True)
+    finally:
+        if not args.work_dir and not args.keep:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    if args.keep:
+        print(f"下载的数据保留于 {work_dir}")
+
+    if args.json:
+        doc = {
+            "time": dt.datetime.now().isoformat(timespec="seconds"),
+            "python": sys.version.split()[0],
+            "pandas": pd.__version__,
+            "platform": platform.platform(),
+            "params": {k: v for k, v in vars(args).items() if k not in ("json", "work_dir", "keep", "verbose")},
+            "results": results,
+        }
+        Path(args.json).write_text(json.dumps(doc, ensure_ascii=False, indent=2), encoding="utf-8")
+        print(f"结果已写入 {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+from __future__ import annotations
+
+import json
+import logging
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional
+
+import pandas as pd
+
+logger = logging.getLogger("fetch_journal")
+
+# --------------------------- 抓取运行日志 --------------------------- #
+#
+# 每次抓取在输出目录写一份只追加的 JSON Lines 日志：
+#
+#     {"type": "run", "start": ..., "end": ..., "datasource": ..., "freq": ..., "time": ...}
+#     {"type": "plan", "codes": {"000001": null, "600000": ["2024-03-01", ...]}}   # 值为历史缺口
+#     {"type": "result", "code": "000001", "status": "appended", "attempts": 1, "error": null}
+#
+# 每个结果一行、写完即 flush，进程中途退出最多丢失正在进行的那几只。重新加载时按顺序回放，
+# 得到每只股票的最新状态：pending（未完成）/ done / failed，以及累计尝试次数与最后一次错误。
+
+JOURNAL_FILE = "fetch_journal.jsonl"
+
+# fetch_one 返回的状态中视为完成的（其余为失败）
+DONE_STATUS = frozenset({"written", "appended", "filled", "unchanged", "uptodate", "empty"})
+
+
+def _dump_gaps(gaps: Optional[pd.DatetimeIndex]) -> Optional[List[str]]:
+    return None if gaps is None else [d.strftime("%Y-%m-%d") for d in gaps]
+
+
+def _load_gaps(raw: Optional[List[str]]) -> Optional[pd.DatetimeIndex]:
+    return None if raw is None else pd.DatetimeIndex(pd.to_datetime(raw))
+
+
+class RunJournal:
+    """一次抓取运行的逐只状态记录，线程安全。"""
+
+    def __init__(self, path: Path) -> None:
+        self.path = Path(path)
+        self.meta: Dict[str, Any] = {}
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self._fh = None
+
+    # ---------- 创建 / 加载 ---------- #
+    @classmethod
+    def start(
+        cls,
+        path: Path,
+        meta: Dict[str, Any],
+        plan: Dict[str, Optional[pd.DatetimeIndex]],
+    ) -> "RunJournal":
+        """开始新一次运行：覆盖旧日志，写入运行参数与抓取计划。"""
+        j = cls(path)
+        j.path.parent.mkdir(parents=True, exist_ok=True)
+        j._fh = j.path.open("w", encoding="utf-8")
+        j.meta = dict(meta)
+        j._write({"type": "run", **j.meta, "time": time.time()})
+        j.add(plan)
+        return j
+
+    @classmethod
+    def load(cls, path: Path) -> "RunJournal":
+        """回放已有日志并以追加方式打开；末行不完整（写入中被中断）时截掉。"""
+        j = cls(path)
+        raw = j.path.read_bytes()
+        complete = raw[: raw.rfind(b"\n") + 1]
+        if len(complete) < len(raw):
+            logger.warning("运行日志 %s 末尾存在不完整的记录，已截去", j.path)
+            with j.path.open("r+b") as f:
+                f.truncate(len(complete))
+        for line in complete.decode("utf-8").splitlines():
+            try:
+                rec = json.loads(line)
+            except ValueError:
+                logger.warning("运行日志 %s 存在无法解析的记录，已忽略", j.path)
+                continue
+            j._apply(rec)
+        j._fh = j.path.open("a", encoding="utf-8")
+        return j
+
+    def _apply(self, rec: Dict[str, Any]) -> None:
+        kind = rec.get("type")
+        if kind == "run":
+            self.meta = {k: v for k, v in rec.items() if k not in ("type", "time")}
+        elif kind == "plan":
+            for code, gaps in rec["codes"].items():
+                prev = self.entries.get(code, {})
+                self.entries[code] = {
+                    "state": "pending",
+                    "status": None,
+                    "attempts": prev.get("attempts", 0),
+                    "error": prev.get("error"),
+                    "gaps": gaps,
+                }
+        elif kind == "result":
+            e = self.entries.setdefault(
+                rec["code"], {"state": "pending", "status": None, "attempts": 0, "error": None, "gaps": None}
+            )
+            e["status"] = rec["status"]
+            e["state"] = "done" if rec["status"] in DONE_STATUS else "failed"
+            e["attempts"] += rec.get("attempts", 0)
+            e["error"] = rec.get("error")
+
+    def _write(self, rec: Dict[str, Any]) -> None:
+        with self._lock:
+            self._apply(rec)
+            self._fh.write(json.dumps(rec, ensure_ascii=False) + "\n")
+            self._fh.flush()
+
+    # ---------- 记录 ---------- #
+    def add(self, plan: Dict[str, Optional[pd.DatetimeIndex]]) -> None:
+        """追加待抓取的股票（已在日志中的重新置为 pending）。"""
+        if plan:
+            self._write({"type": "plan", "codes": {c: _dump_gaps(g) for c, g in plan.items()}})
+
+    def record(self, code: str, status: str, attempts: int = 1, error: Optional[str] = None) -> None:
+        self._write({"type": "result", "code": code, "status": status, "attempts": attempts, "error": error})
+
+    def close(self) -> None:
+        with self._lock:
+            if self._fh is not None:
+                self._fh.close()
+                self._fh = None
+
+    # ---------- 查询 ---------- #
+    def select(self, states: Iterable[str]) -> Dict[str, Optional[pd.DatetimeIndex]]:
+        """处于 *states* 的股票 → 计划中的历史缺口，可直接作为抓取计划。"""
+        states = set(states)
+        return {c: _load_gaps(e["gaps"]) for c, e in self.entries.items() if e["state"] in states}
+
+    def counts(self) -> Counter:
+        return Counter(e["state"] for e in self.entries.values())
+
+    def failures(self, limit: int = 10) -> List[tuple]:
+        """失败的股票及其尝试次数、最后一次错误（最多 *limit* 条）。"""
+        failed = [(c, e["attempts"], e["error"]) for c, e in self.entries.items() if e["state"] == "failed"]
+        return failed[:limit]
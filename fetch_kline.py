@@ -1,23 +1,34 @@
 from __future__ import annotations
 
 import argparse
+import asyncio
 import datetime as dt
 import json
 import logging
-import random
 import sys
+import threading
 import time
 import warnings
+from collections import Counter
 from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from functools import partial
 from pathlib import Path
-from typing import List, Optional
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
 
 import akshare as ak
+import numpy as np
 import pandas as pd
 import tushare as ts
-from mootdx.quotes import Quotes
 from tqdm import tqdm
 
+from fetch_journal import JOURNAL_FILE, RunJournal
+from kline_store import CALENDAR_FILE, KLINE_COLUMNS, MKTCAP_FILE, STORE_FORMATS, CsvStore, KlineStore, open_store
+from market_file import MARKET_FILE, build_market_file
+from mootdx_pool import configure_pool, get_pool
+from rate_limit import AdaptiveLimiter, CircuitOpen, configure_breakers, configure_limiter, get_limiter
+from replay_source import configure_replay, get_replay
+
 warnings.filterwarnings("ignore")
 
 # --------------------------- 全局日志配置 --------------------------- #
@@ -36,17 +47,100 @@ logger = logging.getLogger("fetch_mktcap")
 for noisy in ("httpx", "urllib3", "_client", "akshare"):
     logging.getLogger(noisy).setLevel(logging.WARNING)
 
+# --------------------------- 数据源限流 --------------------------- #
+
+# 各数据源限流器的初始值与上限；运行中按延迟与错误率自适应（见 rate_limit.py）。
+# Tushare 普通积分每分钟约 500 次，速率上限据此设定
+RATE_LIMITS: Dict[str, dict] = {
+    "tushare": dict(rate=4.0, max_rate=8.0, concurrency=2, max_concurrency=8),
+    "akshare": dict(rate=2.0, max_rate=20.0, concurrency=2, max_concurrency=16),
+    "mootdx": dict(rate=10.0, max_rate=100.0, concurrency=4, max_concurrency=32),
+    "replay": dict(rate=50.0, max_rate=5000.0, concurrency=8, max_concurrency=64),
+    "replay2": dict(rate=50.0, max_rate=5000.0, concurrency=8, max_concurrency=64),
+}
+
+
+def _limiter(datasource: str) -> AdaptiveLimiter:
+    return get_limiter(datasource, **RATE_LIMITS.get(datasource, {}))
+
+
+def _log_breaker(datasource: str) -> None:
+    """运行总结：*datasource* 熔断器的状态切换。"""
+    breaker = _limiter(datasource).breaker
+    for t in breaker.transitions:
+        logger.info(
+            "熔断 %s：%s %s → %s（%s）",
+            datasource,
+            dt.datetime.fromtimestamp(t["time"]).strftime("%H:%M:%S"),
+            t["from"],
+            t["to"],
+            t["reason"],
+        )
+    if breaker.state != "closed":
+        logger.warning("熔断 %s：运行结束时仍为 %s", datasource, breaker.state)
+
+# --------------------------- 耗时统计 --------------------------- #
+
+class StageTimer:
+    """
+    抓取流水线各阶段的累计耗时（各线程合计，单位秒）与单次请求延迟样本，线程安全。
+    阶段：network（数据源请求）、parse（结果清洗）、validate（校验）、write（落盘与清单）。
+    """
+
+    STAGES = ("network", "parse", "validate", "write")
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self.totals: Counter = Counter()
+            self.counts: Counter = Counter()
+            self.latencies: List[float] = []
+
+    @contextmanager
+    def timed(self, stage: str) -> Iterator[None]:
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - t0
+            with self._lock:
+                self.totals[stage] += elapsed
+                self.counts[stage] += 1
+                if stage == "network":
+                    self.latencies.append(elapsed)
+
+    def count(self, key: str, n: int = 1) -> None:
+        with self._lock:
+            self.counts[key] += n
+
+    def percentiles(self, qs: Tuple[int, ...] = (50, 95, 99)) -> Dict[str, float]:
+        """请求延迟分位数（毫秒）。"""
+        with self._lock:
+            lat = np.asarray(self.latencies)
+        return {f"p{q}": round(float(np.percentile(lat, q)) * 1000, 1) for q in qs} if lat.size else {}
+
+    def summary(self) -> Dict[str, float]:
+        return {s: round(self.totals[s], 3) for s in self.STAGES}
+
+
+TIMINGS = StageTimer()
+
 # --------------------------- 市值快照 --------------------------- #
 
 def _get_mktcap_ak() -> pd.DataFrame:
     """实时快照，返回列：code, mktcap（单位：元）"""
+    limiter = _limiter("akshare")
     for attempt in range(1, 4):
         try:
-            df = ak.stock_zh_a_spot_em()
+            with limiter.slot():
+                df = ak.stock_zh_a_spot_em()
             break
         except Exception as e:
             logger.warning("AKShare 获取市值快照失败(%d/3): %s", attempt, e)
-            time.sleep(backoff := random.uniform(1, 3) * attempt)
+            time.sleep(limiter.backoff(attempt))
     else:
         raise RuntimeError("AKShare 连续三次拉取市值快照失败！")
 
@@ -54,6 +148,45 @@ def _get_mktcap_ak() -> pd.DataFrame:
     df["mktcap"] = pd.to_numeric(df["mktcap"], errors="coerce")
     return df
 
+
+def _get_mktcap(datasource: str = "akshare") -> pd.DataFrame:
+    """市值快照：回放数据源自带快照，其余数据源统一取 AKShare。"""
+    if datasource in REPLAY_SOURCES:
+        return _call_with_retry(datasource, "回放数据源获取市值快照", get_replay(datasource).mktcap)
+    return _get_mktcap_ak()
+
+
+def load_mktcap_snapshot(cache_dir: Path, ttl: float) -> Tuple[Optional[pd.DataFrame], float]:
+    """
+    读取缓存的市值快照，返回 (快照, 距上次刷新的秒数)；无缓存或读取失败时快照为 None。
+    是否过期由调用方按 *ttl* 判断（过期快照仍可先用于筛选）。
+    """
+    path = cache_dir / MKTCAP_FILE
+    if not path.exists():
+        return None, float("inf")
+    try:
+        df = pd.read_csv(path, dtype={"code": str})
+    except Exception:
+        logger.exception("读取市值快照缓存 %s 失败", path)
+        return None, float("inf")
+    return df, time.time() - path.stat().st_mtime
+
+
+def refresh_mktcap_snapshot(cache_dir: Path, datasource: str = "akshare") -> pd.DataFrame:
+    """重新拉取市值快照并原子写回缓存。"""
+    df = _get_mktcap(datasource)
+    path = cache_dir / MKTCAP_FILE
+    tmp = path.with_name(path.name + ".tmp")
+    df.to_csv(tmp, index=False)
+    tmp.replace(path)
+    return df
+
+
+def get_mktcap_snapshot(cache_dir: Path, ttl: float, datasource: str = "akshare") -> pd.DataFrame:
+    """缓存未过期时直接使用，否则同步刷新。"""
+    df, age = load_mktcap_snapshot(cache_dir, ttl)
+    return df if df is not None and age <= ttl else refresh_mktcap_snapshot(cache_dir, datasource)
+
 # --------------------------- 股票池筛选 --------------------------- #
 
 def get_constituents(
@@ -61,8 +194,13 @@ def get_constituents(
     max_cap: float,
     small_player: bool,
     mktcap_df: Optional[pd.DataFrame] = None,
+    cache_dir: Optional[Path] = None,
+    ttl: float = 12 * 3600,
 ) -> List[str]:
-    df = mktcap_df if mktcap_df is not None else _get_mktcap_ak()
+    if mktcap_df is not None:
+        df = mktcap_df
+    else:
+        df = get_mktcap_snapshot(cache_dir, ttl) if cache_dir is not None else _get_mktcap_ak()
 
     cond = (df["mktcap"] >= min_cap) & (df["mktcap"] <= max_cap)
     if small_player:
@@ -114,25 +252,17 @@ def _to_ts_code(code: str) -> str:
     return f"{code.zfill(6)}.SH" if code.startswith(("60", "68", "9")) else f"{code.zfill(6)}.SZ"
 
 
-def _get_kline_tushare(code: str, start: str, end: str, adjust: str) -> pd.DataFrame:
-    ts_code = _to_ts_code(code)
-    adj_flag = None if adjust == "" else adjust
-    for attempt in range(1, 4):
-        try:
-            df = ts.pro_bar(
-                ts_code=ts_code,
-                adj=adj_flag,
-                start_date=start,
-                end_date=end,
-                freq="D",
-            )
-            break
-        except Exception as e:
-            logger.warning("Tushare 拉取 %s 失败(%d/3): %s", code, attempt, e)
-            time.sleep(random.uniform(1, 2) * attempt)
-    else:
-        return pd.DataFrame()
+def _request_tushare(code: str, start: str, end: str, adjust: str, freq_code: int = 4) -> Optional[pd.DataFrame]:
+    return ts.pro_bar(
+        ts_code=_to_ts_code(code),
+        adj=None if adjust == "" else adjust,
+        start_date=start,
+        end_date=end,
+        freq="D",
+    )
+
 
+def _clean_tushare(df: Optional[pd.DataFrame], start: str, end: str) -> pd.DataFrame:
     if df is None or df.empty:
         return pd.DataFrame()
 
@@ -145,25 +275,20 @@ def _get_kline_tushare(code: str, start: str, end: str, adjust: str) -> pd.DataF
     )    
     return df.sort_values("date").reset_index(drop=True)
 
+
 # ---------- AKShare 工具函数 ---------- #
 
-def _get_kline_akshare(code: str, start: str, end: str, adjust: str) -> pd.DataFrame:
-    for attempt in range(1, 4):
-        try:
-            df = ak.stock_zh_a_hist(
-                symbol=code,
-                period="daily",
-                start_date=start,
-                end_date=end,
-                adjust=adjust,
-            )
-            break
-        except Exception as e:
-            logger.warning("AKShare 拉取 %s 失败(%d/3): %s", code, attempt, e)
-            time.sleep(random.uniform(1, 2) * attempt)
-    else:
-        return pd.DataFrame()
+def _request_akshare(code: str, start: str, end: str, adjust: str, freq_code: int = 4) -> Optional[pd.DataFrame]:
+    return ak.stock_zh_a_hist(
+        symbol=code,
+        period="daily",
+        start_date=start,
+        end_date=end,
+        adjust=adjust,
+    )
 
+
+def _clean_akshare(df: Optional[pd.DataFrame], start: str, end: str) -> pd.DataFrame:
     if df is None or df.empty:
         return pd.DataFrame()
 
@@ -178,17 +303,17 @@ def _get_kline_akshare(code: str, start: str, end: str, adjust: str) -> pd.DataF
     df = df[["date", "open", "close", "high", "low", "volume"]]
     return df.sort_values("date").reset_index(drop=True)
 
+
 # ---------- Mootdx 工具函数 ---------- #
 
-def _get_kline_mootdx(code: str, start: str, end: str, adjust: str, freq_code: int) -> pd.DataFrame:    
-    symbol = code.zfill(6)
-    freq = _FREQ_MAP.get(freq_code, "day")
-    client = Quotes.factory(market="std")
-    try:
-        df = client.bars(symbol=symbol, frequency=freq, adjust=adjust or None)
-    except Exception as e:
-        logger.warning("Mootdx 拉取 %s 失败: %s", code, e)
-        return pd.DataFrame()
+def _request_mootdx(code: str, start: str, end: str, adjust: str, freq_code: int = 4) -> Optional[pd.DataFrame]:
+    # 复用连接池中的长连接；连接失效时池内自动重连重试
+    return get_pool().call(
+        lambda client: client.bars(symbol=code.zfill(6), frequency=_FREQ_MAP.get(freq_code, "day"), adjust=adjust or None)
+    )
+
+
+def _clean_mootdx(df: Optional[pd.DataFrame], start: str, end: str) -> pd.DataFrame:
     if df is None or df.empty:
         return pd.DataFrame()
     
@@ -202,8 +327,39 @@ def _get_kline_mootdx(code: str, start: str, end: str, adjust: str, freq_code: i
     df = df.sort_values("date").reset_index(drop=True)    
     return df[["date", "open", "close", "high", "low", "volume"]]
 
+
+# ---------- 回放数据源（压测 / 回归测试） ---------- #
+
+# replay 为主回放数据源；replay2 返回同样的数据，延迟与故障单独设置（--replay2-*），供演练对冲与熔断改道
+REPLAY_SOURCES = ("replay", "replay2")
+
+
+def _request_replay(
+    code: str, start: str, end: str, adjust: str, freq_code: int = 4, name: str = "replay"
+) -> Optional[pd.DataFrame]:
+    if _FREQ_MAP.get(freq_code) != "day":
+        raise ValueError("回放数据源仅支持日线")
+    return get_replay(name).kline(code, start, end)
+
+
+def _clean_replay(df: Optional[pd.DataFrame], start: str, end: str) -> pd.DataFrame:
+    if df is None or df.empty:
+        return pd.DataFrame()
+    return df[["date", "open", "close", "high", "low", "volume"]].sort_values("date").reset_index(drop=True)
+
+
 # ---------- 通用接口 ---------- #
 
+# 数据源 → (单次请求, 结果清洗)；单次请求失败直接抛异常，由调用方决定重试方式
+DATASOURCES = {
+    "tushare": (_request_tushare, _clean_tushare),
+    "akshare": (_request_akshare, _clean_akshare),
+    "mootdx": (_request_mootdx, _clean_mootdx),
+    "replay": (_request_replay, _clean_replay),
+    "replay2": (partial(_request_replay, name="replay2"), _clean_replay),
+}
+
+
 def get_kline(
     code: str,
     start: str,
@@ -212,28 +368,663 @@ def get_kline(
     datasource: str,
     freq_code: int = 4,
 ) -> pd.DataFrame:
-    if datasource == "tushare":
-        return _get_kline_tushare(code, start, end, adjust)
-    elif datasource == "akshare":
-        return _get_kline_akshare(code, start, end, adjust)
-    elif datasource == "mootdx":        
-        return _get_kline_mootdx(code, start, end, adjust, freq_code)
-    else:
-        raise ValueError("datasource 仅支持 'tushare', 'akshare' 或 'mootdx'")
+    """
+    经该数据源的限流器发出一次请求，失败（含熔断）时记录日志并返回空表。
+    重试与退避只在抓取流程中统一处理（见 ``fetch_one``），这里不再另设一套。
+    """
+    if datasource not in DATASOURCES:
+        raise ValueError(f"datasource 仅支持 {', '.join(map(repr, DATASOURCES))}")
+    try:
+        with _limiter(datasource).slot():
+            return get_kline_once(code, start, end, adjust, datasource, freq_code)
+    except CircuitOpen as e:
+        logger.warning("%s 拉取 %s 跳过: %s", datasource, code, e)
+    except Exception as e:
+        logger.warning("%s 拉取 %s 失败: %s", datasource, code, e)
+    return pd.DataFrame()
+
+
+def get_kline_once(
+    code: str,
+    start: str,
+    end: str,
+    adjust: str,
+    datasource: str,
+    freq_code: int = 4,
+) -> pd.DataFrame:
+    """单次请求、不重试，失败时抛出异常（供异步抓取自行退避重试）。"""
+    if datasource not in DATASOURCES:
+        raise ValueError(f"datasource 仅支持 {', '.join(map(repr, DATASOURCES))}")
+    request, clean = DATASOURCES[datasource]
+    with TIMINGS.timed("network"):
+        raw = request(code, start, end, adjust, freq_code)
+    with TIMINGS.timed("parse"):
+        return clean(raw, start, end)
+
+# ---------- 对冲请求与数据源回退 ---------- #
+#
+# 单个慢请求（AKShare 偶尔一次要几十秒）会占住一个抓取线程，而其他数据源此时空闲。
+# 配置了对冲数据源后，主数据源的请求超过其近期 p95 延迟仍未返回、或先返回了错误时，
+# 向对冲数据源发出同样的请求。落败一方若还在排队等限流名额则直接取消；已发出的数据源调用
+# 无法中断，任其完成后丢弃结果（其延迟照常计入限流器，p95 不会因此失真）。
+#
+# async 模式下两个请求都不占事件循环，先成功的一方胜出。thread 模式下主请求就在抓取线程中执行，
+# 对冲线程池只负责计时与发出对冲请求，慢请求不会额外占住池中线程；代价是抓取线程要等主请求
+# 返回才能继续：主请求成功即用其结果，主请求出错时对冲请求往往已提前发出、不必再从头等待。
+#
+# 各数据源的清洗结果列相同、均为前复权、成交量均以手计，胜出结果再统一列顺序与类型后写入。
+# 不同数据源的前复权价可能有细微差别：与本地末根 K 线不一致时按“历史已变”整段重新下载，
+# 同一文件内不会拼接不同来源的数据。
+#
+# 主数据源熔断时请求在取限流名额时即失败（CircuitOpen），按出错回退立即改走对冲数据源；
+# 未启用对冲时直接失败，由调用方记为失败、不再重试。
+
+# 主数据源 → 缺省的对冲数据源（--hedge 不带值时使用）；对冲数据源必须与主数据源不同，
+# 否则对冲请求与主请求共用限流器、延迟统计与熔断器，只会加重慢数据源的负担
+HEDGE_SOURCES = {
+    "akshare": "mootdx",
+    "tushare": "mootdx",
+    "mootdx": "akshare",
+    "replay": "replay2",
+    "replay2": "replay",
+}
+
+HEDGE_MIN_DELAY = 0.05     # 对冲等待的下限（秒），避免极快的数据源因调度抖动频繁对冲
+
+# 本次运行启用的对冲：主数据源 → 对冲数据源
+HEDGE_TO: Dict[str, str] = {}
+_HEDGE_POOL: Optional[ThreadPoolExecutor] = None
+
+
+def configure_hedge(datasource: str, secondary: str, workers: int) -> None:
+    """
+    为 *datasource* 启用对冲。thread 模式的每个抓取线程同一时刻至多有一个等待中的对冲任务，
+    另有至多一个已发出、结果将被丢弃的对冲请求，线程池按 2×*workers* 分配；池满时对冲顺延，不影响主请求。
+    """
+    global _HEDGE_POOL
+    if secondary == datasource:
+        raise ValueError(f"对冲数据源不能与主数据源相同：{datasource}")
+    HEDGE_TO[datasource] = secondary
+    _HEDGE_POOL = ThreadPoolExecutor(max_workers=2 * max(1, workers), thread_name_prefix="hedge")
+
+
+def _normalize_kline(df: pd.DataFrame) -> pd.DataFrame:
+    """统一为 date + OHLCV 六列，date 归一到日，数值列为 float64。"""
+    if df.empty:
+        return df
+    df = df[KLINE_COLUMNS].copy()
+    df["date"] = pd.to_datetime(df["date"]).dt.normalize()
+    df[KLINE_COLUMNS[1:]] = df[KLINE_COLUMNS[1:]].astype("float64")
+    return df
+
+
+def _hedge_target(datasource: str, freq_code: int) -> Optional[str]:
+    """对冲数据源；未启用或非日线（Tushare / AKShare 只有日线）时为 None。"""
+    return HEDGE_TO.get(datasource) if _FREQ_MAP.get(freq_code) == "day" else None
+
+
+def _hedge_delay(datasource: str) -> Optional[float]:
+    """主请求发出后等待多久再对冲：近期 p95 延迟；样本不足时为 None（只在出错时回退）。"""
+    delay = _limiter(datasource).latency_quantile(0.95)
+    return None if delay is None else max(delay, HEDGE_MIN_DELAY)
+
+
+def _hedge_timeout(datasource: str, sent_at: List[float]) -> Optional[float]:
+    """
+    从现在起还要等多久再对冲：对冲延迟从主请求发出时刻（*sent_at*）算起，扣除调用方被唤醒前
+    已经过去的时间（事件循环繁忙、轮询间隔），否则实际门槛会高于 p95、几乎从不对冲。
+    """
+    delay = _hedge_delay(datasource)
+    if delay is None or not sent_at:
+        return delay
+    return max(0.0, delay - (time.monotonic() - sent_at[0]))
+
+
+def request_kline(code: str, start: str, end: str, datasource: str, freq_code: int = 4) -> pd.DataFrame:
+    """
+    经限流器的单次前复权请求，失败抛出；启用对冲时按上文规则同时请求对冲数据源。
+    对冲的计时从主请求拿到限流名额、真正发出时开始，排队等名额的时间不算在内。
+    """
+    secondary = _hedge_target(datasource, freq_code)
+    sent_at: List[float] = []
+
+    def attempt(ds: str, sent: Optional[threading.Event] = None) -> pd.DataFrame:
+        with _limiter(ds).slot():
+            if sent is not None:
+                sent_at.append(time.monotonic())
+                sent.set()
+            return get_kline_once(code, start, end, "qfq", ds, freq_code)
+
+    if secondary is None or _HEDGE_POOL is None:
+        return attempt(datasource)
+
+    sent = threading.Event()        # 主请求已发出（或未发出即已结束）
+    settled = threading.Event()     # 主请求已返回，不再需要对冲
+
+    def hedger() -> Optional[pd.DataFrame]:
+        """主请求发出后超过 p95 仍未返回时发出对冲请求；无需对冲时返回 None。"""
+        sent.wait()
+        timeout = _hedge_timeout(datasource, sent_at)
+        if timeout is None or settled.wait(timeout):
+            return None
+        TIMINGS.count("hedge")
+        return attempt(secondary)
+
+    hedge = _HEDGE_POOL.submit(hedger)
+    try:
+        df = attempt(datasource, sent)
+    except Exception:
+        sent.set()
+        settled.set()
+        if hedge.cancel() or (hedged := hedge.result()) is None:
+            TIMINGS.count("failover")       # 对冲尚未发出：立即改走对冲数据源
+            return _normalize_kline(attempt(secondary))
+        TIMINGS.count("hedge_win")
+        return _normalize_kline(hedged)
+    finally:
+        sent.set()
+        settled.set()
+    hedge.cancel()                          # 尚未开始的直接取消；已发出的任其完成
+    return _normalize_kline(df)
+
+
+async def request_kline_async(
+    code: str,
+    start: str,
+    end: str,
+    datasource: str,
+    freq_code: int,
+    net_pool: ThreadPoolExecutor,
+) -> pd.DataFrame:
+    """``request_kline`` 的协程版本：请求在 *net_pool* 中执行，等待与竞速都不占线程。"""
+    loop = asyncio.get_running_loop()
+    secondary = _hedge_target(datasource, freq_code)
+    sent = set()
+    sent_at: List[float] = []
+    primary_sent = asyncio.Event()
+
+    async def attempt(ds: str, tag: str) -> pd.DataFrame:
+        async with _limiter(ds).aslot():
+            sent.add(tag)
+            if tag == "primary":
+                sent_at.append(time.monotonic())
+                primary_sent.set()
+            return await loop.run_in_executor(net_pool, get_kline_once, code, start, end, "qfq", ds, freq_code)
+
+    if secondary is None:
+        return await attempt(datasource, "primary")
+
+    primary = asyncio.ensure_future(attempt(datasource, "primary"))
+    waiter = asyncio.ensure_future(primary_sent.wait())
+    await asyncio.wait({primary, waiter}, return_when=asyncio.FIRST_COMPLETED)
+    waiter.cancel()
+    done, _ = await asyncio.wait({primary}, timeout=_hedge_timeout(datasource, sent_at))
+    if done and primary.exception() is None:
+        return _normalize_kline(primary.result())
+    TIMINGS.count("failover" if done else "hedge")
+    tasks = {primary: "primary", asyncio.ensure_future(attempt(secondary, "hedge")): "hedge"}
+    pending = set(tasks)
+    error: Optional[BaseException] = None
+    while pending:
+        done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            if task.exception() is not None:
+                error = task.exception()
+                continue
+            for other in pending:
+                if tasks[other] not in sent:
+                    other.cancel()      # 还在等限流名额：取消，不再发出
+                other.add_done_callback(lambda t: t.cancelled() or t.exception())
+            TIMINGS.count("hedge_win", tasks[task] == "hedge")
+            return _normalize_kline(task.result())
+    raise error
 
 # ---------- 数据校验 ---------- #
 
 def validate(df: pd.DataFrame) -> pd.DataFrame:
-    df = df.drop_duplicates(subset="date").sort_values("date").reset_index(drop=True)
-    if df["date"].isna().any():
-        raise ValueError("存在缺失日期！")
-    if (df["date"] > pd.Timestamp.today()).any():
-        raise ValueError("数据包含未来日期，可能抓取错误！")
-    return df
+    with TIMINGS.timed("validate"):
+        df = df.drop_duplicates(subset="date").sort_values("date").reset_index(drop=True)
+        if df["date"].isna().any():
+            raise ValueError("存在缺失日期！")
+        if (df["date"] > pd.Timestamp.today()).any():
+            raise ValueError("数据包含未来日期，可能抓取错误！")
+        return df
 
 def drop_dup_columns(df: pd.DataFrame) -> pd.DataFrame:
     return df.loc[:, ~df.columns.duplicated()]
+
+def _tail_matches(new_df: pd.DataFrame, last_row: pd.DataFrame) -> bool:
+    """
+    比对本地最后一根 K 线与新数据中同一日期的 K 线。前复权数据在除权后整段历史都会变化，
+    此时重叠的那根 K 线不再一致；新数据不含该日期时无从比对，视为一致。
+    """
+    last_date = last_row["date"].iloc[-1]
+    overlap = new_df[new_df["date"] == last_date]
+    if overlap.empty:
+        return True
+    cols = [c for c in last_row.columns if c != "date" and c in overlap.columns]
+    old = last_row[cols].iloc[-1].to_numpy(dtype=float)
+    new = overlap[cols].iloc[-1].to_numpy(dtype=float)
+    return bool(np.allclose(old, new, rtol=1e-6, atol=0.0, equal_nan=True))
+
+# ---------- 交易日历与抓取规划 ---------- #
+
+def _get_trade_calendar_ak() -> pd.DatetimeIndex:
+    """新浪交易日历（1990 年至当年年底）"""
+    limiter = _limiter("akshare")
+    for attempt in range(1, 4):
+        try:
+            with limiter.slot():
+                df = ak.tool_trade_date_hist_sina()
+            break
+        except Exception as e:
+            logger.warning("AKShare 获取交易日历失败(%d/3): %s", attempt, e)
+            time.sleep(limiter.backoff(attempt))
+    else:
+        raise RuntimeError("AKShare 连续三次拉取交易日历失败！")
+    return pd.DatetimeIndex(pd.to_datetime(df["trade_date"])).sort_values()
+
+
+def load_trade_calendar(cache_dir: Path, end: str, datasource: str = "akshare") -> Optional[pd.DatetimeIndex]:
+    """
+    读取本地缓存的交易日历；缓存不覆盖 *end* 时重新下载并原子写回。
+    无法得到覆盖 *end* 的日历时返回 None（此时不做规划，逐只请求）。
+    回放数据源使用其自带的日历，其余数据源统一取新浪交易日历。
+    """
+    path = cache_dir / CALENDAR_FILE
+    end_ts = pd.to_datetime(end, format="%Y%m%d")
+    cached: Optional[pd.DatetimeIndex] = None
+    if path.exists():
+        try:
+            cached = pd.DatetimeIndex(pd.read_csv(path, parse_dates=["date"])["date"])
+        except Exception:
+            logger.exception("读取交易日历缓存 %s 失败", path)
+    if cached is not None and len(cached) and cached.max() >= end_ts:
+        return cached
+
+    try:
+        cal = get_replay(datasource).calendar() if datasource in REPLAY_SOURCES else _get_trade_calendar_ak()
+    except Exception as e:
+        logger.warning("无法获取交易日历，本次不做抓取规划: %s", e)
+        return None
+    tmp = path.with_name(path.name + ".tmp")
+    pd.DataFrame({"date": cal}).to_csv(tmp, index=False)
+    tmp.replace(path)
+    return cal if cal.max() >= end_ts else None
+
+
+def _find_gaps(
+    code: str,
+    store: KlineStore,
+    calendar: pd.DatetimeIndex,
+    entry: dict,
+) -> pd.DatetimeIndex:
+    """
+    本地历史中缺失的交易日（已确认无数据的除外）。先以清单行数与应有天数比较，
+    行数不少于应有天数时直接判定无缺口；否则才读取该股票的日期列逐日比对。
+    """
+    first, last = pd.Timestamp(entry["first"]), pd.Timestamp(entry["last"])
+    if calendar[0] > first:
+        return pd.DatetimeIndex([])         # 日历不覆盖该股票的全部历史
+    sessions = calendar[(calendar >= first) & (calendar <= last)].difference(store.manifest.no_data(code))
+    if entry["rows"] >= len(sessions):
+        return pd.DatetimeIndex([])
+    return sessions.difference(pd.DatetimeIndex(store.read(code)["date"]))
+
+
+def plan_fetch(
+    codes: List[str],
+    store: KlineStore,
+    calendar: pd.DatetimeIndex,
+    end: str,
+) -> Dict[str, Optional[pd.DatetimeIndex]]:
+    """
+    按交易日历规划：返回需要抓取的股票 → 历史缺口的交易日（无缺口为 None）。
+    末日已是 *end* 之前最后一个交易日且历史无缺口的股票不发请求。
+    """
+    end_ts = pd.to_datetime(end, format="%Y%m%d")
+    sessions = calendar[calendar <= end_ts]
+    last_session = sessions[-1] if len(sessions) else None
+    manifest = store.manifest
+
+    plan: Dict[str, Optional[pd.DatetimeIndex]] = {}
+    skipped = with_gaps = 0
+    for code in codes:
+        entry = manifest.get(code) if manifest is not None and manifest.is_fresh(code, store.path(code)) else None
+        if entry is None or not entry["last"] or last_session is None:
+            plan[code] = None
+            continue
+        try:
+            missing = _find_gaps(code, store, calendar, entry)
+        except Exception:
+            logger.exception("%s 缺口检查失败，按普通增量处理", code)
+            missing = pd.DatetimeIndex([])
+        if missing.empty and pd.Timestamp(entry["last"]) >= last_session:
+            skipped += 1
+            continue
+        with_gaps += not missing.empty
+        plan[code] = missing if not missing.empty else None
+
+    logger.info("抓取规划：%d 只需请求（其中 %d 只补历史缺口），%d 只已完整跳过", len(plan), with_gaps, skipped)
+    return plan
+
+# ---------- 按交易日批量更新 ---------- #
+#
+# 日常增量时多数股票只缺最近一两个交易日，而 Tushare 的 daily / adj_factor 与东方财富实时行情
+# 都能一次返回全市场某一天的数据，通达信行情接口一次可查询数十只股票的当日行情。
+# 批量下载后拆分写入各股票，只有批量结果里缺失（停牌、新上市）或发生除权（前复权历史整体变化）
+# 的股票才回退到逐只请求。
+
+BULK_SOURCES = ("tushare", "akshare", "mootdx")
+BULK_MAX_DAYS = 5       # 缺失交易日超过该数目的股票直接逐只请求
+MOOTDX_QUOTE_BATCH = 80 # 通达信单次行情查询的股票数上限
+
+# 实时行情在收盘前只是盘中快照；北京时间 15:00 收盘后留出几分钟，行情才是当日的收盘数据
+MARKET_CLOSE = dt.time(15, 5)
+_BEIJING = dt.timezone(dt.timedelta(hours=8))
+
+
+def _beijing_now() -> dt.datetime:
+    return dt.datetime.now(_BEIJING)
+
+
+def _call_with_retry(datasource: str, what: str, fn, *args, **kwargs):
+    """经数据源限流器调用 *fn*，失败重试三次后抛出 RuntimeError；数据源熔断中直接抛出 CircuitOpen。"""
+    limiter = _limiter(datasource)
+    for attempt in range(1, 4):
+        try:
+            with limiter.slot():
+                return fn(*args, **kwargs)
+        except CircuitOpen:
+            raise
+        except Exception as e:
+            logger.warning("%s 失败(%d/3): %s", what, attempt, e)
+            time.sleep(limiter.backoff(attempt))
+    raise RuntimeError(f"{what} 连续三次失败！")
+
+
+def _bulk_tushare(candidates: Dict[str, Tuple[pd.Timestamp, pd.DatetimeIndex]]) -> Dict[str, pd.DataFrame]:
+    """
+    Tushare：逐个缺失交易日拉取全市场日线与复权因子。前复权价 = 原始价 × 当日因子 / 最新因子，
+    因此本地末日至今因子不变的股票，新 K 线就是原始价；因子变化的交给逐只请求重新下载。
+    """
+    api = ts.pro_api()
+    days = sorted(set().union(*(set(missing) for _, missing in candidates.values())))
+    factor_days = sorted(set(days) | {last for last, _ in candidates.values()})
+
+    bars = []
+    for day in days:
+        d = day.strftime("%Y%m%d")
+        bars.append(_call_with_retry("tushare", f"Tushare 拉取 {d} 全市场日线", api.daily, trade_date=d))
+    factors = []
+    for day in factor_days:
+        d = day.strftime("%Y%m%d")
+        factors.append(_call_with_retry("tushare", f"Tushare 拉取 {d} 复权因子", api.adj_factor, trade_date=d))
+
+    num = ["open", "close", "high", "low", "volume"]
+    bars_df = pd.concat(bars, ignore_index=True).rename(columns={"trade_date": "date", "vol": "volume"})
+    bars_df = bars_df.assign(code=bars_df["ts_code"].str[:6], date=pd.to_datetime(bars_df["date"]))
+    bars_df[num] = bars_df[num].apply(pd.to_numeric, errors="coerce")
+    fac = pd.concat(factors, ignore_index=True)
+    fac = fac.assign(code=fac["ts_code"].str[:6], date=pd.to_datetime(fac["trade_date"]))
+    fac = fac.set_index(["code", "date"])["adj_factor"]
+
+    by_code = dict(tuple(bars_df.groupby("code")))
+    out: Dict[str, pd.DataFrame] = {}
+    for code, (last, missing) in candidates.items():
+        g = by_code.get(code)
+        if g is None:
+            continue
+        rows = g[g["date"].isin(missing)]
+        if len(rows) != len(missing):
+            continue
+        f = fac.reindex([(code, d) for d in [last, *missing]]).to_numpy(dtype=float)
+        if np.isnan(f).any() or not np.allclose(f, f[0], rtol=1e-9, atol=0.0):
+            continue
+        out[code] = rows[["date", *num]].sort_values("date").reset_index(drop=True)
+    return out
+
+
+def _bulk_akshare(
+    candidates: Dict[str, Tuple[pd.Timestamp, pd.DatetimeIndex]],
+    store: KlineStore,
+) -> Dict[str, pd.DataFrame]:
+    """
+    AKShare：东方财富实时行情一次返回全市场当日行情，只能补“今天”这一根。
+    前复权的最新一根即原始价；除权日的昨收为除权后价格，与本地末根收盘价不一致时交给逐只请求。
+    收盘（``MARKET_CLOSE``）前的行情不是当日收盘价，写入后清单会把当天记为已抓取、不再更新，
+    因此盘中运行时不使用实时行情，全部交给逐只请求。
+    """
+    now = _beijing_now()
+    today = pd.Timestamp(now.date())
+    todo = {c: v for c, v in candidates.items() if len(v[1]) == 1 and v[1][0] == today}
+    if not todo:
+        return {}
+    if now.time() < MARKET_CLOSE:
+        logger.info("北京时间 %s 前实时行情尚非收盘数据，%d 只改为逐只请求", MARKET_CLOSE.strftime("%H:%M"), len(todo))
+        return {}
+    spot = _call_with_retry("akshare", "AKShare 拉取实时行情", ak.stock_zh_a_spot_em)
+    spot = spot.rename(
+        columns={"代码": "code", "今开": "open", "最新价": "close", "最高": "high", "最低": "low", "成交量": "volume", "昨收": "pre_close"}
+    )
+    spot = spot.set_index(spot["code"].astype(str).str.zfill(6))
+    cols = ["open", "close", "high", "low", "volume", "pre_close"]
+    spot = spot[cols].apply(pd.to_numeric, errors="coerce")
+
+    out: Dict[str, pd.DataFrame] = {}
+    for code in todo:
+        if code not in spot.index:
+            continue
+        row = spot.loc[code]
+        if row[["open", "close", "volume"]].isna().any() or row["volume"] <= 0:
+            continue        # 停牌
+        last_close = store.manifest.last_bar(code)["close"].iloc[-1]
+        if not np.isclose(row["pre_close"], last_close, rtol=1e-6, atol=1e-3):
+            continue        # 除权或本地数据与数据源不一致
+        out[code] = pd.DataFrame({"date": [today], **{c: [float(row[c])] for c in cols[:-1]}})
+    return out
+
+
+def _bulk_mootdx(
+    candidates: Dict[str, Tuple[pd.Timestamp, pd.DatetimeIndex]],
+    store: KlineStore,
+) -> Dict[str, pd.DataFrame]:
+    """
+    Mootdx：实时行情每次查询一批股票（最多 ``MOOTDX_QUOTE_BATCH`` 只）的当日行情，只能补“今天”这一根，
+    一千只股票只需十几次请求。与 AKShare 相同，昨收与本地末根收盘价不一致（除权）时交给逐只请求，
+    收盘（``MARKET_CLOSE``）前不使用实时行情。
+    """
+    now = _beijing_now()
+    today = pd.Timestamp(now.date())
+    todo = [c for c, v in candidates.items() if len(v[1]) == 1 and v[1][0] == today]
+    if not todo:
+        return {}
+    if now.time() < MARKET_CLOSE:
+        logger.info("北京时间 %s 前实时行情尚非收盘数据，%d 只改为逐只请求", MARKET_CLOSE.strftime("%H:%M"), len(todo))
+        return {}
+    pool = get_pool()
+    batches = [todo[i : i + MOOTDX_QUOTE_BATCH] for i in range(0, len(todo), MOOTDX_QUOTE_BATCH)]
+    frames = []
+    for batch in tqdm(batches, desc="Mootdx 批量行情"):
+        df = _call_with_retry(
+            "mootdx",
+            f"Mootdx 拉取 {len(batch)} 只股票行情",
+            pool.call,
+            lambda client, batch=batch: client.quotes(symbol=batch),
+        )
+        if df is not None and not df.empty:
+            frames.append(df)
+    if not frames:
+        return {}
+    quotes = pd.concat(frames, ignore_index=True)
+    quotes = quotes.rename(columns={"price": "close", "vol": "volume", "last_close": "pre_close"})
+    quotes = quotes.set_index(quotes["code"].astype(str).str.zfill(6))
+    quotes = quotes[~quotes.index.duplicated(keep="last")]
+    cols = ["open", "close", "high", "low", "volume", "pre_close"]
+    quotes = quotes[cols].apply(pd.to_numeric, errors="coerce")     # 成交量与日线 K 线同为手
+
+    out: Dict[str, pd.DataFrame] = {}
+    for code in todo:
+        if code not in quotes.index:
+            continue
+        row = quotes.loc[code]
+        if row[["open", "close", "volume"]].isna().any() or row["open"] <= 0 or row["volume"] <= 0:
+            continue        # 停牌
+        last_close = store.manifest.last_bar(code)["close"].iloc[-1]
+        if not np.isclose(row["pre_close"], last_close, rtol=1e-6, atol=1e-3):
+            continue        # 除权或本地数据与数据源不一致
+        out[code] = pd.DataFrame({"date": [today], **{c: [float(row[c])] for c in cols[:-1]}})
+    return out
+
+
+def bulk_update(
+    plan: Dict[str, Optional[pd.DatetimeIndex]],
+    store: KlineStore,
+    calendar: pd.DatetimeIndex,
+    end: str,
+    datasource: str,
+    journal: Optional[RunJournal] = None,
+) -> Tuple[Counter, Dict[str, Optional[pd.DatetimeIndex]]]:
+    """
+    按交易日批量更新 *plan* 中只缺最近几个交易日的股票，返回 (结果计数, 仍需逐只抓取的计划)。
+    批量下载失败时不写入任何数据，整个计划原样交回逐只抓取。
+    """
+    manifest = store.manifest
+    sessions = calendar[calendar <= pd.to_datetime(end, format="%Y%m%d")]
+    candidates: Dict[str, Tuple[pd.Timestamp, pd.DatetimeIndex]] = {}
+    for code, gaps in plan.items():
+        if gaps is not None or not manifest.is_fresh(code, store.path(code)):
+            continue        # 有历史缺口或本地无有效记录
+        last = manifest.last_date(code)
+        if last is None:
+            continue
+        missing = sessions[sessions > last].difference(manifest.no_data(code))
+        if 0 < len(missing) <= BULK_MAX_DAYS:
+            candidates[code] = (last, missing)
+    if not candidates:
+        return Counter(), plan
+
+    try:
+        if datasource == "tushare":
+            fetched = _bulk_tushare(candidates)
+        elif datasource == "mootdx":
+            fetched = _bulk_mootdx(candidates, store)
+        else:
+            fetched = _bulk_akshare(candidates, store)
+    except Exception as e:
+        logger.warning("按交易日批量下载失败，全部改为逐只抓取: %s", e)
+        return Counter(), plan
+
+    stats: Counter = Counter()
+    written = set()
+    for code, rows in tqdm(fetched.items(), desc="批量写入"):
+        try:
+            store.append(code, drop_dup_columns(validate(rows)))
+        except Exception:
+            logger.exception("%s 批量写入失败，改为逐只抓取", code)
+            continue
+        written.add(code)
+        stats["appended"] += 1
+        if journal is not None:
+            journal.record(code, "appended", 1)
+    rest = {c: g for c, g in plan.items() if c not in written}
+    logger.info(
+        "按交易日批量更新：候选 %d 只，批量写入 %d 只，其余 %d 只逐只抓取",
+        len(candidates),
+        stats["appended"],
+        len(rest),
+    )
+    return stats, rest
+
 # ---------- 单只股票抓取 ---------- #
+
+# fetch_one 及异步抓取的结果状态 → 汇总时的显示名
+FETCH_STATUS = {
+    "written": "全量写入",
+    "appended": "追加",
+    "filled": "补缺",
+    "unchanged": "无变化",
+    "uptodate": "已最新",
+    "empty": "无数据",
+    "failed": "失败",
+    "circuit_open": "熔断跳过",
+}
+
+
+def _prepare_fetch(
+    code: str,
+    start: str,
+    end: str,
+    store: KlineStore,
+    incremental: bool,
+    gaps: Optional[pd.DatetimeIndex],
+) -> Optional[Tuple[str, Optional[pd.DataFrame]]]:
+    """
+    增量准备：返回 (请求起始日, 本地最后一根 K 线)，本地已是最新时返回 None。
+    最后一根 K 线在数据清单有效时直接取自清单，无需打开文件；请求从该日开始（含该日，用于比对），
+    有历史缺口时从最早的缺口开始。
+    """
+    path = store.path(code)
+    if not (incremental and store.exists(code)):
+        return start, None
+    try:
+        manifest = store.manifest
+        if manifest is not None and manifest.is_fresh(code, path):
+            last_row = manifest.last_bar(code)
+        else:
+            last_row = store.tail(code, 1)
+        if last_row is None or last_row.empty:
+            return start, None
+        last_date = last_row["date"].iloc[-1]
+        if last_date.date() > pd.to_datetime(end, format="%Y%m%d").date():
+            logger.debug("%s 已是最新，无需更新", code)
+            return None
+        gap_start = gaps[0] if gaps is not None and len(gaps) else None
+        return (last_date if gap_start is None else min(last_date, gap_start)).strftime("%Y%m%d"), last_row
+    except Exception:
+        logger.exception("读取 %s 失败，将重新下载", path)
+        return start, None
+
+
+def _store_fetched(
+    code: str,
+    new_df: pd.DataFrame,
+    last_row: Optional[pd.DataFrame],
+    store: KlineStore,
+    gaps: Optional[pd.DatetimeIndex],
+) -> str:
+    """
+    写入已校验的新数据并返回状态。*last_row* 为 None 时整体写入；否则历史未变，
+    只追加新日期，有缺口时把缺口内的数据并入后整体重写。
+    """
+    with TIMINGS.timed("write"):
+        if last_row is None:
+            store.write(code, new_df)
+            return "written"
+
+        last_date = last_row["date"].iloc[-1]
+        fresh = new_df[new_df["date"] > last_date]
+        holes = new_df[new_df["date"].isin(gaps)] if gaps is not None else new_df.iloc[:0]
+        if not holes.empty:
+            merged = (
+                pd.concat([drop_dup_columns(store.read(code)), holes, fresh], ignore_index=True)
+                .drop_duplicates(subset="date")
+                .sort_values("date")
+            )
+            store.write(code, merged)
+            status = "filled"
+        elif fresh.empty:
+            logger.debug("%s 无新数据", code)
+            status = "unchanged"
+        else:
+            store.append(code, fresh)
+            status = "appended"
+        if gaps is not None and store.manifest is not None:
+            # 数据源返回的区间内仍缺的交易日即为停牌等无数据日
+            store.manifest.mark_no_data(code, gaps.difference(pd.DatetimeIndex(new_df["date"])))
+        return status
+
+
 def fetch_one(
     code: str,
     start: str,
@@ -242,55 +1033,299 @@ def fetch_one(
     incremental: bool,
     datasource: str,
     freq_code: int,
-):    
-    csv_path = out_dir / f"{code}.csv"
+    store: Optional[KlineStore] = None,
+    gaps: Optional[pd.DatetimeIndex] = None,
+    journal: Optional[RunJournal] = None,
+) -> str:    
+    """
+    抓取单只股票并写入 *store*，返回结果状态（见 ``FETCH_STATUS``）。
+    *gaps* 为规划阶段发现的历史缺失交易日，此时从最早的缺口抓取到 *end*，
+    一次请求同时补缺口与追加新数据。给定 *journal* 时记录状态、尝试次数与最后一次错误。
+    """
+    store = store if store is not None else CsvStore(out_dir)
+    status, attempts, error = _fetch_one(code, start, end, incremental, datasource, freq_code, store, gaps)
+    if journal is not None:
+        journal.record(code, status, attempts, error)
+    return status
 
-    # 增量更新：若本地已有数据则从最后一天开始
-    if incremental and csv_path.exists():
-        try:
-            existing = pd.read_csv(csv_path, parse_dates=["date"])
-            last_date = existing["date"].max()
-            if last_date.date() > pd.to_datetime(end, format="%Y%m%d").date():
-                logger.debug("%s 已是最新，无需更新", code)
-                return
-            start = last_date.strftime("%Y%m%d")
-        except Exception:
-            logger.exception("读取 %s 失败，将重新下载", csv_path)
 
+def _fetch_one(
+    code: str,
+    start: str,
+    end: str,
+    incremental: bool,
+    datasource: str,
+    freq_code: int,
+    store: KlineStore,
+    gaps: Optional[pd.DatetimeIndex],
+) -> Tuple[str, int, Optional[str]]:
+    """fetch_one 的实现，返回 (状态, 尝试次数, 最后一次错误)。"""
+    prep = _prepare_fetch(code, start, end, store, incremental, gaps)
+    if prep is None:
+        return "uptodate", 0, None
+    req_start, last_row = prep
+    limiter = _limiter(datasource)
+
+    def request(s: str) -> pd.DataFrame:
+        # 单次请求（启用时带对冲）：失败直接抛出，由下面的循环统一重试并记录错误
+        return request_kline(code, s, end, datasource, freq_code)
+
+    error = None
     for attempt in range(1, 4):
         try:            
-            new_df = get_kline(code, start, end, "qfq", datasource, freq_code)
+            new_df = request(req_start)
             if new_df.empty:
                 logger.debug("%s 无新数据", code)
-                break
-            new_df = validate(new_df)
-            if csv_path.exists() and incremental:
-                old_df = pd.read_csv(
-                    csv_path,
-                    parse_dates=["date"],
-                    index_col=False
-                )
-                old_df = drop_dup_columns(old_df)
-                new_df = drop_dup_columns(new_df)
-                new_df = (
-                    pd.concat([old_df, new_df], ignore_index=True)
-                    .drop_duplicates(subset="date")
-                    .sort_values("date")
-                )
-            new_df.to_csv(csv_path, index=False)
-            break
-        except Exception:
+                return "empty", attempt, error
+            new_df = drop_dup_columns(validate(new_df))
+            if last_row is not None and not _tail_matches(new_df, last_row):
+                # 历史已变（如除权导致前复权价格整体调整）：重新抓取全量并整体重写
+                logger.info("%s 历史数据发生变化，重新下载 %s → %s", code, start, end)
+                new_df = request(start)
+                if new_df.empty:
+                    raise RuntimeError("全量数据为空")
+                return _store_fetched(code, drop_dup_columns(validate(new_df)), None, store, gaps), attempt, error
+            return _store_fetched(code, new_df, last_row, store, gaps), attempt, error
+        except CircuitOpen as e:
+            # 数据源熔断：不再重试与退避，由 _retry_after_cooldown 在冷却结束后统一再试
+            logger.warning("%s 跳过：%s", code, e)
+            TIMINGS.count("circuit_open")
+            return "circuit_open", attempt, f"{type(e).__name__}: {e}"
+        except Exception as e:
             logger.exception("%s 第 %d 次抓取失败", code, attempt)
-            time.sleep(random.uniform(1, 3) * attempt)  # 指数退避
-    else:
-        logger.error("%s 三次抓取均失败，已跳过！", code)
+            error = f"{type(e).__name__}: {e}"
+            TIMINGS.count("retry")
+            time.sleep(limiter.backoff(attempt))  # 指数退避
+    logger.error("%s 三次抓取均失败，已跳过！", code)
+    return "failed", 3, error
+
+
+def _wait_breaker(datasource: str) -> float:
+    """等 *datasource* 的熔断冷却结束（此后的第一个请求即半开探测），返回等待的秒数。"""
+    breaker = _limiter(datasource).breaker
+    t0 = time.monotonic()
+    while breaker.blocked():
+        time.sleep(min(max(breaker.retry_in(), 0.05), 1.0))
+    return time.monotonic() - t0
+
+
+def _retry_after_cooldown(
+    plan: Dict[str, Optional[pd.DatetimeIndex]],
+    datasource: str,
+    run: Callable[[Dict[str, Optional[pd.DatetimeIndex]]], Dict[str, str]],
+) -> Counter:
+    """
+    以 *run* 抓取 *plan*（返回 代码 → 状态），再处理因熔断未发出请求的股票：等一次冷却，
+    先单独抓取其中一只作为半开探测，探测成功、熔断恢复后再抓取其余股票；探测失败时
+    其余股票随即快速失败，最终记为熔断跳过（可 --retry-failed）。返回各结果状态的计数。
+    """
+    statuses = run(plan)
+    deferred = [code for code, status in statuses.items() if status == "circuit_open"]
+    if deferred:
+        logger.warning("%d 只股票因 %s 熔断未抓取，等待冷却结束后探测重试", len(deferred), datasource)
+        waited = _wait_breaker(datasource)
+        logger.info("熔断冷却等待 %.1fs，发出探测", waited)
+        probe, rest = deferred[:1], deferred[1:]
+        statuses.update(run({code: plan[code] for code in probe}))
+        if rest:
+            statuses.update(run({code: plan[code] for code in rest}))
+    return Counter(statuses.values())
+
+
+def fetch_all_threaded(
+    plan: Dict[str, Optional[pd.DatetimeIndex]],
+    start: str,
+    end: str,
+    store: KlineStore,
+    datasource: str,
+    freq_code: int,
+    workers: int,
+    journal: Optional[RunJournal] = None,
+) -> Counter:
+    """线程池逐只抓取 *plan* 中的全部股票，返回各结果状态的计数。"""
+
+    def run(part: Dict[str, Optional[pd.DatetimeIndex]]) -> Dict[str, str]:
+        statuses: Dict[str, str] = {}
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {
+                executor.submit(
+                    fetch_one,
+                    code,
+                    start,
+                    end,
+                    store.root,
+                    True,
+                    datasource,
+                    freq_code,
+                    store,
+                    gaps,
+                    journal,
+                ): code
+                for code, gaps in part.items()
+            }
+            for fut in tqdm(as_completed(futures), total=len(futures), desc="下载进度"):
+                statuses[futures[fut]] = fut.result()
+        return statuses
+
+    return _retry_after_cooldown(plan, datasource, run)
+
+# ---------- 异步抓取 ---------- #
+#
+# 数据源 SDK 都是同步阻塞的：每次请求放进线程池执行，而重试退避用 asyncio.sleep，
+# 等待期间不占线程；同一数据源的请求速率与在途数由其自适应限流器控制。下载好的数据交给
+# 单独的写入协程，在专用线程里落盘，网络与磁盘互不阻塞。
+
+
+async def _fetch_code_async(
+    code: str,
+    gaps: Optional[pd.DatetimeIndex],
+    start: str,
+    end: str,
+    store: KlineStore,
+    datasource: str,
+    freq_code: int,
+    net_pool: ThreadPoolExecutor,
+    queue: "asyncio.Queue",
+    statuses: Dict[str, str],
+    journal: Optional[RunJournal] = None,
+) -> None:
+    loop = asyncio.get_running_loop()
+
+    def done(status: str, attempts: int, error: Optional[str] = None) -> None:
+        statuses[code] = status
+        if journal is not None:
+            journal.record(code, status, attempts, error)
+
+    prep = await loop.run_in_executor(None, _prepare_fetch, code, start, end, store, True, gaps)
+    if prep is None:
+        done("uptodate", 0)
+        return
+    req_start, last_row = prep
+    limiter = _limiter(datasource)
+
+    async def request(s: str) -> pd.DataFrame:
+        return await request_kline_async(code, s, end, datasource, freq_code, net_pool)
+
+    error = None
+    for attempt in range(1, 4):
+        try:
+            new_df = await request(req_start)
+            if new_df.empty:
+                logger.debug("%s 无新数据", code)
+                done("empty", attempt, error)
+                return
+            new_df = drop_dup_columns(validate(new_df))
+            base = last_row
+            if last_row is not None and not _tail_matches(new_df, last_row):
+                logger.info("%s 历史数据发生变化，重新下载 %s → %s", code, start, end)
+                new_df = await request(start)
+                if new_df.empty:
+                    raise RuntimeError("全量数据为空")
+                new_df, base = drop_dup_columns(validate(new_df)), None
+            await queue.put((code, new_df, base, gaps, attempt, error))
+            return
+        except CircuitOpen as e:
+            logger.warning("%s 跳过：%s", code, e)
+            TIMINGS.count("circuit_open")
+            done("circuit_open", attempt, f"{type(e).__name__}: {e}")
+            return
+        except Exception as e:
+            logger.warning("%s 第 %d 次抓取失败: %s", code, attempt, e)
+            error = f"{type(e).__name__}: {e}"
+            TIMINGS.count("retry")
+            await asyncio.sleep(limiter.backoff(attempt))  # 退避期间不占用线程
+    logger.error("%s 三次抓取均失败，已跳过！", code)
+    done("failed", 3, error)
+
+
+async def _write_worker(
+    queue: "asyncio.Queue",
+    store: KlineStore,
+    io_pool: ThreadPoolExecutor,
+    statuses: Dict[str, str],
+    journal: Optional[RunJournal] = None,
+) -> None:
+    loop = asyncio.get_running_loop()
+    while True:
+        item = await queue.get()
+        if item is None:
+            return
+        code, new_df, last_row, gaps, attempts, error = item
+        try:
+            status = await loop.run_in_executor(io_pool, _store_fetched, code, new_df, last_row, store, gaps)
+        except Exception as e:
+            logger.exception("%s 写入失败", code)
+            status, error = "failed", f"{type(e).__name__}: {e}"
+        statuses[code] = status
+        if journal is not None:
+            journal.record(code, status, attempts, error)
+
+
+async def _fetch_all_async(
+    plan: Dict[str, Optional[pd.DatetimeIndex]],
+    start: str,
+    end: str,
+    store: KlineStore,
+    datasource: str,
+    freq_code: int,
+    concurrency: int,
+    journal: Optional[RunJournal] = None,
+) -> Dict[str, str]:
+    statuses: Dict[str, str] = {}
+    queue: asyncio.Queue = asyncio.Queue(maxsize=concurrency)      # 写入跟不上时对下载形成背压
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="fetch") as net_pool, \
+            ThreadPoolExecutor(max_workers=1, thread_name_prefix="write") as io_pool:
+        writer = asyncio.create_task(_write_worker(queue, store, io_pool, statuses, journal))
+        tasks = [
+            asyncio.create_task(
+                _fetch_code_async(
+                    code, gaps, start, end, store, datasource, freq_code, net_pool, queue, statuses, journal
+                )
+            )
+            for code, gaps in plan.items()
+        ]
+        with tqdm(total=len(tasks), desc="下载进度") as bar:
+            for fut in asyncio.as_completed(tasks):
+                await fut
+                bar.update()
+        await queue.put(None)
+        await writer
+    return statuses
+
+
+def fetch_all_async(
+    plan: Dict[str, Optional[pd.DatetimeIndex]],
+    start: str,
+    end: str,
+    store: KlineStore,
+    datasource: str,
+    freq_code: int,
+    concurrency: int = 64,
+    journal: Optional[RunJournal] = None,
+) -> Counter:
+    """
+    异步抓取 *plan* 中的全部股票，返回各结果状态的计数。*concurrency* 为请求线程数，
+    实际在途请求数由数据源限流器在其上限内自适应调整。
+    """
+    return _retry_after_cooldown(
+        plan,
+        datasource,
+        lambda part: asyncio.run(
+            _fetch_all_async(part, start, end, store, datasource, freq_code, concurrency, journal)
+        ),
+    )
 
 
 # ---------- 主入口 ---------- #
 
 def main():
     parser = argparse.ArgumentParser(description="按市值筛选 A 股并抓取历史 K 线")
-    parser.add_argument("--datasource", choices=["tushare", "akshare", "mootdx"], default="tushare", help="历史 K 线数据源")
+    parser.add_argument(
+        "--datasource",
+        choices=list(DATASOURCES),
+        default="tushare",
+        help="历史 K 线数据源；replay / replay2 为本地回放数据源（压测 / 回归测试用，见 --replay-*）",
+    )
     parser.add_argument("--frequency", type=int, choices=list(_FREQ_MAP.keys()), default=4, help="K线频率编码，参见说明")
     parser.add_argument("--exclude-gem", default=True, help="True则排除创业板/科创板/北交所")
     parser.add_argument("--min-mktcap", type=float, default=5e9, help="最小总市值（含），单位：元")
@@ -298,7 +1333,71 @@ def main():
     parser.add_argument("--start", default="20190101", help="起始日期 YYYYMMDD 或 'today'")
     parser.add_argument("--end", default="today", help="结束日期 YYYYMMDD 或 'today'")
     parser.add_argument("--out", default="./data", help="输出目录")
-    parser.add_argument("--workers", type=int, default=3, help="并发线程数")
+    parser.add_argument("--workers", type=int, help="thread 模式的并发上限；默认取数据源限流器的上限，实际并发自适应")
+    parser.add_argument(
+        "--format",
+        choices=["auto", *STORE_FORMATS],
+        default="auto",
+        help="K 线存储格式；auto 按输出目录已有文件识别，空目录为 csv",
+    )
+    parser.add_argument(
+        "--market-file",
+        nargs="?",
+        const=MARKET_FILE,
+        help=f"抓取完成后重建合并的内存映射行情文件；不带值时为 <out>/{MARKET_FILE}",
+    )
+    parser.add_argument("--no-calendar", action="store_true", help="不按交易日历规划，每只股票都发请求")
+    parser.add_argument(
+        "--mode",
+        choices=["thread", "async"],
+        default="thread",
+        help="thread=线程池逐只抓取（--workers）；async=异步流水线（--concurrency）",
+    )
+    parser.add_argument("--concurrency", type=int, default=64, help="async 模式下每个数据源的在途请求上限")
+    parser.add_argument("--mootdx-pool", type=int, help="Mootdx 长连接数；默认与并发上限相同（最多 16）")
+    parser.add_argument("--rate", type=float, help="数据源初始请求速率（次/秒）；默认见 RATE_LIMITS，运行中自适应")
+    parser.add_argument(
+        "--hedge",
+        nargs="?",
+        const="auto",
+        choices=["auto", *DATASOURCES],
+        help="日线请求超过主数据源 p95 延迟或出错时向该数据源发出对冲请求；不带值时见 HEDGE_SOURCES",
+    )
+    parser.add_argument(
+        "--breaker-threshold",
+        type=float,
+        default=0.5,
+        help="数据源最近 20 次请求的失败率达到该值时熔断：不再发请求，剩余股票直接记为失败（启用 --hedge 时改走对冲数据源）；0 为关闭",
+    )
+    parser.add_argument("--breaker-cooldown", type=float, default=30.0, help="熔断后等待多少秒发出探测请求，探测失败时翻倍")
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help=f"按 <out>/{JOURNAL_FILE} 续跑上次运行中未完成和失败的股票（沿用其日期范围）",
+    )
+    parser.add_argument("--retry-failed", action="store_true", help="只重试上次运行中失败的股票")
+    parser.add_argument(
+        "--bulk",
+        action="store_true",
+        help=f"日线增量按交易日批量下载全市场数据（{' / '.join(BULK_SOURCES)}），批量结果缺失的股票再逐只请求",
+    )
+    parser.add_argument(
+        "--mktcap-ttl",
+        type=float,
+        default=12.0,
+        help=f"市值快照缓存（<out>/{MKTCAP_FILE}）有效期，单位小时；过期时先用缓存筛选并在后台刷新",
+    )
+    replay = parser.add_argument_group("回放数据源（--datasource replay；replay2 用于对冲）")
+    replay.add_argument("--replay-dir", help="夹具目录（某次抓取的输出目录）；缺省时合成数据")
+    replay.add_argument("--replay-codes", type=int, default=5000, help="合成股票池的股票数")
+    replay.add_argument("--replay-seed", type=int, default=0, help="合成数据与故障注入的随机种子")
+    replay.add_argument("--replay-latency", type=float, default=0.0, help="每个请求的平均延迟，单位秒")
+    replay.add_argument("--replay-error-rate", type=float, default=0.0, help="请求随机失败的概率")
+    replay.add_argument("--replay-throttle-rate", type=float, default=0.0, help="请求随机返回限流的概率")
+    replay.add_argument("--replay-quota", type=float, default=0.0, help="每秒请求配额，超出即返回限流；0 为不限")
+    replay.add_argument("--replay2-latency", type=float, default=0.0, help="replay2 每个请求的平均延迟，单位秒")
+    replay.add_argument("--replay2-error-rate", type=float, default=0.0, help="replay2 请求随机失败的概率")
+    replay.add_argument("--replay2-throttle-rate", type=float, default=0.0, help="replay2 请求随机返回限流的概率")
     args = parser.parse_args()
 
     # ---------- Token 处理 ---------- #
@@ -308,59 +1407,209 @@ def main():
         global pro
         pro = ts.pro_api()
 
+    hedge = HEDGE_SOURCES[args.datasource] if args.hedge == "auto" else args.hedge
+    if hedge == args.datasource:
+        parser.error(f"--hedge 需要另一个数据源，不能与 --datasource 相同（{hedge}）")
+
+    if {args.datasource, hedge} & set(REPLAY_SOURCES):
+        # 两个回放实例数据相同，延迟与故障各自注入
+        data = dict(fixture_dir=args.replay_dir, codes=args.replay_codes, seed=args.replay_seed)
+        configure_replay(
+            "replay",
+            **data,
+            latency=args.replay_latency,
+            error_rate=args.replay_error_rate,
+            throttle_rate=args.replay_throttle_rate,
+            quota=args.replay_quota,
+        )
+        configure_replay(
+            "replay2",
+            **data,
+            fault_seed=args.replay_seed + 1,
+            latency=args.replay2_latency,
+            error_rate=args.replay2_error_rate,
+            throttle_rate=args.replay2_throttle_rate,
+        )
+
+    # ---------- 限流、熔断与连接池 ---------- #
+    configure_breakers(failure_rate=args.breaker_threshold, cooldown=args.breaker_cooldown)
+    limits = dict(RATE_LIMITS.get(args.datasource, {}))
+    cap = args.concurrency if args.mode == "async" else args.workers
+    if cap:
+        limits["max_concurrency"] = cap
+    if args.rate:
+        limits["rate"] = args.rate
+        limits["max_rate"] = max(args.rate, limits.get("max_rate", args.rate))
+    limiter = configure_limiter(args.datasource, **limits)
+    if hedge:
+        configure_hedge(args.datasource, hedge, limiter.max_concurrency)
+    if "mootdx" in (args.datasource, hedge):
+        configure_pool(args.mootdx_pool or min(limiter.max_concurrency, 16))
+
     # ---------- 日期解析 ---------- #
     start = dt.date.today().strftime("%Y%m%d") if args.start.lower() == "today" else args.start
     end = dt.date.today().strftime("%Y%m%d") if args.end.lower() == "today" else args.end
 
     out_dir = Path(args.out)
     out_dir.mkdir(parents=True, exist_ok=True)
+    store = open_store(out_dir, args.format, manifest=True)
+    store.manifest.sync(store)       # 清单完好时只做 stat，不打开数据文件
 
-    # ---------- 市值快照 & 股票池 ---------- #
-    mktcap_df = _get_mktcap_ak()    
+    # ---------- 续跑 / 新的运行 ---------- #
+    journal_path = out_dir / JOURNAL_FILE
+    mktcap_refresh = None
+    calendar = None
+    if args.resume or args.retry_failed:
+        if not journal_path.exists():
+            logger.error("运行日志 %s 不存在，无法续跑", journal_path)
+            sys.exit(1)
+        journal = RunJournal.load(journal_path)
+        # 沿用原运行的日期与频率（数据源可以换），不重新筛选股票池、不重新规划
+        start, end, args.frequency = journal.meta["start"], journal.meta["end"], journal.meta["freq"]
+        plan = journal.select(["failed"] if args.retry_failed else ["pending", "failed"])
+        codes = list(plan)
+        logger.info(
+            "续跑 %s 的运行：%s",
+            journal_path,
+            " ".join(f"{k}:{v}" for k, v in sorted(journal.counts().items())),
+        )
+        if not plan:
+            logger.info("没有需要%s的股票", "重试" if args.retry_failed else "续跑")
+            return
+    else:
+        # ---------- 市值快照 & 股票池 ---------- #
+        # 缓存未过期直接使用；过期则先按旧快照筛选，刷新与 K 线下载并行，结束后补抓新进入股票池的代码
+        ttl = args.mktcap_ttl * 3600
+        mktcap_df, age = load_mktcap_snapshot(out_dir, ttl)
+        if mktcap_df is None:
+            mktcap_df = refresh_mktcap_snapshot(out_dir, args.datasource)
+        elif age > ttl:
+            logger.info("市值快照已缓存 %.1f 小时，先按缓存筛选，后台刷新", age / 3600)
+            bg_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="mktcap")
+            mktcap_refresh = bg_pool.submit(refresh_mktcap_snapshot, out_dir, args.datasource)
+            bg_pool.shutdown(wait=False)
 
-    codes_from_filter = get_constituents(
-        args.min_mktcap,
-        args.max_mktcap,
-        args.exclude_gem,
-        mktcap_df=mktcap_df,
-    )    
-    # 加上本地已有的股票，确保旧数据也能更新
-    local_codes = [p.stem for p in out_dir.glob("*.csv")]
-    codes = sorted(set(codes_from_filter) | set(local_codes))
+        codes_from_filter = get_constituents(
+            args.min_mktcap,
+            args.max_mktcap,
+            args.exclude_gem,
+            mktcap_df=mktcap_df,
+        )    
+        # 加上本地已有的股票，确保旧数据也能更新
+        local_codes = store.manifest.codes()
+        codes = sorted(set(codes_from_filter) | set(local_codes))
+
+        if not codes:
+            logger.error("筛选结果为空，请调整参数！")
+            sys.exit(1)
 
-    if not codes:
-        logger.error("筛选结果为空，请调整参数！")
-        sys.exit(1)
+        # ---------- 交易日历规划（仅日线） ---------- #
+        if not args.no_calendar and _FREQ_MAP[args.frequency] == "day":
+            calendar = load_trade_calendar(out_dir, end, args.datasource)
+        plan = plan_fetch(codes, store, calendar, end) if calendar is not None else dict.fromkeys(codes)
+
+        meta = {"start": start, "end": end, "datasource": args.datasource, "freq": args.frequency}
+        journal = RunJournal.start(journal_path, meta, plan)
 
     logger.info(
-        "开始抓取 %d 支股票 | 数据源:%s | 频率:%s | 日期:%s → %s",
-        len(codes),
+        "开始抓取 %d 支股票 | 数据源:%s | 频率:%s | 格式:%s | 模式:%s | 日期:%s → %s",
+        len(plan),
         args.datasource,
         _FREQ_MAP[args.frequency],
+        store.name,
+        args.mode,
         start,
         end,
     )
 
-    # ---------- 多线程抓取 ---------- #
-    with ThreadPoolExecutor(max_workers=args.workers) as executor:
-        futures = [
-            executor.submit(
-                fetch_one,
-                code,
-                start,
-                end,
-                out_dir,
-                True,
-                args.datasource,
-                args.frequency,
+    def run(plan: Dict[str, Optional[pd.DatetimeIndex]]) -> Counter:
+        if args.mode == "async":
+            # ---------- 异步抓取 ---------- #
+            return fetch_all_async(
+                plan, start, end, store, args.datasource, args.frequency, args.concurrency, journal
             )
-            for code in codes
-        ]
-        for _ in tqdm(as_completed(futures), total=len(futures), desc="下载进度"):
-            pass
+        # ---------- 多线程抓取 ---------- #
+        return fetch_all_threaded(
+            plan, start, end, store, args.datasource, args.frequency, limiter.max_concurrency, journal
+        )
 
+    t0 = time.perf_counter()
+    stats: Counter = Counter()
+    rest = plan
+    if args.bulk:
+        # ---------- 按交易日批量更新 ---------- #
+        if calendar is None or args.datasource not in BULK_SOURCES:
+            logger.warning(
+                "--bulk 仅用于按交易日历规划的日线抓取（数据源 %s），本次逐只抓取", " / ".join(BULK_SOURCES)
+            )
+        else:
+            stats, rest = bulk_update(plan, store, calendar, end, args.datasource, journal)
+    stats += run(rest)
+
+    # ---------- 后台刷新的市值快照 ---------- #
+    if mktcap_refresh is not None:
+        try:
+            fresh_codes = get_constituents(
+                args.min_mktcap, args.max_mktcap, args.exclude_gem, mktcap_df=mktcap_refresh.result()
+            )
+        except Exception as e:
+            logger.warning("后台刷新市值快照失败，本次沿用缓存: %s", e)
+        else:
+            extra = sorted(set(fresh_codes) - set(codes))
+            if extra:
+                logger.info("刷新后的股票池新增 %d 只，补充抓取", len(extra))
+                journal.add(dict.fromkeys(extra))
+                stats += run(dict.fromkeys(extra))
+                plan.update(dict.fromkeys(extra))
+    store.manifest.save()
+    journal.close()
+    elapsed = time.perf_counter() - t0
+
+    logger.info(
+        "抓取完成：%d 只，用时 %.1fs，%.2f codes/s | %s",
+        len(plan),
+        elapsed,
+        len(plan) / elapsed if elapsed > 0 else 0.0,
+        " ".join(f"{FETCH_STATUS[k]}:{stats[k]}" for k in FETCH_STATUS if stats[k]),
+    )
+    logger.info("限流 %s：%s", args.datasource, " ".join(f"{k}={v}" for k, v in limiter.summary().items()))
+    if TIMINGS.latencies:
+        logger.info(
+            "各阶段耗时（各线程合计）：%s | 请求延迟 %s | 重试 %d 次",
+            " ".join(f"{k}={v:.1f}s" for k, v in TIMINGS.summary().items()),
+            "/".join(f"{k}={v}ms" for k, v in TIMINGS.percentiles().items()),
+            TIMINGS.counts["retry"],
+        )
+    if hedge:
+        logger.info(
+            "对冲 %s：超时对冲 %d 次、出错回退 %d 次，对冲数据源胜出 %d 次 | 限流 %s",
+            hedge,
+            TIMINGS.counts["hedge"],
+            TIMINGS.counts["failover"],
+            TIMINGS.counts["hedge_win"],
+            " ".join(f"{k}={v}" for k, v in _limiter(hedge).summary().items()),
+        )
+    for ds in dict.fromkeys([args.datasource, hedge or args.datasource]):
+        _log_breaker(ds)
+    if stats["circuit_open"]:
+        logger.warning("熔断探测未能恢复，%d 只股票未抓取，可用 --retry-failed 重试", stats["circuit_open"])
+    states = journal.counts()
+    if states["failed"] or states["pending"]:
+        for code, attempts, error in journal.failures():
+            logger.warning("失败 %s（累计尝试 %d 次）：%s", code, attempts, error)
+        logger.warning(
+            "未完成 %d 只、失败 %d 只，可用 --resume 续跑或 --retry-failed 仅重试失败的股票",
+            states["pending"],
+            states["failed"],
+        )
     logger.info("全部任务完成，数据已保存至 %s", out_dir.resolve())
 
+    if args.market_file:
+        mf_path = Path(args.market_file)
+        mf_path = mf_path if mf_path.is_absolute() else out_dir / mf_path
+        n = build_market_file(store, mf_path)
+        logger.info("已合并 %d 只股票 → %s", n, mf_path.resolve())
+
 
 if __name__ == "__main__":
     main()
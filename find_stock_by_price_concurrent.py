@@ -15,15 +15,18 @@ import os
 from functools import partial
 import time
 
+from kline_store import list_kline_files, read_kline_file
+from market_file import MARKET_FILE, open_market_file
+
 # 配置日志
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 def load_single_stock_data(csv_file: Path) -> Optional[Tuple[str, pd.DataFrame]]:
-    """加载单个股票数据文件"""
+    """加载单个股票数据文件（CSV / Feather / Parquet）"""
     try:
         stock_code = csv_file.stem
-        df = pd.read_csv(csv_file, parse_dates=['date'])
+        df = read_kline_file(csv_file)
         if not df.empty:
             return (stock_code, df)
     except Exception as e:
@@ -36,8 +39,9 @@ def load_stock_data_concurrent(data_dir: Path, max_workers: Optional[int] = None
         logger.error(f"数据目录不存在: {data_dir}")
         return []
     
-    csv_files = list(data_dir.glob("**/*.csv"))
-    logger.info(f"找到 {len(csv_files)} 个CSV文件")
+    # 同一代码存在多种格式时优先读取列式文件
+    csv_files = list_kline_files(data_dir, recursive=True)
+    logger.info(f"找到 {len(csv_files)} 个行情文件")
     
     if not csv_files:
         return []
@@ -67,6 +71,13 @@ def load_stock_data_concurrent(data_dir: Path, max_workers: Optional[int] = None
     logger.info(f"成功加载 {len(stock_data)} 只股票的数据")
     return stock_data
 
+def load_stock_data_mmap(market_file: Path) -> List[Tuple[str, pd.DataFrame]]:
+    """从合并的内存映射行情文件加载：各股票 DataFrame 直接引用映射内存，无需读文件"""
+    mf = open_market_file(market_file)
+    stock_data = [(code, mf.read(code)) for code in mf.codes()]
+    logger.info(f"从 {market_file} 映射 {len(stock_data)} 只股票的数据")
+    return stock_data
+
 def find_by_price_single_stock(
     stock_item: Tuple[str, pd.DataFrame],
     target_price: float,
@@ -117,6 +128,18 @@ def find_by_price_single_stock(
     
     return results
 
+def find_by_price_market_chunk(
+    market_file: str,
+    codes: List[str],
+    **kwargs: Any
+) -> List[Tuple[str, float, str]]:
+    """worker 内自行映射合并文件（每进程一次），按代码取零拷贝视图查找"""
+    mf = open_market_file(Path(market_file))
+    results = []
+    for code in codes:
+        results.extend(find_by_price_single_stock((code, mf.read(code)), **kwargs))
+    return results
+
 def find_by_price_concurrent(
     stock_data: List[Tuple[str, pd.DataFrame]], 
     target_price: float,
@@ -124,7 +147,8 @@ def find_by_price_concurrent(
     start_date: Optional[str] = None,
     end_date: Optional[str] = None,
     tolerance: float = 0.01,
-    max_workers: Optional[int] = None
+    max_workers: Optional[int] = None,
+    market_file: Optional[Path] = None
 ) -> List[Tuple[str, float, str]]:
     """
     并发查找历史价格等于指定价格的股票
@@ -137,6 +161,7 @@ def find_by_price_concurrent(
         end_date: 结束日期 (YYYY-MM-DD)
         tolerance: 价格容差
         max_workers: 最大并发数
+        market_file: 合并行情文件；指定时 worker 直接映射该文件，不再向子进程传送 DataFrame
         
     Returns:
         符合条件的股票列表 (代码, 价格, 日期)
@@ -166,6 +191,30 @@ def find_by_price_concurrent(
     )
     
     all_results = []
+
+    if market_file is not None:
+        codes = [code for code, _ in stock_data]
+        chunk = max(1, -(-len(codes) // (max_workers * 4)))
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            futures = [
+                executor.submit(
+                    find_by_price_market_chunk,
+                    str(market_file),
+                    codes[i:i + chunk],
+                    target_price=target_price,
+                    price_type=price_type,
+                    start_date=start_date,
+                    end_date=end_date,
+                    tolerance=tolerance,
+                )
+                for i in range(0, len(codes), chunk)
+            ]
+            for future in as_completed(futures):
+                try:
+                    all_results.extend(future.result())
+                except Exception as e:
+                    logger.warning(f"处理合并文件分块时出错: {e}")
+        return sorted(all_results, key=lambda x: (x[0], x[2]))
     
     # 使用进程池并发查找
     with ProcessPoolExecutor(max_workers=max_workers) as executor:
@@ -214,6 +263,8 @@ def main():
     parser.add_argument("--end-date", help="结束日期 (YYYY-MM-DD)")
     parser.add_argument("--tolerance", type=float, default=0.00, help="价格容差 (默认: 0.01)")
     parser.add_argument("--max-workers", type=int, help="最大并发数 (默认: CPU核心数)")
+    parser.add_argument("--market-file", nargs="?", const=MARKET_FILE,
+                       help=f"使用合并的内存映射行情文件 (不带值时为 <data-dir>/{MARKET_FILE})")
     parser.add_argument("--benchmark", action="store_true", help="显示性能基准测试")
     
     args = parser.parse_args()
@@ -222,8 +273,17 @@ def main():
     
     # 加载数据
     data_dir = Path(args.data_dir)
-    logger.info("开始并发加载股票数据...")
-    stock_data = load_stock_data_concurrent(data_dir, args.max_workers)
+    market_file = None
+    if args.market_file:
+        market_file = Path(args.market_file)
+        market_file = market_file if market_file.is_absolute() else data_dir / market_file
+        if not market_file.exists():
+            logger.error(f"合并行情文件不存在: {market_file}")
+            return
+        stock_data = load_stock_data_mmap(market_file)
+    else:
+        logger.info("开始并发加载股票数据...")
+        stock_data = load_stock_data_concurrent(data_dir, args.max_workers)
     
     if not stock_data:
         logger.error("没有找到可用的股票数据")
@@ -243,7 +303,8 @@ def main():
             args.start_date,
             args.end_date,
             args.tolerance,
-            args.max_workers
+            args.max_workers,
+            market_file
         )
         search_time = time.time() - search_start_time
         logger.info(f"查找完成，耗时: {search_time:.2f}秒")
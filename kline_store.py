@@ -0,0 +1,558 @@
+from __future__ import annotations
+
+import argparse
+import io
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Type
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger("kline_store")
+
+# --------------------------- K 线存储 --------------------------- #
+#
+# 每只股票一个文件，目录即“库”。CSV 为原有格式；Feather / Parquet 为列式格式，
+# 列类型固定（date 为 datetime64[ns]，价格与成交量为 float64）并带 zstd 压缩，
+# 读取时无需逐行解析日期。列式格式依赖 pyarrow，仅在使用时导入。
+
+KLINE_COLUMNS = ["date", "open", "close", "high", "low", "volume"]
+
+# 与行情文件放在同一目录、但不是 K 线的辅助文件（交易日历、市值快照缓存），列举代码时跳过
+CALENDAR_FILE = "trade_calendar.csv"
+MKTCAP_FILE = "mktcap_snapshot.csv"
+AUX_FILES = frozenset({CALENDAR_FILE, MKTCAP_FILE})
+
+
+def normalize(df: pd.DataFrame) -> pd.DataFrame:
+    """统一列类型：date → datetime64[ns]，其余数值列 → float64；保留额外列。"""
+    df = df.reset_index(drop=True)
+    if "date" in df.columns and not pd.api.types.is_datetime64_ns_dtype(df["date"]):
+        df["date"] = pd.to_datetime(df["date"]).astype("datetime64[ns]")
+    for col in df.columns:
+        if col != "date" and pd.api.types.is_numeric_dtype(df[col]) and df[col].dtype != "float64":
+            df[col] = df[col].astype("float64")
+    return df
+
+
+class KlineStore:
+    """K 线存储基类：``read`` / ``write`` 以股票代码为键。"""
+
+    suffix = ""
+    name = ""
+
+    def __init__(self, root: Path, manifest: Optional["Manifest"] = None) -> None:
+        self.root = Path(root)
+        self.manifest = manifest     # 若设置，write / append 时同步更新数据清单
+
+    def path(self, code: str) -> Path:
+        return self.root / f"{code}{self.suffix}"
+
+    def codes(self) -> List[str]:
+        return sorted(p.stem for p in self.root.glob(f"*{self.suffix}") if p.name not in AUX_FILES)
+
+    def exists(self, code: str) -> bool:
+        return self.path(code).exists()
+
+    def read(self, code: str) -> pd.DataFrame:
+        return self._read(self.path(code))
+
+    def write(self, code: str, df: pd.DataFrame) -> None:
+        """先写临时文件再替换，读者不会看到写了一半的文件。"""
+        self.root.mkdir(parents=True, exist_ok=True)
+        path = self.path(code)
+        tmp = path.with_name(path.name + ".tmp")
+        df = normalize(df)
+        stored = self._write(df, tmp)
+        tmp.replace(path)
+        if self.manifest is not None:
+            self.manifest.record(code, stored() if stored is not None else df, path)
+
+    def tail(self, code: str, n: int = 1) -> pd.DataFrame:
+        """最后 *n* 行。"""
+        return self.read(code).tail(n).reset_index(drop=True)
+
+    def append(self, code: str, df: pd.DataFrame) -> None:
+        """
+        追加日期晚于已有数据的新行。列式文件无法原地追加，默认读出后整体重写；
+        CSV 覆盖为真正的追加写。
+        """
+        if not self.exists(code):
+            self.write(code, df)
+            return
+        self.write(code, pd.concat([self.read(code), df], ignore_index=True))
+
+    def _read(self, path: Path) -> pd.DataFrame:
+        raise NotImplementedError
+
+    def _write(self, df: pd.DataFrame, path: Path) -> Optional[Callable[[], pd.DataFrame]]:
+        """
+        写入 *path*。写入有损（读回与 *df* 不完全相同）的格式返回一个函数，
+        调用时给出读回的样子，供数据清单按实际存储的数值登记；无损格式返回 None。
+        """
+        raise NotImplementedError
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({str(self.root)!r})"
+
+
+class CsvStore(KlineStore):
+    suffix = ".csv"
+    name = "csv"
+
+    def _read(self, path: Path) -> pd.DataFrame:
+        return pd.read_csv(path, parse_dates=["date"], index_col=False)
+
+    def _write(self, df: pd.DataFrame, path: Path) -> Callable[[], pd.DataFrame]:
+        text = df.to_csv(index=False)
+        with path.open("w", encoding="utf-8", newline="") as f:
+            f.write(text)
+        # 浮点数经文本往返可能差一个 ulp，清单按读回的数值登记
+        return lambda: pd.read_csv(io.StringIO(text), parse_dates=["date"], index_col=False)
+
+    def tail(self, code: str, n: int = 1) -> pd.DataFrame:
+        """从文件末尾按块向前读取，只解析表头与最后 *n* 行。"""
+        path = self.path(code)
+        with path.open("rb") as f:
+            header = f.readline()
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+            block = 4096
+            while True:
+                pos = max(len(header), size - block)
+                f.seek(pos)
+                lines = f.read(size - pos).splitlines()
+                if pos > len(header):
+                    lines = lines[1:]            # 块首行可能不完整
+                lines = [ln for ln in lines if ln.strip()]
+                if len(lines) >= n or pos == len(header):
+                    break
+                block *= 4
+        body = b"\n".join(lines[-n:]) if n > 0 else b""
+        return pd.read_csv(io.BytesIO(header + body), parse_dates=["date"], index_col=False)
+
+    def append(self, code: str, df: pd.DataFrame) -> None:
+        """按已有表头的列顺序追加写入；列不一致时退回整体重写。"""
+        path = self.path(code)
+        if not path.exists():
+            self.write(code, df)
+            return
+        with path.open("rb") as f:
+            header = f.readline().decode("utf-8").strip().split(",")
+        df = normalize(df)
+        if sorted(header) != sorted(df.columns):
+            super().append(code, df)
+            return
+        buf = df[header].to_csv(index=False, header=False).encode("utf-8")
+        with path.open("rb+") as f:
+            f.seek(0, os.SEEK_END)
+            if f.tell() > 0:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    buf = b"\n" + buf
+            f.write(buf)
+        if self.manifest is not None:
+            stored = pd.read_csv(
+                io.BytesIO(",".join(header).encode("utf-8") + b"\n" + buf.lstrip(b"\n")),
+                parse_dates=["date"],
+                index_col=False,
+            )
+            self.manifest.record_append(code, stored, path)
+
+
+def _require_pyarrow(fmt: str) -> None:
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError as e:
+        raise ImportError(f"{fmt} 格式需要 pyarrow，请先 `pip install pyarrow`") from e
+
+
+class FeatherStore(KlineStore):
+    suffix = ".feather"
+    name = "feather"
+
+    def __init__(self, root: Path, manifest: Optional["Manifest"] = None) -> None:
+        _require_pyarrow(self.name)
+        super().__init__(root, manifest)
+
+    def _read(self, path: Path) -> pd.DataFrame:
+        from pyarrow import feather
+
+        # 单文件很小，pyarrow 内部多线程反而更慢；并发由调用方负责
+        return feather.read_feather(path, use_threads=False)
+
+    def _write(self, df: pd.DataFrame, path: Path) -> None:
+        df.to_feather(path, compression="zstd")
+
+
+class ParquetStore(KlineStore):
+    suffix = ".parquet"
+    name = "parquet"
+
+    def __init__(self, root: Path, manifest: Optional["Manifest"] = None) -> None:
+        _require_pyarrow(self.name)
+        super().__init__(root, manifest)
+
+    def _read(self, path: Path) -> pd.DataFrame:
+        import pyarrow.parquet as pq
+
+        return pq.read_table(path, use_threads=False).to_pandas()
+
+    def _write(self, df: pd.DataFrame, path: Path) -> None:
+        df.to_parquet(path, compression="zstd", index=False)
+
+
+# --------------------------- 数据清单 --------------------------- #
+
+MANIFEST_FILE = "manifest.json"
+
+
+def _mix64(x: np.ndarray) -> np.ndarray:
+    """splitmix64 末端混合。"""
+    x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return x ^ (x >> np.uint64(31))
+
+
+def frame_hash(df: pd.DataFrame) -> str:
+    """
+    内容哈希：``KLINE_COLUMNS`` 各行哈希之和（mod 2^64）。与行序、列序无关，
+    追加新行时可在旧值上累加，无需重读整个文件。
+    """
+    if df.empty:
+        return f"{0:016x}"
+    acc = np.zeros(len(df), dtype=np.uint64)
+    with np.errstate(over="ignore"):
+        for i, col in enumerate(KLINE_COLUMNS):
+            if col not in df.columns:
+                continue
+            if col == "date":
+                bits = df[col].to_numpy(dtype="datetime64[ns]").view(np.uint64)
+            else:
+                v = df[col].to_numpy(dtype="float64") + 0.0          # -0.0 → 0.0
+                bits = np.where(np.isnan(v), np.nan, v).view(np.uint64)   # NaN 统一为同一比特
+            acc = _mix64(acc ^ _mix64(bits + np.uint64(i + 1) * np.uint64(0x9E3779B97F4A7C15)))
+        total = int(np.add.reduce(acc, dtype=np.uint64))
+    return f"{total:016x}"
+
+
+def _price_bounds(df: pd.DataFrame) -> tuple:
+    lo = df["low"] if "low" in df.columns else df["close"]
+    hi = df["high"] if "high" in df.columns else df["close"]
+    return float(np.nanmin(lo.to_numpy(dtype=float))), float(np.nanmax(hi.to_numpy(dtype=float)))
+
+
+class Manifest:
+    """
+    数据清单：每只股票的首末日期、行数、价格区间、内容哈希与最后一根 K 线，
+    以及已确认无数据的交易日（停牌等），规划抓取、跳过已最新的股票、
+    确定最新交易日时只需读这一个小文件。
+
+    每个条目记录对应文件的 mtime / size，文件在清单之外被改动时条目即失效
+    （``is_fresh`` 为 False），由 ``sync`` 重新读取。写入先写临时文件再替换；
+    多线程共享同一实例，更新在内存中进行，按 *flush_interval* 秒节流落盘。
+    """
+
+    def __init__(self, path: Path, fmt: str, flush_interval: float = 10.0) -> None:
+        self.path = Path(path)
+        self.format = fmt
+        self.flush_interval = flush_interval
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._last_flush = time.monotonic()
+
+    @classmethod
+    def load(cls, path: Path, fmt: str, flush_interval: float = 10.0) -> "Manifest":
+        """读取清单；文件缺失、损坏或格式不符时返回空清单。"""
+        m = cls(path, fmt, flush_interval)
+        if m.path.exists():
+            try:
+                raw = json.loads(m.path.read_text(encoding="utf-8"))
+                if raw.get("format") == fmt:
+                    m.entries = raw.get("codes", {})
+            except Exception as e:  # noqa: BLE001
+                logger.warning("数据清单 %s 无法读取，将重建：%s", m.path, e)
+        return m
+
+    # ---------- 查询 ---------- #
+    def codes(self) -> List[str]:
+        return sorted(self.entries)
+
+    def get(self, code: str) -> Optional[Dict[str, Any]]:
+        return self.entries.get(code)
+
+    def is_fresh(self, code: str, path: Path) -> bool:
+        e = self.entries.get(code)
+        if e is None:
+            return False
+        try:
+            st = path.stat()
+        except FileNotFoundError:
+            return False
+        return e["mtime_ns"] == st.st_mtime_ns and e["size"] == st.st_size
+
+    def last_date(self, code: str) -> Optional[pd.Timestamp]:
+        e = self.entries.get(code)
+        return pd.Timestamp(e["last"]) if e and e["last"] else None
+
+    def last_bar(self, code: str) -> Optional[pd.DataFrame]:
+        """最后一根 K 线（单行 DataFrame），与 ``KlineStore.tail(code, 1)`` 等价。"""
+        e = self.entries.get(code)
+        if not e or not e["last"]:
+            return None
+        row = {"date": pd.Timestamp(e["last"]), **e["last_bar"]}
+        return pd.DataFrame([row]).astype({c: "float64" for c in e["last_bar"]})
+
+    def max_last_date(self, codes: Optional[List[str]] = None) -> Optional[pd.Timestamp]:
+        keys = self.entries if codes is None else [c for c in codes if c in self.entries]
+        dates = [self.entries[c]["last"] for c in keys if self.entries[c]["last"]]
+        return pd.Timestamp(max(dates)) if dates else None
+
+    # ---------- 更新 ---------- #
+    def record(self, code: str, df: pd.DataFrame, path: Path) -> None:
+        """以整份数据 *df* 重建 *code* 的条目。"""
+        entry: Dict[str, Any] = {"rows": int(len(df)), "hash": frame_hash(df)}
+        if df.empty:
+            entry.update(first=None, last=None, min=None, max=None, last_bar={})
+        else:
+            lo, hi = _price_bounds(df)
+            last = df.iloc[-1]
+            entry.update(
+                first=pd.Timestamp(df["date"].iloc[0]).isoformat(),
+                last=pd.Timestamp(last["date"]).isoformat(),
+                min=lo,
+                max=hi,
+                last_bar={c: float(last[c]) for c in df.columns if c != "date"},
+            )
+        old = self.entries.get(code)
+        if old and old.get("no_data"):
+            entry["no_data"] = old["no_data"]
+        self._put(code, entry, path)
+
+    def mark_no_data(self, code: str, dates: Iterable) -> None:
+        """
+        记录本地缺失、且已向数据源确认无数据的交易日（如停牌），
+        之后规划抓取时不再当作缺口。
+        """
+        new = [pd.Timestamp(d).isoformat() for d in dates]
+        if not new:
+            return
+        with self._lock:
+            e = self.entries.get(code)
+            if e is None:
+                return
+            e["no_data"] = sorted(set(e.get("no_data", [])) | set(new))
+            self._dirty = True
+
+    def no_data(self, code: str) -> pd.DatetimeIndex:
+        e = self.entries.get(code) or {}
+        return pd.DatetimeIndex(pd.to_datetime(e.get("no_data", [])))
+
+    def record_append(self, code: str, df: pd.DataFrame, path: Path) -> None:
+        """在已有条目上累加追加的行 *df*；条目缺失时只能整体重建。"""
+        old = self.entries.get(code)
+        if old is None or not old["last"] or df.empty:
+            self._put(code, None, path)       # 作废，待 sync 重新读取
+            return
+        lo, hi = _price_bounds(df)
+        last = df.iloc[-1]
+        entry = dict(
+            old,
+            rows=old["rows"] + int(len(df)),
+            hash=f"{(int(old['hash'], 16) + int(frame_hash(df), 16)) % 2**64:016x}",
+            last=pd.Timestamp(last["date"]).isoformat(),
+            min=min(old["min"], lo),
+            max=max(old["max"], hi),
+            last_bar={c: float(last[c]) for c in df.columns if c != "date"},
+        )
+        self._put(code, entry, path)
+
+    def _put(self, code: str, entry: Optional[Dict[str, Any]], path: Path) -> None:
+        if entry is not None:
+            st = path.stat()
+            entry.update(mtime_ns=st.st_mtime_ns, size=st.st_size)
+        with self._lock:
+            if entry is None:
+                self.entries.pop(code, None)
+            else:
+                self.entries[code] = entry
+            self._dirty = True
+            due = time.monotonic() - self._last_flush >= self.flush_interval
+        if due:
+            self.save()
+
+    def sync(self, store: "KlineStore", workers: int = 4) -> int:
+        """
+        与目录对齐：补录缺失或已失效的条目，删除文件已不存在的条目。
+        返回重新读取的文件数（清单完好时为 0，只做 stat）。
+        """
+        codes = store.codes()
+        stale = [c for c in codes if not self.is_fresh(c, store.path(c))]
+
+        def _one(code: str) -> None:
+            try:
+                self.record(code, store.read(code), store.path(code))
+            except Exception as e:  # noqa: BLE001
+                logger.warning("读取 %s 失败，清单中跳过：%s", code, e)
+
+        if stale:
+            logger.info("数据清单：重新读取 %d / %d 个文件", len(stale), len(codes))
+            with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+                list(executor.map(_one, stale))
+        gone = set(self.entries) - set(codes)
+        if gone:
+            with self._lock:
+                for code in gone:
+                    self.entries.pop(code, None)
+                self._dirty = True
+        self.save()
+        return len(stale)
+
+    def save(self) -> None:
+        """原子写入（仅在有改动时）。"""
+        with self._lock:
+            if not self._dirty:
+                return
+            payload = json.dumps(
+                {"version": 1, "format": self.format, "codes": self.entries},
+                ensure_ascii=False,
+                separators=(",", ":"),
+            )
+            self._dirty = False
+            self._last_flush = time.monotonic()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_name(self.path.name + f".{os.getpid()}.{threading.get_ident()}.tmp")
+        tmp.write_text(payload, encoding="utf-8")
+        tmp.replace(self.path)
+
+
+STORE_FORMATS: Dict[str, Type[KlineStore]] = {
+    "csv": CsvStore,
+    "feather": FeatherStore,
+    "parquet": ParquetStore,
+}
+
+# 同一目录存在多种格式时的优先顺序（导入后保留的 CSV 不再被读取）
+_AUTO_ORDER = ("feather", "parquet", "csv")
+
+
+def detect_format(root: Path) -> str:
+    """按目录中已有文件判断格式；空目录视为 CSV。"""
+    root = Path(root)
+    for fmt in _AUTO_ORDER:
+        if any(root.glob(f"*{STORE_FORMATS[fmt].suffix}")):
+            return fmt
+    return "csv"
+
+
+def open_store(root: Path, fmt: str = "auto", manifest: bool = False) -> KlineStore:
+    """
+    打开 *root* 下的 K 线库；*fmt* 为 ``auto`` 时自动识别。
+    *manifest* 为 True 时加载（或新建）目录下的数据清单并随写入维护。
+    """
+    if fmt == "auto":
+        fmt = detect_format(root)
+    if fmt not in STORE_FORMATS:
+        raise ValueError(f"未知存储格式 {fmt!r}，可选：auto, {', '.join(STORE_FORMATS)}")
+    store = STORE_FORMATS[fmt](root)
+    if manifest:
+        store.manifest = Manifest.load(Path(root) / MANIFEST_FILE, fmt)
+    return store
+
+
+def read_kline_file(path: Path) -> pd.DataFrame:
+    """按扩展名读取单个 K 线文件。"""
+    path = Path(path)
+    for cls in STORE_FORMATS.values():
+        if path.suffix == cls.suffix:
+            return cls(path.parent)._read(path)
+    raise ValueError(f"不支持的 K 线文件：{path}")
+
+
+def list_kline_files(root: Path, recursive: bool = False) -> List[Path]:
+    """列出目录下的 K 线文件；同一目录下同一代码存在多种格式时取优先格式。"""
+    root = Path(root)
+    chosen: Dict[tuple, Path] = {}
+    for fmt in reversed(_AUTO_ORDER):
+        pattern = f"**/*{STORE_FORMATS[fmt].suffix}" if recursive else f"*{STORE_FORMATS[fmt].suffix}"
+        for p in root.glob(pattern):
+            if p.name not in AUX_FILES:
+                chosen[(p.parent, p.stem)] = p  # 后写入者（优先格式）覆盖
+    return sorted(chosen.values())
+
+
+# --------------------------- CSV 导入 --------------------------- #
+
+def import_csv(
+    src: Path,
+    dst: KlineStore,
+    codes: Optional[List[str]] = None,
+    workers: int = 4,
+    overwrite: bool = False,
+) -> int:
+    """将 *src* 下的 ``*.csv`` 转存到 *dst*，返回成功转换的文件数。"""
+    src_store = CsvStore(src)
+    codes = codes if codes is not None else src_store.codes()
+    todo = [c for c in codes if overwrite or not dst.exists(c)]
+    if len(todo) < len(codes):
+        logger.info("跳过 %d 个已存在的文件（--overwrite 可强制覆盖）", len(codes) - len(todo))
+
+    def _one(code: str) -> bool:
+        try:
+            dst.write(code, src_store.read(code))
+            return True
+        except Exception as e:  # noqa: BLE001
+            logger.warning("转换 %s 失败：%s", code, e)
+            return False
+
+    done = 0
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        for fut in as_completed([executor.submit(_one, c) for c in todo]):
+            done += fut.result()
+    return done
+
+
+def main() -> None:
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s [%(levelname)s] %(message)s",
+        handlers=[logging.StreamHandler(sys.stdout)],
+    )
+    p = argparse.ArgumentParser(description="将 CSV 行情目录导入列式 K 线库")
+    p.add_argument("--src", default="./data", help="CSV 行情目录")
+    p.add_argument("--dst", help="目标目录；缺省与 --src 相同（与 CSV 并存）")
+    p.add_argument("--format", choices=["feather", "parquet"], default="feather", help="目标格式")
+    p.add_argument("--workers", type=int, default=4, help="并发线程数")
+    p.add_argument("--overwrite", action="store_true", help="覆盖已存在的目标文件")
+    p.add_argument(
+        "--manifest-only",
+        action="store_true",
+        help=f"不导入，仅为 --src（按已有格式识别）重建数据清单 {MANIFEST_FILE}",
+    )
+    args = p.parse_args()
+
+    src = Path(args.src)
+    if not src.exists():
+        logger.error("目录 %s 不存在", src)
+        sys.exit(1)
+    if args.manifest_only:
+        store = open_store(src, manifest=True)
+        n = store.manifest.sync(store, workers=args.workers)
+        logger.info("数据清单已更新（重新读取 %d 个文件）→ %s", n, store.manifest.path.resolve())
+        return
+    dst = open_store(Path(args.dst) if args.dst else src, args.format, manifest=True)
+    n = import_csv(src, dst, workers=args.workers, overwrite=args.overwrite)
+    dst.manifest.sync(dst, workers=args.workers)
+    logger.info("已导入 %d 个文件 → %s", n, dst.root.resolve())
+
+
+if __name__ == "__main__":
+    main()
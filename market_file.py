@@ -0,0 +1,212 @@
+from __future__ import annotations
+
+import argparse
+import json
+import logging
+import struct
+import sys
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Union
+
+import numpy as np
+import pandas as pd
+
+from kline_store import KLINE_COLUMNS, STORE_FORMATS, KlineStore, open_store
+
+logger = logging.getLogger("market_file")
+
+# --------------------------- 合并行情文件 --------------------------- #
+#
+# 全市场 K 线合并为单个二进制文件，以只读内存映射方式打开：
+#
+#     MAGIC(8) | 头部长度(8, little-endian) | 头部 JSON | 各字段数组（64 字节对齐）
+#
+# 头部记录股票代码及其在数组中的 (offset, length)，以及每个字段的 dtype 与字节偏移。
+# 各股票的行按日期升序连续存放；取某只股票即对各字段数组切片，得到的是
+# 共享映射内存的 NumPy 视图，不发生拷贝。多个进程映射同一文件时物理内存共享。
+
+MAGIC = b"KLMMAP01"
+MARKET_FILE = "market.kline"
+_ALIGN = 64
+
+# 字段 → 磁盘 dtype；date 以 int64 纳秒存放
+FIELD_DTYPES: Dict[str, str] = {c: ("<i8" if c == "date" else "<f8") for c in KLINE_COLUMNS}
+
+
+def _pad(n: int) -> int:
+    return (-n) % _ALIGN
+
+
+def build_market_file(
+    store: KlineStore,
+    path: Path,
+    codes: Optional[Iterable[str]] = None,
+) -> int:
+    """
+    将 *store* 中的行情合并写入 *path*（先写临时文件再替换），返回股票数。
+    仅保留 ``KLINE_COLUMNS`` 中的列；缺失列以 NaN 填充。
+    """
+    codes = list(codes) if codes is not None else store.codes()
+    frames: List[pd.DataFrame] = []
+    kept: List[str] = []
+    for code in codes:
+        try:
+            df = store.read(code)
+        except Exception as e:  # noqa: BLE001
+            logger.warning("读取 %s 失败，跳过：%s", code, e)
+            continue
+        if df.empty:
+            continue
+        df = df.sort_values("date")
+        frames.append(df.reindex(columns=KLINE_COLUMNS))
+        kept.append(code)
+
+    lengths = np.array([len(f) for f in frames], dtype=np.int64)
+    offsets = np.concatenate([[0], np.cumsum(lengths)[:-1]]).astype(np.int64) if len(frames) else lengths
+    total = int(lengths.sum())
+
+    arrays: Dict[str, np.ndarray] = {}
+    for col, dtype in FIELD_DTYPES.items():
+        if col == "date":
+            parts = [f["date"].to_numpy(dtype="datetime64[ns]").view("<i8") for f in frames]
+        else:
+            parts = [f[col].to_numpy(dtype="float64") for f in frames]
+        arrays[col] = np.concatenate(parts).astype(dtype, copy=False) if parts else np.zeros(0, dtype)
+
+    # 字段偏移相对于数据区起点（头部之后按 _ALIGN 对齐处）
+    fields, pos = {}, 0
+    for col, dtype in FIELD_DTYPES.items():
+        fields[col] = {"dtype": dtype, "offset": pos}
+        pos += arrays[col].nbytes + _pad(arrays[col].nbytes)
+    header = {
+        "version": 1,
+        "rows": total,
+        "codes": kept,
+        "offsets": offsets.tolist(),
+        "lengths": lengths.tolist(),
+        "fields": fields,
+    }
+    raw = json.dumps(header).encode("utf-8")
+    raw += b" " * _pad(len(MAGIC) + 8 + len(raw))
+
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + ".tmp")
+    with tmp.open("wb") as f:
+        f.write(MAGIC)
+        f.write(struct.pack("<Q", len(raw)))
+        f.write(raw)
+        for col in FIELD_DTYPES:
+            f.write(arrays[col].tobytes())
+            f.write(b"\0" * _pad(arrays[col].nbytes))
+    tmp.replace(path)
+    return len(kept)
+
+
+class MarketFile:
+    """
+    只读打开合并行情文件。接口与 ``KlineStore`` 的读取部分一致
+    （``codes`` / ``exists`` / ``read``），``read`` 返回的 DataFrame
+    直接引用映射内存，不可原地修改。
+    """
+
+    name = "mmap"
+
+    def __init__(self, path: Path) -> None:
+        self.path_ = Path(path)
+        with self.path_.open("rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{self.path_} 不是合并行情文件")
+            (hlen,) = struct.unpack("<Q", f.read(8))
+            header = json.loads(f.read(hlen).decode("utf-8"))
+        base = len(MAGIC) + 8 + hlen
+
+        self._codes: List[str] = header["codes"]
+        self._index: Dict[str, tuple] = {
+            c: (o, n) for c, o, n in zip(self._codes, header["offsets"], header["lengths"])
+        }
+        rows = int(header["rows"])
+        self._mm = np.memmap(self.path_, mode="r") if rows else None
+        self.fields: Dict[str, np.ndarray] = {}
+        for col, meta in header["fields"].items():
+            dtype = np.dtype(meta["dtype"])
+            if self._mm is None:
+                arr = np.zeros(0, dtype)
+            else:
+                arr = np.ndarray((rows,), dtype=dtype, buffer=self._mm, offset=base + meta["offset"])
+            if col == "date":
+                arr = arr.view("datetime64[ns]")
+            self.fields[col] = arr
+
+    # ---------- 与 KlineStore 对齐的读取接口 ---------- #
+    def codes(self) -> List[str]:
+        return list(self._codes)
+
+    def exists(self, code: str) -> bool:
+        return code in self._index
+
+    def path(self, code: str) -> Path:
+        return self.path_
+
+    def arrays(self, code: str) -> Dict[str, np.ndarray]:
+        """某只股票各字段的零拷贝视图。"""
+        o, n = self._index[code]
+        return {col: arr[o:o + n] for col, arr in self.fields.items()}
+
+    def read(self, code: str) -> pd.DataFrame:
+        return pd.DataFrame(self.arrays(code), copy=False)
+
+    def last_date(self, codes: Optional[Iterable[str]] = None) -> Optional[pd.Timestamp]:
+        """*codes*（缺省为全部股票）的最新日期，即各段末行的最大值。"""
+        codes = self._codes if codes is None else [c for c in codes if c in self._index]
+        ends = [o + n - 1 for o, n in (self._index[c] for c in codes) if n]
+        return pd.Timestamp(self.fields["date"][ends].max()) if ends else None
+
+    def is_stale(self, store: Union[KlineStore, Path]) -> bool:
+        """源目录中存在比合并文件更新的行情文件时返回 True。"""
+        store = store if isinstance(store, KlineStore) else open_store(store)
+        mtime = self.path_.stat().st_mtime
+        return any(store.path(c).stat().st_mtime > mtime for c in store.codes())
+
+    def __len__(self) -> int:
+        return len(self._codes)
+
+    def __repr__(self) -> str:
+        return f"MarketFile({str(self.path_)!r}, codes={len(self._codes)})"
+
+
+# 每个进程只映射一次，供进程池 worker 复用
+_OPENED: Dict[str, MarketFile] = {}
+
+
+def open_market_file(path: Path) -> MarketFile:
+    key = str(Path(path).resolve())
+    mf = _OPENED.get(key)
+    if mf is None:
+        mf = _OPENED[key] = MarketFile(path)
+    return mf
+
+
+def main() -> None:
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s [%(levelname)s] %(message)s",
+        handlers=[logging.StreamHandler(sys.stdout)],
+    )
+    p = argparse.ArgumentParser(description="将行情目录合并为单个内存映射文件")
+    p.add_argument("--data-dir", default="./data", help="行情目录")
+    p.add_argument("--format", choices=["auto", *STORE_FORMATS], default="auto", help="源存储格式")
+    p.add_argument("--out", help=f"输出文件；缺省为 <data-dir>/{MARKET_FILE}")
+    args = p.parse_args()
+
+    data_dir = Path(args.data_dir)
+    if not data_dir.exists():
+        logger.error("数据目录 %s 不存在", data_dir)
+        sys.exit(1)
+    out = Path(args.out) if args.out else data_dir / MARKET_FILE
+    n = build_market_file(open_store(data_dir, args.format), out)
+    logger.info("已合并 %d 只股票 → %s（%.1f MB）", n, out.resolve(), out.stat().st_size / 2**20)
+
+
+if __name__ == "__main__":
+    main()
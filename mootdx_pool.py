@@ -0,0 +1,201 @@
+from __future__ import annotations
+
+import logging
+import queue
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Callable, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger("mootdx_pool")
+
+# --------------------------- Mootdx 连接池 --------------------------- #
+#
+# ``Quotes.factory(market="std")`` 每次都会新建 TCP 连接并重新选择服务器，
+# 逐只抓取时这部分开销占了单次请求的大半。连接池在首次使用时测速一次，
+# 只连接最快的若干台服务器；客户端长期复用，借出前对闲置过久的连接做一次
+# 轻量健康检查，请求出错时换一台服务器重连并透明重试一次。
+
+Server = Tuple[str, int]
+
+
+def _probe(server: Server, timeout: float) -> Optional[float]:
+    """TCP 建连耗时（秒），不可达时返回 None。"""
+    t0 = time.perf_counter()
+    try:
+        with socket.create_connection(server, timeout=timeout):
+            return time.perf_counter() - t0
+    except OSError:
+        return None
+
+
+def rank_servers(
+    candidates: Optional[List[Server]] = None,
+    limit: int = 5,
+    timeout: float = 0.7,
+) -> List[Server]:
+    """并发测速 *candidates*（缺省为 mootdx 内置行情服务器），按建连耗时返回最快的 *limit* 台。"""
+    if candidates is None:
+        from mootdx.consts import HQ_HOSTS
+
+        candidates = [(host, int(port)) for _, host, port in HQ_HOSTS]
+    candidates = list(dict.fromkeys(candidates))
+    with ThreadPoolExecutor(max_workers=min(32, len(candidates) or 1)) as ex:
+        timings = list(ex.map(lambda s: _probe(s, timeout), candidates))
+    ranked = sorted((t, s) for s, t in zip(candidates, timings) if t is not None)
+    return [s for _, s in ranked[:limit]]
+
+
+class MootdxPool:
+    """
+    线程安全的 mootdx 行情客户端池。
+
+    客户端按需创建，最多 *size* 个，轮流连接测速得到的服务器；``call(fn)`` 借出一个
+    客户端执行 ``fn(client)`` 后归还。连接失效（健康检查失败或请求抛异常）时丢弃该客户端，
+    换下一台服务器重建后重试一次，调用方无感知；重试仍失败则抛出异常。
+    """
+
+    def __init__(
+        self,
+        size: int = 4,
+        servers: Optional[List[Server]] = None,
+        timeout: float = 15,
+        idle_check: float = 30.0,
+    ) -> None:
+        self.size = max(1, size)
+        self.timeout = timeout
+        self.idle_check = idle_check   # 闲置超过该秒数的连接借出前先做健康检查
+        self._servers = list(servers) if servers else None
+        self._idle: "queue.LifoQueue" = queue.LifoQueue()   # 优先复用刚归还的热连接
+        self._lock = threading.Lock()
+        self._created = 0
+        self._next = 0
+        self.reconnects = 0
+
+    # ---------- 服务器选择 ---------- #
+    def servers(self) -> List[Server]:
+        """本池使用的服务器（首次调用时测速，整个进程只测一次）。"""
+        with self._lock:
+            if self._servers is None:
+                self._servers = rank_servers(limit=max(3, min(self.size, 8)))
+                if self._servers:
+                    logger.info("Mootdx 最快服务器：%s", ", ".join(f"{h}:{p}" for h, p in self._servers))
+                else:
+                    logger.warning("Mootdx 服务器测速全部失败，使用 mootdx 默认服务器")
+            return self._servers
+
+    def _connect(self) -> Any:
+        from mootdx.quotes import Quotes
+
+        servers = self.servers()
+        with self._lock:
+            server = servers[self._next % len(servers)] if servers else None
+            self._next += 1
+            # mootdx 构造客户端时会改写全局配置中的 BESTIP，需串行
+            client = Quotes.factory(market="std", server=server, timeout=self.timeout, raise_exception=True)
+        client._pool_used = time.monotonic()
+        return client
+
+    @staticmethod
+    def _healthy(client: Any) -> bool:
+        try:
+            return not client.closed and client.client.get_security_count(0) is not None
+        except Exception:
+            return False
+
+    @staticmethod
+    def _discard(client: Any) -> None:
+        try:
+            client.close()
+        except Exception:
+            pass
+        client.client = None    # mootdx 的 __del__ 会再次 close，已断开的连接会因此报错
+
+    # ---------- 借出 / 归还 ---------- #
+    def _acquire(self) -> Any:
+        while True:
+            try:
+                client = self._idle.get_nowait()
+            except queue.Empty:
+                with self._lock:
+                    can_create = self._created < self.size
+                    self._created += can_create
+                if can_create:
+                    try:
+                        return self._connect()
+                    except Exception:
+                        with self._lock:
+                            self._created -= 1
+                        raise
+                client = self._idle.get()
+            if time.monotonic() - client._pool_used < self.idle_check or self._healthy(client):
+                return client
+            logger.debug("Mootdx 闲置连接失效，重新连接")
+            self._replace(client)
+
+    def _release(self, client: Any) -> None:
+        client._pool_used = time.monotonic()
+        self._idle.put(client)
+
+    def _replace(self, client: Any) -> None:
+        """丢弃失效客户端，释放其名额（下次借出时按需重建）。"""
+        self._discard(client)
+        with self._lock:
+            self._created -= 1
+            self.reconnects += 1
+
+    @contextmanager
+    def client(self) -> Iterator[Any]:
+        client = self._acquire()
+        try:
+            yield client
+        except Exception:
+            self._replace(client)
+            raise
+        else:
+            self._release(client)
+
+    def call(self, fn: Callable[[Any], Any]) -> Any:
+        """借出客户端执行 ``fn(client)``；失败时换连接透明重试一次。"""
+        try:
+            with self.client() as client:
+                return fn(client)
+        except Exception as e:
+            logger.debug("Mootdx 请求失败，重连后重试: %s", e)
+        with self.client() as client:
+            return fn(client)
+
+    def close(self) -> None:
+        while True:
+            try:
+                client = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(client)
+            with self._lock:
+                self._created -= 1
+
+
+_POOL: Optional[MootdxPool] = None
+_POOL_LOCK = threading.Lock()
+
+
+def get_pool() -> MootdxPool:
+    """进程级共享连接池（同步与异步抓取共用）。"""
+    global _POOL
+    with _POOL_LOCK:
+        if _POOL is None:
+            _POOL = MootdxPool()
+        return _POOL
+
+
+def configure_pool(size: int, servers: Optional[List[Server]] = None) -> MootdxPool:
+    """按本次运行的并发数重建共享连接池。"""
+    global _POOL
+    with _POOL_LOCK:
+        if _POOL is not None:
+            _POOL.close()
+        _POOL = MootdxPool(size=size, servers=servers)
+        return _POOL
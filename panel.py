@@ -0,0 +1,176 @@
+from __future__ import annotations
+
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+# --------------------------- 面板数据 --------------------------- #
+
+PANEL_FIELDS = ("open", "close", "high", "low", "volume")
+
+
+class PanelWindow:
+    """
+    面板在某一交易日的 as-of 窗口：每列为一只股票截至该日的最近 *L* 根 K 线。
+
+    数组形状均为 (L × K)，**右对齐**——末行为该日（或之前最近的有效日），
+    历史不足 L 根的列在顶部以 NaN 填充，等价于逐股票的
+    ``df[df["date"] <= date].tail(L)``。
+    """
+
+    def __init__(
+        self,
+        fields: Dict[str, np.ndarray],
+        dates: np.ndarray,
+        count: np.ndarray,
+        columns: np.ndarray,
+        panel: Optional["Panel"] = None,
+    ) -> None:
+        self.fields = fields
+        self.dates = dates        # datetime64[ns]，填充处为 NaT
+        self.count = count        # 各列截至该日的有效 K 线总数（不受 L 截断）
+        self.columns = columns    # 对应 Panel.codes 的列号
+        self.panel = panel        # 来源面板，可据此取各列的全历史数据
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        return self.fields[name]
+
+    @property
+    def rows(self) -> int:
+        return self.dates.shape[0]
+
+    @property
+    def length(self) -> np.ndarray:
+        """各列窗口内的有效 K 线数 = min(count, L)。"""
+        return np.minimum(self.count, self.rows)
+
+    def take(self, idx: np.ndarray) -> "PanelWindow":
+        """按位置 (0..K-1) 或布尔掩码取部分列。"""
+        return PanelWindow(
+            {k: v[:, idx] for k, v in self.fields.items()},
+            self.dates[:, idx],
+            self.count[idx],
+            self.columns[idx],
+            self.panel,
+        )
+
+    def head(self, n: int) -> "PanelWindow":
+        """取窗口前 n 行（即截止到更早一日的前缀），仍保持右对齐语义。"""
+        drop = self.rows - n
+        return PanelWindow(
+            {k: v[:n] for k, v in self.fields.items()},
+            self.dates[:n],
+            np.maximum(self.count - drop, 0),
+            self.columns,
+            self.panel,
+        )
+
+
+class Panel:
+    """
+    全市场对齐面板：按交易日历 (dates) × 股票 (codes) 排列的 NumPy 矩阵，
+    每个 OHLCV 字段一张，停牌/未上市处为 NaN，由 ``mask`` 标记是否有数据。
+
+    为支持 as-of 窗口，构造时额外记录每列“有数据的行”在日历中的顺序
+    (``_order``) 与累计计数 (``_cum``)，取窗口只需一次花式索引。
+    """
+
+    def __init__(
+        self,
+        dates: pd.DatetimeIndex,
+        codes: Sequence[str],
+        fields: Dict[str, np.ndarray],
+        mask: np.ndarray,
+    ) -> None:
+        self.dates = pd.DatetimeIndex(dates)
+        self.codes: List[str] = list(codes)
+        self.fields = fields
+        self.mask = mask
+
+        # 每列有效行排在前面（保持时间顺序），无效行在后
+        self._order = np.argsort(~mask, axis=0, kind="stable").astype(np.int32)
+        self._cum = np.cumsum(mask, axis=0, dtype=np.int32)
+
+        # 由面板派生、可在多次查询间复用的数据（如峰值索引）
+        self.cache: Dict[Any, Any] = {}
+
+    # ---------- 构造 ---------- #
+    @classmethod
+    def from_frames(
+        cls,
+        data: Dict[str, pd.DataFrame],
+        calendar: Optional[Iterable] = None,
+        fields: Sequence[str] = PANEL_FIELDS,
+    ) -> "Panel":
+        """
+        由 ``{code: DataFrame}`` 构造面板。*calendar* 缺省为所有股票日期的并集；
+        同一股票的重复日期保留最后一条。
+        """
+        codes = list(data)
+        if calendar is None:
+            all_dates = [df["date"].to_numpy(dtype="datetime64[ns]") for df in data.values()]
+            cal = np.unique(np.concatenate(all_dates)) if all_dates else np.array([], "datetime64[ns]")
+        else:
+            cal = np.unique(pd.to_datetime(list(calendar)).to_numpy(dtype="datetime64[ns]"))
+
+        T, C = len(cal), len(codes)
+        mats = {f: np.full((T, C), np.nan) for f in fields}
+        mask = np.zeros((T, C), dtype=bool)
+        for j, code in enumerate(codes):
+            df = data[code]
+            pos = np.searchsorted(cal, df["date"].to_numpy(dtype="datetime64[ns]"))
+            inside = (pos < T) & (cal[np.minimum(pos, T - 1)] == df["date"].to_numpy(dtype="datetime64[ns]"))
+            pos = pos[inside]
+            mask[pos, j] = True
+            for f in fields:
+                if f in df.columns:
+                    mats[f][pos, j] = df[f].to_numpy(dtype=float)[inside]
+        return cls(pd.DatetimeIndex(cal), codes, mats, mask)
+
+    # ---------- 查询 ---------- #
+    @property
+    def shape(self) -> tuple[int, int]:
+        return self.mask.shape
+
+    def series(self, col: int, field: str) -> np.ndarray:
+        """第 *col* 只股票的全部有效 K 线上的 *field*（按时间顺序，不含停牌填充）。"""
+        total = int(self._cum[-1, col]) if len(self.dates) else 0
+        return self.fields[field][self._order[:total, col], col]
+
+    def _row_of(self, date) -> int:
+        """日历中 ≤ date 的最后一行；若 date 早于日历起点返回 -1。"""
+        return int(np.searchsorted(self.dates.values, np.datetime64(pd.Timestamp(date), "ns"), side="right")) - 1
+
+    def window(self, date, length: int, columns: Optional[np.ndarray] = None) -> PanelWindow:
+        """取各列截至 *date* 的最近 *length* 根 K 线（右对齐）。"""
+        cols = np.arange(len(self.codes)) if columns is None else np.asarray(columns)
+        r = self._row_of(date)
+        end = self._cum[r, cols] if r >= 0 else np.zeros(len(cols), dtype=np.int32)
+        return self._gather(end, cols, length)
+
+    def windows(self, dates: Sequence, length: int, columns: Optional[np.ndarray] = None) -> PanelWindow:
+        """
+        多个交易日的 as-of 窗口横向拼接：结果列按 (date, code) 排列，
+        即第 i 个日期占据第 ``i*K .. (i+1)*K-1`` 列。
+        """
+        cols = np.arange(len(self.codes)) if columns is None else np.asarray(columns)
+        ends = []
+        for d in dates:
+            r = self._row_of(d)
+            ends.append(self._cum[r, cols] if r >= 0 else np.zeros(len(cols), dtype=np.int32))
+        end = np.concatenate(ends) if ends else np.zeros(0, dtype=np.int32)
+        return self._gather(end, np.tile(cols, len(ends)), length)
+
+    def _gather(self, end: np.ndarray, cols: np.ndarray, length: int) -> PanelWindow:
+        """按“每列第 end 根有效 K 线为止”取右对齐窗口。"""
+        T = self.mask.shape[0]
+        k = end[None, :] - length + np.arange(length)[:, None]     # 有效行序号
+        valid = k >= 0
+        src = self._order[np.clip(k, 0, max(T - 1, 0)), cols[None, :]]
+        fields = {}
+        for f, mat in self.fields.items():
+            fields[f] = np.where(valid, mat[src, cols[None, :]], np.nan) if T else np.full(k.shape, np.nan)
+        dates = self.dates.values[src] if T else np.full(k.shape, np.datetime64("NaT"), "datetime64[ns]")
+        dates = np.where(valid, dates, np.datetime64("NaT"))
+        return PanelWindow(fields, dates, end.astype(np.int64), cols, self)
@@ -0,0 +1,406 @@
+from __future__ import annotations
+
+import hashlib
+import logging
+import math
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger("peak_index")
+
+# --------------------------- 峰值索引 --------------------------- #
+#
+# PeakKDJSelector 在每个交易日对最近 max_window+20 根 K 线调用
+# ``scipy.signal.find_peaks(oc_max, distance=6, prominence=0.5)``。
+# find_peaks 的三个步骤都可以拆成“与窗口无关的全历史信息 + 窗口内的少量计算”：
+#
+#   1. 局部极大（含平台）只取决于平台两侧相邻的一根 K 线，窗口内的候选峰
+#      恰为全历史候选峰中“左邻、右邻都落在窗口内”的那些；
+#   2. distance 过滤只作用于窗口内的候选峰（数量很少），按 SciPy 的规则
+#      （np.argsort 优先级、由高到低逐个剔除近邻）重算；
+#   3. prominence 的左右基准由“向两侧第一个更高（或 NaN）的 K 线”决定，
+#      该位置与窗口无关，窗口只负责截断，区间最小值一次 reduceat 求出。
+#
+# 因此每只股票只需保存一次全历史的候选峰及其左右阻挡位置，新 K 线到达时
+# 只扫描尾部；任意 as-of 窗口上的峰值与直接调用 find_peaks 完全一致。
+
+
+def _digest(oc: np.ndarray) -> str:
+    return hashlib.blake2b(np.ascontiguousarray(oc, dtype=float).tobytes(), digest_size=16).hexdigest()
+
+
+def _local_maxima(x: np.ndarray, start: int = 0) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    与 SciPy ``_local_maxima_1d`` 相同的平台极大：返回 (左端, 右端)。
+
+    平台 [l, r] 为极大当且仅当 x[l-1] < x[l] = … = x[r] > x[r+1]（NaN 参与的比较
+    均为 False）。只返回 l-1 ≥ *start* 的平台，用于从尾部续扫。
+    """
+    seg = x[start:]
+    m = len(seg)
+    empty = np.zeros(0, dtype=np.int64)
+    if m < 3:
+        return empty, empty
+    with np.errstate(invalid="ignore"):
+        rise = seg[:-1] < seg[1:]
+        changed = np.flatnonzero(~(seg[:-1] == seg[1:])) + 1   # 与前一根不相等的位置
+
+    # 平台起点 l：x[l-1] < x[l]，且 l 不是最后一根
+    lefts = np.flatnonzero(rise) + 1
+    lefts = lefts[lefts < m - 1]
+    if len(lefts) == 0 or len(changed) == 0:
+        return empty, empty
+    # 前探到第一根不等于 x[l] 的 K 线，最远到最后一根
+    nxt = np.searchsorted(changed, lefts, side="right")
+    ahead = np.where(nxt < len(changed), changed[np.minimum(nxt, len(changed) - 1)], m - 1)
+    ahead = np.minimum(ahead, m - 1)
+    with np.errstate(invalid="ignore"):
+        is_peak = seg[ahead] < seg[lefts]
+    return lefts[is_peak] + start, ahead[is_peak] - 1 + start
+
+
+def _blocker_table(x: np.ndarray) -> list:
+    """区间最大值的倍增表；NaN 视为 +inf（阻挡 prominence 的左右扩展）。"""
+    level = np.where(np.isnan(x), np.inf, x)
+    table = [level]
+    step = 1
+    while step * 2 <= len(x):
+        prev = table[-1]
+        table.append(np.maximum(prev[:-step], prev[step:]))
+        step *= 2
+    return table
+
+
+def _next_blocker(table: list, n: int, pos: np.ndarray, vals: np.ndarray) -> np.ndarray:
+    """pos 之后第一个 x > val（或 NaN）的位置；不存在时为 n。"""
+    cur = pos + 1
+    for k in range(len(table) - 1, -1, -1):
+        size = 1 << k
+        lvl = table[k]
+        can = cur + size <= n
+        idx = np.minimum(cur, len(lvl) - 1)
+        skip = can & (lvl[idx] <= vals)
+        cur = np.where(skip, cur + size, cur)
+    return cur
+
+
+def _prev_blocker(table: list, pos: np.ndarray, vals: np.ndarray) -> np.ndarray:
+    """pos 之前最后一个 x > val（或 NaN）的位置；不存在时为 -1。"""
+    cur = pos              # 当前区间为 [cur, pos)，向左扩展
+    for k in range(len(table) - 1, -1, -1):
+        size = 1 << k
+        lvl = table[k]
+        can = cur - size >= 0
+        idx = np.maximum(cur - size, 0)
+        skip = can & (lvl[np.minimum(idx, len(lvl) - 1)] <= vals)
+        cur = np.where(skip, cur - size, cur)
+    return cur - 1
+
+
+def _select_by_distance(peaks: np.ndarray, priority: np.ndarray, distance: float) -> np.ndarray:
+    """SciPy ``_select_by_peak_distance`` 的同序实现（优先级高者先保留）。"""
+    size = len(peaks)
+    dist = math.ceil(distance)
+    keep = [True] * size
+    pos = peaks.tolist()
+    for j in np.argsort(priority)[::-1].tolist():
+        if not keep[j]:
+            continue
+        k = j - 1
+        while 0 <= k and pos[j] - pos[k] < dist:
+            keep[k] = False
+            k -= 1
+        k = j + 1
+        while k < size and pos[k] - pos[j] < dist:
+            keep[k] = False
+            k += 1
+    return np.array(keep, dtype=bool)
+
+
+def _range_min(x: np.ndarray, lo: np.ndarray, hi: np.ndarray) -> np.ndarray:
+    """各闭区间 [lo, hi]（非空）上的最小值。"""
+    if len(lo) == 0:
+        return np.zeros(0)
+    padded = np.append(x, np.inf)
+    return np.minimum.reduceat(padded, np.ravel(np.column_stack([lo, hi + 1])))[::2]
+
+
+class PeakIndex:
+    """
+    单只股票全历史 ``oc_max`` 序列上的候选峰索引。
+
+    * ``left`` / ``right`` —— 平台极大的左右端（峰位置取中点）；
+    * ``lb`` / ``rb`` —— 峰值向左、向右第一个更高（或 NaN）的位置，
+      ``rb = -1`` 表示截至 ``n`` 根 K 线尚未出现；
+    * ``lmin`` / ``rmin`` —— 未被窗口截断时 prominence 的左右基准，即
+      ``(lb, mid]`` 与 ``[mid, rb)`` 上的最小值（``rb = -1`` 时 ``rmin`` 为 NaN）；
+    * ``n`` / ``digest`` —— 已覆盖的 K 线数及其内容摘要，用于判断能否增量续算。
+    """
+
+    def __init__(
+        self,
+        n: int,
+        digest: str,
+        left: np.ndarray,
+        right: np.ndarray,
+        lb: np.ndarray,
+        rb: np.ndarray,
+        lmin: np.ndarray,
+        rmin: np.ndarray,
+    ) -> None:
+        self.n = n
+        self.digest = digest
+        self.left = left
+        self.right = right
+        self.lb = lb
+        self.rb = rb
+        self.lmin = lmin
+        self.rmin = rmin
+
+    @property
+    def mid(self) -> np.ndarray:
+        return (self.left + self.right) // 2
+
+    # ---------- 构建 / 续算 ---------- #
+    @staticmethod
+    def _bases(oc: np.ndarray, mid: np.ndarray, lb: np.ndarray, rb: np.ndarray):
+        lmin = _range_min(oc, lb + 1, mid)
+        closed = rb >= 0
+        rmin = np.full(len(mid), np.nan)
+        rmin[closed] = _range_min(oc, mid[closed], rb[closed] - 1)
+        return lmin, rmin
+
+    @classmethod
+    def build(cls, oc: np.ndarray) -> "PeakIndex":
+        oc = np.asarray(oc, dtype=float)
+        left, right = _local_maxima(oc)
+        mid = (left + right) // 2
+        vals = oc[mid]
+        table = _blocker_table(oc)
+        lb = _prev_blocker(table, left, vals)
+        rb = _next_blocker(table, len(oc), right, vals)
+        rb = np.where(rb >= len(oc), -1, rb)
+        return cls(len(oc), _digest(oc), left, right, lb, rb, *cls._bases(oc, mid, lb, rb))
+
+    def covers(self, oc: np.ndarray) -> bool:
+        """*oc* 的前 ``n`` 根是否与建索引时一致（之后只追加了新 K 线）。"""
+        return len(oc) >= self.n and _digest(oc[: self.n]) == self.digest
+
+    def extend(self, oc: np.ndarray) -> "PeakIndex":
+        """
+        在追加了新 K 线的序列上续算（调用方保证 :meth:`covers`）：已确定的峰与
+        阻挡位置保持不变，只在尾部扫描新峰，并为尚无右阻挡的峰在新数据中查找。
+        """
+        oc = np.asarray(oc, dtype=float)
+        if len(oc) == self.n:
+            return self
+
+        # 新峰只可能出现在最后一个已确认峰的右邻之后（该右邻低于平台，不是起点）
+        start = int(self.right[-1]) + 1 if len(self.right) else 0
+        new_left, new_right = _local_maxima(oc, start)
+        new_vals = oc[(new_left + new_right) // 2]
+
+        table = _blocker_table(oc)
+        new_lb = _prev_blocker(table, new_left, new_vals)
+        new_rb = _next_blocker(table, len(oc), new_right, new_vals)
+
+        new_rb = np.where(new_rb >= len(oc), -1, new_rb)
+        new_lmin, new_rmin = self._bases(oc, (new_left + new_right) // 2, new_lb, new_rb)
+
+        # 尚无右阻挡的旧峰：只在新数据中查找
+        rb, rmin = self.rb.copy(), self.rmin.copy()
+        open_ = np.flatnonzero(rb < 0)
+        if len(open_):
+            found = _next_blocker(table, len(oc), np.full(len(open_), self.n - 1), oc[self.mid[open_]])
+            closed = found < len(oc)
+            rb[open_[closed]] = found[closed]
+            rmin[open_[closed]] = _range_min(oc, self.mid[open_[closed]], found[closed] - 1)
+
+        return PeakIndex(
+            len(oc),
+            _digest(oc),
+            np.concatenate([self.left, new_left]),
+            np.concatenate([self.right, new_right]),
+            np.concatenate([self.lb, new_lb]),
+            np.concatenate([rb, new_rb]),
+            np.concatenate([self.lmin, new_lmin]),
+            np.concatenate([rmin, new_rmin]),
+        )
+
+    # ---------- 查询 ---------- #
+    def peaks(
+        self,
+        oc: np.ndarray,
+        start: int,
+        end: int,
+        *,
+        distance: float = 6,
+        prominence: float = 0.5,
+    ) -> np.ndarray:
+        """
+        等价于 ``find_peaks(oc[start:end+1], distance=..., prominence=...)``，
+        返回全历史坐标下的峰位置。
+        """
+        if end - start < 2:
+            return np.zeros(0, dtype=np.int64)
+        i0 = int(np.searchsorted(self.left, start + 1, side="left"))
+        i1 = int(np.searchsorted(self.right, end - 1, side="right"))
+        if i1 <= i0:
+            return np.zeros(0, dtype=np.int64)
+
+        mid = (self.left[i0:i1] + self.right[i0:i1]) // 2
+        vals = oc[mid]
+        keep = _select_by_distance(mid, vals, distance)
+        mid, vals = mid[keep], vals[keep]
+        lb, rb = self.lb[i0:i1][keep], self.rb[i0:i1][keep]
+        left_min, right_min = self.lmin[i0:i1][keep], self.rmin[i0:i1][keep]
+
+        # prominence：基准区间被窗口截断的峰，改用窗口端点起的累计最小值
+        # （截断区间内不含 NaN，否则阻挡位置会落在窗口内）
+        cut_left = lb + 1 < start
+        if cut_left.any():
+            run = np.minimum.accumulate(oc[start : mid[cut_left][-1] + 1])
+            left_min = np.where(cut_left, run[np.minimum(mid, start + len(run) - 1) - start], left_min)
+        cut_right = (rb < 0) | (rb - 1 > end)
+        if cut_right.any():
+            first = mid[cut_right][0]
+            run = np.minimum.accumulate(oc[first : end + 1][::-1])[::-1]
+            right_min = np.where(cut_right, run[np.maximum(mid, first) - first], right_min)
+
+        prom = vals - np.maximum(left_min, right_min)
+        return mid[prominence <= prom]
+
+    def target(
+        self,
+        oc: np.ndarray,
+        close: np.ndarray,
+        start: int,
+        end: int,
+        gap_threshold: float,
+    ) -> int:
+        """
+        :class:`PeakKDJSelector` 第 1~2 步：窗口 ``[start, end]`` 内以最新峰 peak_t
+        为基准，向前回溯满足条件的 peak_(t-n)，返回其全历史位置；不存在时返回 -1。
+        """
+        peaks = self.peaks(oc, start, end)
+        peaks = peaks[peaks < end]               # 仅取早于当日的峰
+        total = len(peaks)
+        if total < 2:
+            return -1
+
+        t = peaks[-1]
+        prev = peaks[:-1]
+        oc_prev = oc[prev]
+        ok = oc[t] > oc_prev
+
+        # 区间内其余峰均低于 oc_prev：peaks[idx+1 : total-1] 的后缀最大值
+        inter_max = np.full(total - 1, -np.inf)
+        if total >= 3:
+            inter_max[:-1] = np.maximum.accumulate(oc_prev[::-1])[::-1][1:]
+        ok &= inter_max < oc_prev
+
+        # oc_prev 高于 (prev, t) 区间最低收盘价 gap_threshold：自 t-1 向前的累计最小值
+        first = prev[0] + 1
+        if first < t:
+            run = np.fmin.accumulate(close[first:t][::-1])[::-1]
+            min_close = np.where(prev + 1 < t, run[np.minimum(prev + 1, t - 1) - first], np.nan)
+        else:
+            min_close = np.full(total - 1, np.nan)
+        ok &= ~np.isnan(min_close)
+        with np.errstate(invalid="ignore"):
+            ok &= ~(oc_prev <= min_close * (1 + gap_threshold))
+
+        hit = np.flatnonzero(ok)
+        return int(prev[hit[-1]]) if len(hit) else -1
+
+
+# --------------------------- 持久化 --------------------------- #
+
+class PeakIndexStore:
+    """
+    全市场峰值索引，随行情数据保存在单个 ``.npz`` 文件中。
+
+    ``get`` 按需载入 / 续算 / 重建某只股票的索引；``save`` 仅在有变化时写盘，
+    先写临时文件再替换，避免中断时留下半个文件。
+    """
+
+    def __init__(self, path: Optional[Path] = None) -> None:
+        self.path = Path(path) if path else None
+        self._indices: Dict[str, PeakIndex] = {}
+        self._keys: Dict[str, object] = {}
+        self._dirty = False
+        self.stats = {"loaded": 0, "extended": 0, "built": 0}
+        if self.path is not None and self.path.exists():
+            self._load()
+
+    def get(self, code: str, oc: np.ndarray, key: object = None) -> PeakIndex:
+        """
+        返回覆盖 *oc* 全部 K 线的索引。*key* 为数据版本标识（如行情指纹），
+        与上次相同时跳过摘要校验。
+        """
+        index = self._indices.get(code)
+        if index is not None and key is not None and self._keys.get(code) == key:
+            return index
+
+        oc = np.asarray(oc, dtype=float)
+        if index is not None and index.covers(oc):
+            if len(oc) > index.n:
+                index = index.extend(oc)
+                self.stats["extended"] += 1
+                self._dirty = True
+        else:
+            index = PeakIndex.build(oc)
+            self.stats["built"] += 1
+            self._dirty = True
+        self._indices[code] = index
+        self._keys[code] = key
+        return index
+
+    def _load(self) -> None:
+        try:
+            with np.load(self.path, allow_pickle=False) as z:
+                codes, n, digests = z["codes"], z["n"], z["digest"]
+                offsets = z["offsets"]
+                left, right, lb, rb = z["left"], z["right"], z["lb"], z["rb"]
+                lmin, rmin = z["lmin"], z["rmin"]
+        except Exception as e:  # noqa: BLE001
+            logger.warning("峰值索引 %s 读取失败，将重新构建：%s", self.path, e)
+            return
+        for i, code in enumerate(codes):
+            a, b = offsets[i], offsets[i + 1]
+            self._indices[str(code)] = PeakIndex(
+                int(n[i]), str(digests[i]),
+                left[a:b], right[a:b], lb[a:b], rb[a:b], lmin[a:b], rmin[a:b],
+            )
+        self.stats["loaded"] = len(codes)
+
+    def save(self) -> None:
+        if self.path is None or not self._dirty:
+            return
+        codes = sorted(self._indices)
+        idx = [self._indices[c] for c in codes]
+        offsets = np.concatenate([[0], np.cumsum([len(p.left) for p in idx])]).astype(np.int64)
+
+        def _cat(name: str, dtype=np.int64) -> np.ndarray:
+            parts = [getattr(p, name) for p in idx]
+            return np.concatenate(parts).astype(dtype) if parts else np.zeros(0, dtype=dtype)
+
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        with open(tmp, "wb") as f:
+            np.savez(
+                f,
+                codes=np.array(codes, dtype=str),
+                n=np.array([p.n for p in idx], dtype=np.int64),
+                digest=np.array([p.digest for p in idx], dtype=str),
+                offsets=offsets,
+                left=_cat("left"),
+                right=_cat("right"),
+                lb=_cat("lb"),
+                rb=_cat("rb"),
+                lmin=_cat("lmin", float),
+                rmin=_cat("rmin", float),
+            )
+        tmp.replace(self.path)
+        self._dirty = False
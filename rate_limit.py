@@ -0,0 +1,368 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import threading
+import time
+from collections import Counter, deque
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, AsyncIterator, Deque, Dict, Iterator, List, Optional
+
+logger = logging.getLogger("rate_limit")
+
+# --------------------------- 自适应限流 --------------------------- #
+#
+# 每个数据源一个限流器，同时约束两件事：
+#   * 请求速率 —— 令牌桶，每秒补充 rate 个令牌，桶容量 burst；
+#   * 在途请求数 —— 并发上限 limit。
+# 二者按 AIMD 自适应：起步阶段（慢启动）每个健康的评估窗口二者翻倍，首次收缩后改为
+# limit 加 1、rate 加约 5%；被限流或错误率超过阈值时 limit 与 rate 减半，
+# 延迟在连续两个评估窗口都明显高于近期中位数时只收缩 limit。同一“往返时间”内只收缩一次，避免一批同时失败的请求
+# 把上限一路压到底。个别代码的偶发错误（如停牌、代码不存在）不会触发收缩。
+
+# 异常信息中出现这些字样视为被数据源限流
+_THROTTLE_HINTS = ("429", "too many", "rate limit", "频繁", "限流", "每分钟", "最多访问")
+
+
+def is_throttle(exc: BaseException) -> bool:
+    msg = str(exc).lower()
+    return any(h in msg for h in _THROTTLE_HINTS)
+
+# --------------------------- 熔断 --------------------------- #
+#
+# 数据源整体不可用（接口下线、账号被封、网络中断）时，限流只会把速率压到最低，剩下的每只股票
+# 仍要各自失败、退避重试，一次几千只的运行可能拖上几个小时。每个数据源一个熔断器：
+#   * closed    —— 正常放行，记录最近 window 个请求的成败，样本不少于 min_requests 且
+#                  失败率达到 failure_rate 时打开；
+#   * open      —— 拒绝所有请求（排队中的也立即失败），cooldown 秒后转为半开；
+#   * half_open —— 只放行一个探测请求，成功则关闭，失败则重新打开且冷却时间翻倍（最长 max_cooldown）。
+# 被限流不算失败：数据源是可达的，降速交给限流器。
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+
+class CircuitOpen(RuntimeError):
+    """数据源熔断中，请求未发出。"""
+
+    def __init__(self, name: str, retry_in: float) -> None:
+        super().__init__(f"{name} 熔断中，约 {retry_in:.0f}s 后探测恢复")
+        self.name = name
+        self.retry_in = retry_in
+
+
+class CircuitBreaker:
+    """单个数据源的熔断器，线程安全；状态切换记录在 ``transitions``。"""
+
+    def __init__(
+        self,
+        name: str,
+        failure_rate: float = 0.5,
+        window: int = 20,
+        min_requests: int = 10,
+        cooldown: float = 30.0,
+        max_cooldown: float = 300.0,
+    ) -> None:
+        self.name = name
+        self.failure_rate = failure_rate       # <= 0 时不熔断
+        self.min_requests = max(1, min(min_requests, window))
+        self.base_cooldown = cooldown
+        self.max_cooldown = max(cooldown, max_cooldown)
+        self.cooldown = cooldown
+        self.state = CLOSED
+        self.transitions: List[Dict[str, Any]] = []
+        self._outcomes: Deque[bool] = deque(maxlen=max(1, window))   # True 为失败
+        self._opened = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def _switch(self, state: str, reason: str) -> None:
+        """持锁调用。"""
+        self.transitions.append({"time": time.time(), "from": self.state, "to": state, "reason": reason})
+        log = logger.warning if state == OPEN else logger.info
+        log("熔断 %s：%s → %s（%s）", self.name, self.state, state, reason)
+        self.state = state
+        if state == OPEN:
+            self._opened = time.monotonic()
+            self._outcomes.clear()
+        self._probing = False
+
+    def retry_in(self) -> float:
+        """距下一次探测的秒数（非 open 时为 0）。"""
+        if self.state != OPEN:
+            return 0.0
+        return max(0.0, self.cooldown - (time.monotonic() - self._opened))
+
+    def blocked(self) -> bool:
+        """此刻是否拒绝请求（不占用探测名额）。"""
+        with self._lock:
+            if self.state == OPEN:
+                return time.monotonic() - self._opened < self.cooldown
+            return self.state == HALF_OPEN and self._probing
+
+    def allow(self) -> bool:
+        """请求即将发出时调用：放行返回 True；冷却结束后的第一个请求即为半开探测。"""
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN:
+                if time.monotonic() - self._opened < self.cooldown:
+                    return False
+                self._switch(HALF_OPEN, f"冷却 {self.cooldown:g}s 结束，发出探测请求")
+            if self._probing:
+                return False
+            self._probing = True
+            return True
+
+    def record(self, ok: bool) -> None:
+        with self._lock:
+            if self.state == HALF_OPEN:
+                # 半开期间只放行了探测请求，由它的结果决定去留
+                if ok:
+                    self.cooldown = self.base_cooldown
+                    self._switch(CLOSED, "探测请求成功")
+                else:
+                    self.cooldown = min(self.max_cooldown, self.cooldown * 2)
+                    self._switch(OPEN, f"探测请求失败，冷却延长至 {self.cooldown:g}s")
+                return
+            if self.state == OPEN:
+                return                          # 打开前已发出的请求，结果不再计入
+            self._outcomes.append(not ok)
+            n, failed = len(self._outcomes), sum(self._outcomes)
+            if self.failure_rate > 0 and n >= self.min_requests and failed >= self.failure_rate * n:
+                self._switch(OPEN, f"最近 {n} 次请求失败 {failed} 次")
+
+    @property
+    def trips(self) -> int:
+        """打开的次数。"""
+        return sum(t["to"] == OPEN for t in self.transitions)
+
+    def __repr__(self) -> str:
+        return f"CircuitBreaker({self.name!r}, state={self.state}, failure_rate={self.failure_rate})"
+
+
+# 新建熔断器的参数；configure_breakers 修改（之后新建或重建的限流器生效）
+BREAKER_DEFAULTS: Dict[str, Any] = dict(failure_rate=0.5, window=20, min_requests=10, cooldown=30.0)
+
+
+def configure_breakers(**params: Any) -> None:
+    """修改熔断参数（见 ``CircuitBreaker``）并应用到已有的限流器：状态重置为 closed。"""
+    BREAKER_DEFAULTS.update(params)
+    with _LIMITERS_LOCK:
+        for lim in _LIMITERS.values():
+            lim.breaker = CircuitBreaker(lim.name, **BREAKER_DEFAULTS)
+
+
+class AdaptiveLimiter:
+    """
+    数据源级别的令牌桶 + 自适应并发控制，线程安全；同步代码用 ``slot()``，
+    协程用 ``aslot()``。块内抛出的异常记为失败（仍向外抛出），正常退出记为成功并计入延迟。
+    成败同时计入该数据源的熔断器 ``breaker``；熔断中取名额（包括已在排队的）抛出 ``CircuitOpen``。
+    """
+
+    def __init__(
+        self,
+        name: str,
+        rate: float = 5.0,
+        max_rate: float = 50.0,
+        min_rate: float = 0.2,
+        concurrency: int = 2,
+        max_concurrency: int = 16,
+        min_concurrency: int = 1,
+        latency_factor: float = 2.0,
+        error_threshold: float = 0.2,
+    ) -> None:
+        self.name = name
+        self.max_rate = max_rate
+        self.min_rate = min(min_rate, max_rate)
+        self.rate = min(max(rate, self.min_rate), max_rate)
+        self.max_concurrency = max(1, max_concurrency)
+        self.min_concurrency = min(max(1, min_concurrency), self.max_concurrency)
+        self.limit = float(min(max(concurrency, self.min_concurrency), self.max_concurrency))
+        self.latency_factor = latency_factor   # 延迟超过基线的倍数视为退化
+        self.error_threshold = error_threshold # 错误率 EWMA 超过该值时收缩
+
+        self.tokens = 1.0
+        self._stamp = time.monotonic()
+        self.inflight = 0
+        self._lat: Optional[float] = None       # 延迟 EWMA
+        self._slow = 0                          # 延迟偏高的连续评估窗口数
+        self._errors = 0.0                      # 错误率 EWMA
+        self._samples: Deque[float] = deque(maxlen=256)   # 最近成功请求的延迟（分位数用）
+        self._healthy = 0
+        self._slow_start = True
+        self._last_cut = 0.0
+        self.counts: Counter = Counter()
+        self.waited = 0.0                       # 累计排队等待名额与令牌的秒数
+        self.breaker = CircuitBreaker(name, **BREAKER_DEFAULTS)
+        self._cond = threading.Condition()
+
+    # ---------- 令牌与并发名额 ---------- #
+    @property
+    def burst(self) -> float:
+        return max(1.0, self.rate / 4)
+
+    def _try_acquire(self) -> float:
+        """持锁调用：拿到名额与令牌返回 0，否则返回建议等待秒数；熔断中抛出 CircuitOpen。"""
+        if self.breaker.blocked():
+            raise CircuitOpen(self.name, self.breaker.retry_in())
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self._stamp) * self.rate)
+        self._stamp = now
+        if self.inflight >= int(self.limit):
+            return 0.05
+        if self.tokens < 1.0:
+            return (1.0 - self.tokens) / self.rate
+        if not self.breaker.allow():            # 半开时探测名额已被别的请求拿走
+            raise CircuitOpen(self.name, self.breaker.retry_in())
+        self.tokens -= 1.0
+        self.inflight += 1
+        return 0.0
+
+    def acquire(self) -> None:
+        t0 = time.monotonic()
+        with self._cond:
+            while (wait := self._try_acquire()) > 0:
+                self._cond.wait(wait)
+            self.waited += time.monotonic() - t0
+
+    async def acquire_async(self) -> None:
+        t0 = time.monotonic()
+        while True:
+            with self._cond:
+                wait = self._try_acquire()
+                if wait <= 0:
+                    self.waited += time.monotonic() - t0
+                    return
+            await asyncio.sleep(wait)
+
+    def release(self, latency: float, ok: bool = True, throttled: bool = False) -> None:
+        with self._cond:
+            self.inflight -= 1
+            self._adjust(latency, ok, throttled)
+            self._cond.notify_all()
+
+    # ---------- AIMD ---------- #
+    def _cut(self, factor: float, rate_too: bool) -> None:
+        now = time.monotonic()
+        if now - self._last_cut < max(self._lat or 0.0, 0.5):
+            return
+        self._last_cut = now
+        self._healthy = 0
+        self._slow_start = False
+        self.limit = max(float(self.min_concurrency), self.limit * factor)
+        if rate_too:
+            self.rate = max(self.min_rate, self.rate * factor)
+            self.tokens = min(self.tokens, self.burst)
+        self.counts["decrease"] += 1
+
+    def _adjust(self, latency: float, ok: bool, throttled: bool) -> None:
+        self.breaker.record(ok or throttled)
+        self._errors = 0.9 * self._errors + 0.1 * (not ok)
+        if not ok:
+            self.counts["error"] += 1
+            self.counts["throttled"] += throttled
+            if throttled or self._errors > self.error_threshold:
+                self._cut(0.5, rate_too=True)
+            return
+        self.counts["ok"] += 1
+        self._samples.append(latency)
+        self._lat = latency if self._lat is None else 0.8 * self._lat + 0.2 * latency
+        # 大约每秒（或每 limit 个请求，取先到者）评估一次；并发名额未用满时不再加大 limit
+        self._healthy += 1
+        if self._healthy < max(1.0, min(self.limit, self.rate)):
+            return
+        self._healthy = 0
+        base = self._median_latency()
+        if base is not None and self._lat > base * self.latency_factor:
+            # 延迟明显高于近期中位数：本窗口不加大，连续两个窗口如此才收缩
+            self._slow += 1
+            if self._slow >= 2:
+                self._slow = 0
+                self._cut(0.7, rate_too=False)
+            return
+        self._slow = 0
+        saturated = self.inflight + 1 >= int(self.limit)
+        if (saturated and self.limit < self.max_concurrency) or self.rate < self.max_rate:
+            self.counts["increase"] += 1
+        if self._slow_start:
+            self.limit = min(float(self.max_concurrency), self.limit * (2 if saturated else 1))
+            self.rate = min(self.max_rate, self.rate * 2)
+        else:
+            self.limit = min(float(self.max_concurrency), self.limit + saturated)
+            self.rate = min(self.max_rate, self.rate + max(0.1, self.rate * 0.05))
+
+    def _median_latency(self) -> Optional[float]:
+        """持锁调用：最近成功请求延迟的中位数；样本不足 20 个时为 None。"""
+        if len(self._samples) < 20:
+            return None
+        samples = sorted(self._samples)
+        return samples[len(samples) // 2]
+
+    # ---------- 上下文管理 ---------- #
+    @contextmanager
+    def slot(self) -> Iterator[None]:
+        self.acquire()
+        t0 = time.monotonic()
+        try:
+            yield
+        except BaseException as e:
+            self.release(time.monotonic() - t0, ok=False, throttled=is_throttle(e))
+            raise
+        self.release(time.monotonic() - t0)
+
+    @asynccontextmanager
+    async def aslot(self) -> AsyncIterator[None]:
+        await self.acquire_async()
+        t0 = time.monotonic()
+        try:
+            yield
+        except BaseException as e:
+            self.release(time.monotonic() - t0, ok=False, throttled=is_throttle(e))
+            raise
+        self.release(time.monotonic() - t0)
+
+    def latency_quantile(self, q: float = 0.95) -> Optional[float]:
+        """最近成功请求延迟的 *q* 分位数（秒）；样本不足 20 个时返回 None。"""
+        with self._cond:
+            samples = sorted(self._samples)
+        if len(samples) < 20:
+            return None
+        return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+    def backoff(self, attempt: int) -> float:
+        """第 *attempt* 次失败后的重试等待：按当前速率的请求间隔指数增长，最长 30 秒。"""
+        return min(30.0, max(0.5, 1.0 / self.rate) * 2 ** (attempt - 1))
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "rate": round(self.rate, 2),
+            "concurrency": int(self.limit),
+            "latency_ms": round((self._lat or 0.0) * 1000, 1),
+            "wait_s": round(self.waited, 2),
+            "breaker": self.breaker.state,
+            "trips": self.breaker.trips,
+            **{k: self.counts[k] for k in ("ok", "error", "throttled", "increase", "decrease")},
+        }
+
+    def __repr__(self) -> str:
+        return f"AdaptiveLimiter({self.name!r}, rate={self.rate:.2f}/s, concurrency={int(self.limit)})"
+
+
+_LIMITERS: Dict[str, AdaptiveLimiter] = {}
+_LIMITERS_LOCK = threading.Lock()
+
+
+def get_limiter(name: str, **defaults: Any) -> AdaptiveLimiter:
+    """进程级共享的数据源限流器；首次取用时以 *defaults* 创建。"""
+    with _LIMITERS_LOCK:
+        lim = _LIMITERS.get(name)
+        if lim is None:
+            lim = _LIMITERS[name] = AdaptiveLimiter(name, **defaults)
+        return lim
+
+
+def configure_limiter(name: str, **params: Any) -> AdaptiveLimiter:
+    """按本次运行的参数重建 *name* 的限流器。"""
+    with _LIMITERS_LOCK:
+        lim = _LIMITERS[name] = AdaptiveLimiter(name, **params)
+        return lim
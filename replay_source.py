@@ -0,0 +1,200 @@
+from __future__ import annotations
+
+import datetime as dt
+import logging
+import random
+import threading
+import time
+import zlib
+from collections import Counter, deque
+from pathlib import Path
+from typing import Any, Deque, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from kline_store import CALENDAR_FILE, KLINE_COLUMNS, MKTCAP_FILE, KlineStore, open_store
+
+logger = logging.getLogger("replay_source")
+
+# --------------------------- 回放数据源 --------------------------- #
+#
+# 不访问网络的本地数据源，供压测与回归测试使用：K 线、市值快照、交易日历来自
+# 一个夹具目录（即 fetch_kline 的输出目录，任意存储格式），或由按代码确定的随机游走生成。
+# 同样的参数与种子每次生成同样的数据。每个请求可注入延迟、随机错误与限流响应；
+# 限流响应的信息含 "429"，会被限流器识别为被数据源限流。
+#
+# 可按名称注册多个实例（fetch_kline 中的 replay 与 replay2）：数据参数相同时返回相同的数据，
+# 延迟与故障各自设置，用来离线演练对冲与熔断改道。
+
+# 合成股票池的代码前缀（主板 / 中小板 / 创业板 / 沪市主板），按顺序轮流分配
+_SYNTH_PREFIXES = ("000", "002", "300", "600", "601", "603")
+_SYNTH_START = "20150101"
+
+
+class ReplayThrottled(RuntimeError):
+    """注入的限流响应。"""
+
+
+class ReplayError(ConnectionError):
+    """注入的请求错误。"""
+
+
+class ReplaySource:
+    """
+    本地回放数据源，线程安全。
+
+    *fixture_dir* 给定时从该目录读取 K 线（缺少的代码返回空表）、``mktcap_snapshot.csv`` 与
+    ``trade_calendar.csv``；否则合成 *codes* 只股票自 2015 年至今每个工作日的日线（无除权，
+    前复权即原始价），合成的交易日历与新浪日历一样延伸到当年年底。
+
+    每个请求先按 *quota*（次/秒，0 为不限）与 *throttle_rate* 决定是否立即返回限流，
+    再等待 *latency* 秒（按 σ=*jitter* 的对数正态分布抖动），最后以 *error_rate* 的概率抛出错误。
+    故障注入的随机序列取自 *fault_seed*（缺省同 *seed*），同一份数据的多个实例可互不相关地出错。
+    """
+
+    def __init__(
+        self,
+        fixture_dir: Optional[Path] = None,
+        codes: int = 5000,
+        seed: int = 0,
+        latency: float = 0.0,
+        jitter: float = 0.5,
+        error_rate: float = 0.0,
+        throttle_rate: float = 0.0,
+        quota: float = 0.0,
+        fault_seed: Optional[int] = None,
+    ) -> None:
+        self.fixture_dir = Path(fixture_dir) if fixture_dir else None
+        self.n_codes = codes
+        self.seed = seed
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.quota = quota
+        self.counts: Counter = Counter()
+        self._rng = random.Random(seed if fault_seed is None else fault_seed)
+        self._recent: Deque[float] = deque()    # 最近 1 秒内放行的请求时刻（配额判断用）
+        self._lock = threading.Lock()
+        self._store: Optional[KlineStore] = open_store(self.fixture_dir) if self.fixture_dir else None
+        self._frames: Dict[str, pd.DataFrame] = {}
+        self._calendar: Optional[pd.DatetimeIndex] = None
+
+    # ---------- 故障注入 ---------- #
+    def _inject(self) -> None:
+        with self._lock:
+            self.counts["request"] += 1
+            now = time.monotonic()
+            while self._recent and now - self._recent[0] > 1.0:
+                self._recent.popleft()
+            throttled = self._rng.random() < self.throttle_rate or (
+                self.quota > 0 and len(self._recent) >= self.quota
+            )
+            if not throttled:
+                self._recent.append(now)
+            failed = not throttled and self._rng.random() < self.error_rate
+            delay = self.latency * self._rng.lognormvariate(0.0, self.jitter) if self.latency > 0 else 0.0
+            self.counts["throttled"] += throttled
+            self.counts["error"] += failed
+        if throttled:
+            raise ReplayThrottled("replay: 429 Too Many Requests，访问过于频繁")
+        if delay:
+            time.sleep(delay)
+        if failed:
+            raise ReplayError("replay: 注入的请求错误")
+
+    # ---------- 合成数据 ---------- #
+    def universe(self) -> List[str]:
+        """股票池：夹具目录中的全部代码，或合成的 *codes* 只。"""
+        if self._store is not None:
+            return self._store.codes()
+        n = len(_SYNTH_PREFIXES)
+        return [f"{_SYNTH_PREFIXES[i % n]}{i // n + 1:03d}" for i in range(self.n_codes)]
+
+    def _code_rng(self, code: str) -> np.random.Generator:
+        return np.random.default_rng([self.seed, zlib.crc32(code.encode())])
+
+    def _synth(self, code: str) -> pd.DataFrame:
+        df = self._frames.get(code)
+        if df is not None:
+            return df
+        dates = self.calendar()
+        dates = dates[dates <= pd.Timestamp.today().normalize()]
+        rng = self._code_rng(code)
+        n = len(dates)
+        close = rng.uniform(5, 50) * np.exp(np.cumsum(np.clip(rng.normal(3e-4, 0.02, n), -0.1, 0.1)))
+        open_ = np.r_[close[0], close[:-1]] * (1 + rng.normal(0, 0.005, n))
+        high = np.maximum(open_, close) * (1 + np.abs(rng.normal(0, 0.01, n)))
+        low = np.minimum(open_, close) * (1 - np.abs(rng.normal(0, 0.01, n)))
+        volume = np.round(rng.lognormal(16, 0.6, n), -2)
+        df = pd.DataFrame(
+            {"date": dates, "open": open_, "close": close, "high": high, "low": low, "volume": volume}
+        ).round({"open": 2, "close": 2, "high": 2, "low": 2})
+        self._frames[code] = df      # 并发生成同一代码结果相同，无需加锁
+        return df
+
+    # ---------- 数据接口 ---------- #
+    def kline(self, code: str, start: str, end: str) -> pd.DataFrame:
+        """*code* 在 [start, end] 内的日线（列同 ``KLINE_COLUMNS``）。"""
+        self._inject()
+        if self._store is not None:
+            if not self._store.exists(code):
+                return pd.DataFrame(columns=KLINE_COLUMNS)
+            df = self._store.read(code)
+        else:
+            df = self._synth(code)
+        start_ts = pd.to_datetime(start, format="%Y%m%d")
+        end_ts = pd.to_datetime(end, format="%Y%m%d")
+        return df[(df["date"] >= start_ts) & (df["date"] <= end_ts)][KLINE_COLUMNS].reset_index(drop=True)
+
+    def mktcap(self) -> pd.DataFrame:
+        """市值快照，列：code, mktcap（单位：元）。"""
+        self._inject()
+        if self.fixture_dir is not None and (self.fixture_dir / MKTCAP_FILE).exists():
+            return pd.read_csv(self.fixture_dir / MKTCAP_FILE, dtype={"code": str})
+        codes = self.universe()
+        caps = [float(np.round(self._code_rng(c).lognormal(23.5, 1.0), -6)) for c in codes]
+        return pd.DataFrame({"code": codes, "mktcap": caps})
+
+    def calendar(self) -> pd.DatetimeIndex:
+        """
+        交易日历：夹具目录中的 ``trade_calendar.csv``，否则为 2015 年至当年年底的工作日（首次调用后缓存）。
+        覆盖到年底，周末、节假日运行时日历仍覆盖 ``--end today``，抓取规划照常进行。
+        """
+        if self._calendar is None:
+            if self.fixture_dir is not None and (self.fixture_dir / CALENDAR_FILE).exists():
+                path = self.fixture_dir / CALENDAR_FILE
+                self._calendar = pd.DatetimeIndex(pd.read_csv(path, parse_dates=["date"])["date"])
+            else:
+                days = pd.date_range(_SYNTH_START, dt.date(dt.date.today().year, 12, 31), freq="D")
+                self._calendar = days[days.dayofweek < 5]    # bdate_range 逐日生成，慢两个数量级
+        return self._calendar
+
+    def __repr__(self) -> str:
+        src = str(self.fixture_dir) if self.fixture_dir else f"synthetic×{self.n_codes}"
+        return (
+            f"ReplaySource({src}, latency={self.latency}s, error_rate={self.error_rate}, "
+            f"throttle_rate={self.throttle_rate}, quota={self.quota}/s)"
+        )
+
+
+_REPLAYS: Dict[str, ReplaySource] = {}
+_REPLAY_LOCK = threading.Lock()
+
+
+def get_replay(name: str = "replay") -> ReplaySource:
+    """进程级共享的回放数据源 *name*（未配置时为无故障注入的合成数据）。"""
+    with _REPLAY_LOCK:
+        src = _REPLAYS.get(name)
+        if src is None:
+            src = _REPLAYS[name] = ReplaySource()
+        return src
+
+
+def configure_replay(name: str = "replay", **params: Any) -> ReplaySource:
+    """按本次运行的参数重建共享回放数据源 *name*（参数见 ``ReplaySource``）。"""
+    with _REPLAY_LOCK:
+        src = _REPLAYS[name] = ReplaySource(**params)
+        logger.info("回放数据源 %s：%r", name, src)
+        return src
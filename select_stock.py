@@ -6,10 +6,16 @@ import json
 import logging
 import sys
 from pathlib import Path
-from typing import Any, Dict, Iterable, List
+from typing import Any, Dict, Iterable, List, Union
 
 import pandas as pd
 
+from Selector import IndicatorCache, tag_frame, use_indicator_cache, use_peak_index
+from kline_store import MANIFEST_FILE, STORE_FORMATS, KlineStore, Manifest, open_store
+from market_file import MARKET_FILE, MarketFile, open_market_file
+from panel import Panel
+from peak_index import PeakIndexStore
+
 # ---------- 日志 ----------
 logging.basicConfig(
     level=logging.INFO,
@@ -25,18 +31,36 @@ logger = logging.getLogger("select")
 
 # ---------- 工具 ----------
 
-def load_data(data_dir: Path, codes: Iterable[str]) -> Dict[str, pd.DataFrame]:
+def load_data(
+    data_dir: Union[Path, KlineStore, MarketFile], codes: Iterable[str], fmt: str = "auto"
+) -> Dict[str, pd.DataFrame]:
+    store = data_dir if isinstance(data_dir, (KlineStore, MarketFile)) else open_store(data_dir, fmt)
     frames: Dict[str, pd.DataFrame] = {}
     for code in codes:
-        fp = data_dir / f"{code}.csv"
-        if not fp.exists():
-            logger.warning("%s 不存在，跳过", fp.name)
+        if not store.exists(code):
+            logger.warning("%s 不存在，跳过", code)
             continue
-        df = pd.read_csv(fp, parse_dates=["date"]).sort_values("date")
-        frames[code] = df
+        df = store.read(code)
+        if not df["date"].is_monotonic_increasing:
+            df = df.sort_values("date")         # 已有序时不排序，保留合并文件的零拷贝视图
+        frames[code] = tag_frame(df, code)
     return frames
 
 
+def latest_date(store: Union[KlineStore, MarketFile], data: Dict[str, pd.DataFrame]) -> pd.Timestamp:
+    """数据最新日期：优先取数据清单 / 合并文件中记录的末日，清单失效时再遍历行情。"""
+    if isinstance(store, MarketFile):
+        last = store.last_date(data)
+        if last is not None:
+            return last
+    else:
+        manifest = Manifest.load(store.root / MANIFEST_FILE, store.name)
+        codes = list(data)
+        if codes and all(manifest.is_fresh(c, store.path(c)) for c in codes):
+            return manifest.max_last_date(codes)
+    return max(df["date"].max() for df in data.values())
+
+
 def load_config(cfg_path: Path) -> List[Dict[str, Any]]:
     if not cfg_path.exists():
         logger.error("配置文件 %s 不存在", cfg_path)
@@ -75,14 +99,93 @@ def instantiate_selector(cfg: Dict[str, Any]):
     return cfg.get("alias", cls_name), cls(**params)
 
 
+def save_peak_index(store: PeakIndexStore | None) -> None:
+    """保存本次新建 / 续算过的峰值索引。"""
+    if store is None:
+        return
+    try:
+        store.save()
+    except OSError as e:
+        logger.warning("峰值索引保存失败：%s", e)
+        return
+    st = store.stats
+    if st["built"] or st["extended"]:
+        logger.info("峰值索引：载入 %d，续算 %d，重建 %d", st["loaded"], st["extended"], st["built"])
+
+
+def run_scan(
+    data: Dict[str, pd.DataFrame],
+    selector_cfgs: List[Dict[str, Any]],
+    start: pd.Timestamp,
+    end: pd.Timestamp,
+    out_dir: str | None,
+) -> None:
+    """对 [start, end] 内每个交易日运行全部 Selector；面板只构造一次。"""
+    panel = Panel.from_frames(data)
+    out = Path(out_dir) if out_dir else None
+    if out is not None:
+        out.mkdir(parents=True, exist_ok=True)
+
+    for cfg in selector_cfgs:
+        if cfg.get("activate", True) is False:
+            continue
+        try:
+            alias, selector = instantiate_selector(cfg)
+        except Exception as e:
+            logger.error("跳过配置 %s：%s", cfg, e)
+            continue
+
+        signals = selector.select_dates(start, end, panel)
+        logger.info("")
+        logger.info("============== 历史扫描 [%s] ==============", alias)
+        logger.info("区间: %s ~ %s，共 %d 个交易日", start.date(), end.date(), len(signals))
+        for d, row in signals.iterrows():
+            picks = row.index[row.to_numpy()].tolist()
+            if picks:
+                logger.info("%s: %s", d.date(), ", ".join(picks))
+
+        if out is not None:
+            long = signals.stack(future_stack=True)
+            long = long[long].reset_index()
+            long.columns = ["date", "code", "signal"]
+            long[["date", "code"]].to_csv(out / f"{alias}.csv", index=False)
+
+
 # ---------- 主函数 ----------
 
 def main():
     p = argparse.ArgumentParser(description="Run selectors defined in configs.json")
     p.add_argument("--data-dir", default="./data", help="CSV 行情目录")
     p.add_argument("--config", default="./configs.json", help="Selector 配置文件")
+    p.add_argument(
+        "--format",
+        choices=["auto", *STORE_FORMATS],
+        default="auto",
+        help="K 线存储格式；auto 按数据目录已有文件识别",
+    )
+    p.add_argument(
+        "--market-file",
+        nargs="?",
+        const=MARKET_FILE,
+        help=f"从合并的内存映射行情文件加载（见 market_file.py，相对路径位于 --data-dir 下）；不带值时为 {MARKET_FILE}",
+    )
     p.add_argument("--date", help="交易日 YYYY-MM-DD；缺省=数据最新日期")
     p.add_argument("--tickers", default="all", help="'all' 或逗号分隔股票代码列表")
+    p.add_argument(
+        "--engine",
+        choices=["frame", "panel"],
+        default="frame",
+        help="frame=逐股票 DataFrame；panel=全市场二维数组批量计算",
+    )
+    p.add_argument("--cache-mb", type=float, default=512, help="指标缓存内存上限（MB），0 表示关闭")
+    p.add_argument(
+        "--peak-index",
+        default="peak_index.npz",
+        help="峰值索引文件名（保存在 --data-dir 下，新数据到达时增量更新）；设为空字符串关闭",
+    )
+    p.add_argument("--scan-start", help="历史扫描起始日 YYYY-MM-DD；指定后对区间内每个交易日选股")
+    p.add_argument("--scan-end", help="历史扫描结束日；缺省=--date")
+    p.add_argument("--scan-out", help="历史扫描结果输出目录（每个 Selector 一个 CSV）；缺省仅写日志")
     args = p.parse_args()
 
     # --- 加载行情 ---
@@ -91,8 +194,19 @@ def main():
         logger.error("数据目录 %s 不存在", data_dir)
         sys.exit(1)
 
+    store = open_store(data_dir, args.format)
+    if args.market_file:
+        mf_path = Path(args.market_file)
+        mf_path = mf_path if mf_path.is_absolute() else data_dir / mf_path
+        if not mf_path.exists():
+            logger.error("合并行情文件 %s 不存在，请先运行 market_file.py", mf_path)
+            sys.exit(1)
+        market = open_market_file(mf_path)
+        if market.is_stale(store):
+            logger.warning("%s 早于部分行情文件，请重新运行 market_file.py 合并", mf_path.name)
+        store = market
     codes = (
-        [f.stem for f in data_dir.glob("*.csv")]
+        store.codes()
         if args.tickers.lower() == "all"
         else [c.strip() for c in args.tickers.split(",") if c.strip()]
     )
@@ -100,40 +214,65 @@ def main():
         logger.error("股票池为空！")
         sys.exit(1)
 
-    data = load_data(data_dir, codes)
+    data = load_data(store, codes)
     if not data:
         logger.error("未能加载任何行情数据")
         sys.exit(1)
 
-    trade_date = (
-        pd.to_datetime(args.date)
-        if args.date
-        else max(df["date"].max() for df in data.values())
-    )
+    trade_date = pd.to_datetime(args.date) if args.date else latest_date(store, data)
     if not args.date:
         logger.info("未指定 --date，使用最近日期 %s", trade_date.date())
 
     # --- 加载 Selector 配置 ---
     selector_cfgs = load_config(Path(args.config))
 
+    # --- 峰值索引：随行情数据持久化，PeakKDJSelector 复用 ---
+    peak_store = PeakIndexStore(data_dir / args.peak_index) if args.peak_index else None
+
+    # --- 历史扫描模式 ---
+    if args.scan_start:
+        scan_end = pd.to_datetime(args.scan_end) if args.scan_end else trade_date
+        with use_peak_index(peak_store):
+            run_scan(data, selector_cfgs, pd.to_datetime(args.scan_start), scan_end, args.scan_out)
+        save_peak_index(peak_store)
+        return
+
+    # --- 面板：一次对齐全部股票，供所有 Selector 复用 ---
+    panel = Panel.from_frames(data) if args.engine == "panel" else None
+
+    # --- 指标缓存：本次运行的所有 Selector 共享 ---
+    cache = IndicatorCache(int(args.cache_mb * 1024 ** 2)) if args.cache_mb > 0 else None
+
     # --- 逐个 Selector 运行 ---
-    for cfg in selector_cfgs:
-        if cfg.get("activate", True) is False:
-            continue
-        try:
-            alias, selector = instantiate_selector(cfg)
-        except Exception as e:
-            logger.error("跳过配置 %s：%s", cfg, e)
-            continue
+    with use_indicator_cache(cache), use_peak_index(peak_store):
+        for cfg in selector_cfgs:
+            if cfg.get("activate", True) is False:
+                continue
+            try:
+                alias, selector = instantiate_selector(cfg)
+            except Exception as e:
+                logger.error("跳过配置 %s：%s", cfg, e)
+                continue
 
-        picks = selector.select(trade_date, data)
+            if panel is not None:
+                picks = selector.select_panel(trade_date, panel)
+            else:
+                picks = selector.select(trade_date, data)
 
-        # 将结果写入日志，同时输出到控制台
-        logger.info("")
-        logger.info("============== 选股结果 [%s] ==============", alias)
-        logger.info("交易日: %s", trade_date.date())
-        logger.info("符合条件股票数: %d", len(picks))
-        logger.info("%s", ", ".join(picks) if picks else "无符合条件股票")
+            # 将结果写入日志，同时输出到控制台
+            logger.info("")
+            logger.info("============== 选股结果 [%s] ==============", alias)
+            logger.info("交易日: %s", trade_date.date())
+            logger.info("符合条件股票数: %d", len(picks))
+            logger.info("%s", ", ".join(picks) if picks else "无符合条件股票")
+
+    if cache is not None:
+        st = cache.stats()
+        logger.info(
+            "指标缓存：命中 %d / 未命中 %d，条目 %d，占用 %.1f MB，淘汰 %d",
+            st["hits"], st["misses"], st["entries"], st["bytes"] / 1024 ** 2, st["evictions"],
+        )
+    save_peak_index(peak_store)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+熔断测试脚本
+以回放数据源注入故障，验证一次抓取运行中熔断器 open → half_open → closed / open 的切换，
+以及冷却结束后的探测重试
+"""
+
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+os.environ.setdefault("TQDM_DISABLE", "1")
+
+import fetch_kline as fk
+from kline_store import open_store
+from rate_limit import configure_breakers, configure_limiter
+from replay_source import configure_replay
+
+CODES = 40
+
+
+def _run(recover: bool):
+    """错误率 100% 的回放数据源上抓取 CODES 只股票；*recover* 时熔断打开后故障随即消失。"""
+    configure_breakers(failure_rate=0.5, window=20, min_requests=10, cooldown=0.3)
+    limiter = configure_limiter("replay", **fk.RATE_LIMITS["replay"])
+    replay = configure_replay("replay", codes=CODES, error_rate=1.0)
+    fk.HEDGE_TO.clear()
+
+    def heal():
+        while limiter.breaker.state != "open":
+            time.sleep(0.005)
+        replay.error_rate = 0.0
+
+    if recover:
+        threading.Thread(target=heal, daemon=True).start()
+    with tempfile.TemporaryDirectory() as tmp:
+        store = open_store(Path(tmp), "csv", manifest=True)
+        plan = dict.fromkeys(replay.universe())
+        stats = fk.fetch_all_threaded(plan, "20240101", "20240630", store, "replay", 4, 8)
+    return stats, [(t["from"], t["to"]) for t in limiter.breaker.transitions]
+
+
+def test_breaker_recovers_after_probe():
+    """探测成功：熔断恢复，被跳过的股票在同一次运行中全部抓取完成"""
+    stats, transitions = _run(recover=True)
+    assert transitions == [("closed", "open"), ("open", "half_open"), ("half_open", "closed")]
+    assert stats["circuit_open"] == 0
+    assert stats["written"] + stats["failed"] == CODES
+    assert stats["written"] > 0
+
+
+def test_breaker_reopens_when_probe_fails():
+    """探测失败：熔断再次打开，剩余股票快速失败并记为熔断跳过"""
+    t0 = time.monotonic()
+    stats, transitions = _run(recover=False)
+    # 探测股票自身的退避重试可能再触发几轮 half_open → open，最终仍为 open
+    assert transitions[:3] == [("closed", "open"), ("open", "half_open"), ("half_open", "open")]
+    assert transitions[-1] == ("half_open", "open")
+    assert stats["circuit_open"] > 0
+    assert stats["circuit_open"] + stats["failed"] == CODES
+    assert time.monotonic() - t0 < 30
+
+
+if __name__ == "__main__":
+    test_breaker_recovers_after_probe()
+    test_breaker_reopens_when_probe_fails()
+    print("✓ 熔断测试通过")
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+按交易日批量更新测试脚本
+以替换的实时行情接口验证：收盘前不用实时行情写入当天的 K 线（交给逐只请求），
+收盘后昨收与本地末根一致的股票直接追加（AKShare / Mootdx）
+"""
+
+import datetime as dt
+import os
+import tempfile
+from pathlib import Path
+
+os.environ.setdefault("TQDM_DISABLE", "1")
+
+import pandas as pd
+
+import fetch_kline as fk
+from kline_store import open_store
+from rate_limit import configure_limiter
+
+TODAY = dt.date(2024, 3, 1)
+CODES = ["000001", "600000"]
+
+
+def _store(tmp: str):
+    """两只股票的本地数据截至前一交易日，收盘价均为 10。"""
+    store = open_store(Path(tmp), "csv", manifest=True)
+    for code in CODES:
+        store.write(code, pd.DataFrame({
+            "date": pd.to_datetime(["2024-02-28", "2024-02-29"]),
+            "open": [9.8, 9.9], "close": [9.9, 10.0], "high": [10.0, 10.1], "low": [9.7, 9.8], "volume": [1e4, 1e4],
+        }))
+    return store
+
+
+def _candidates():
+    last = pd.Timestamp("2024-02-29")
+    return {code: (last, pd.DatetimeIndex([pd.Timestamp(TODAY)])) for code in CODES}
+
+
+def _at(monkeypatch, hour: int, minute: int) -> None:
+    now = dt.datetime.combine(TODAY, dt.time(hour, minute), tzinfo=fk._BEIJING)
+    monkeypatch.setattr(fk, "_beijing_now", lambda: now)
+
+
+def test_akshare_spot_waits_for_close(monkeypatch):
+    """盘中不请求实时行情、不产出 K 线；收盘后按行情补当天一根。"""
+    calls = []
+
+    def spot():
+        calls.append(1)
+        return pd.DataFrame({
+            "代码": CODES, "今开": [10.1, 10.2], "最新价": [10.5, 10.3], "最高": [10.6, 10.4],
+            "最低": [10.0, 10.1], "成交量": [2e4, 3e4], "昨收": [10.0, 10.0],
+        })
+
+    monkeypatch.setattr(fk.ak, "stock_zh_a_spot_em", spot)
+    configure_limiter("akshare", **fk.RATE_LIMITS["akshare"])
+    with tempfile.TemporaryDirectory() as tmp:
+        store = _store(tmp)
+
+        _at(monkeypatch, 14, 30)
+        assert fk._bulk_akshare(_candidates(), store) == {}
+        assert not calls
+
+        _at(monkeypatch, 15, 30)
+        out = fk._bulk_akshare(_candidates(), store)
+        assert calls and sorted(out) == CODES
+        assert out["000001"]["date"].tolist() == [pd.Timestamp(TODAY)]
+        assert out["000001"]["close"].tolist() == [10.5]
+
+
+class _Pool:
+    """替代 mootdx 连接池：call(fn) 以假客户端调用 fn，记录每批查询的股票。"""
+
+    def __init__(self) -> None:
+        self.batches = []
+
+    def call(self, fn):
+        return fn(self)
+
+    def quotes(self, symbol):
+        self.batches.append(list(symbol))
+        return pd.DataFrame({
+            "code": symbol, "open": 10.1, "price": 10.4, "high": 10.6, "low": 10.0,
+            "vol": 2e4, "last_close": [10.0, 9.5][: len(symbol)],
+        })
+
+
+def test_mootdx_quotes_wait_for_close(monkeypatch):
+    """盘中不查询通达信行情；收盘后昨收一致的股票补当天一根，昨收不一致（除权）的交给逐只请求。"""
+    pool = _Pool()
+    monkeypatch.setattr(fk, "get_pool", lambda: pool)
+    configure_limiter("mootdx", **fk.RATE_LIMITS["mootdx"])
+    with tempfile.TemporaryDirectory() as tmp:
+        store = _store(tmp)
+
+        _at(monkeypatch, 9, 45)
+        assert fk._bulk_mootdx(_candidates(), store) == {}
+        assert not pool.batches
+
+        _at(monkeypatch, 15, 5)
+        out = fk._bulk_mootdx(_candidates(), store)
+        assert pool.batches == [CODES]
+        assert list(out) == ["000001"]
+        assert out["000001"]["close"].tolist() == [10.4]
+
+
+if __name__ == "__main__":
+    import pytest
+
+    raise SystemExit(pytest.main([__file__, "-q"]))
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+抓取运行日志测试脚本
+验证中断后加载日志时截去不完整的末行、回放出每只股票的状态，
+并可在其后继续追加记录（--resume / --retry-failed 的基础）
+"""
+
+import tempfile
+from pathlib import Path
+
+import pandas as pd
+
+from fetch_journal import JOURNAL_FILE, RunJournal
+
+META = {"start": "20240101", "end": "20240329", "datasource": "replay", "freq": 4}
+
+
+def _plan():
+    gaps = pd.DatetimeIndex(["2024-03-01", "2024-03-04"])
+    return {"000001": None, "000002": gaps, "600000": None, "600001": None}
+
+
+def _interrupted(path: Path) -> RunJournal:
+    """写了两条结果、第三条写到一半时进程退出的运行日志。"""
+    j = RunJournal.start(path, META, _plan())
+    j.record("000001", "written")
+    j.record("000002", "failed", attempts=3, error="timeout")
+    j.close()
+    with path.open("ab") as f:
+        f.write(b'{"type": "result", "code": "600000", "sta')
+    return RunJournal.load(path)
+
+
+def test_load_truncates_partial_last_line():
+    """末行不完整时截去，已完成的记录全部回放；之后追加的记录与截断点正确衔接。"""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / JOURNAL_FILE
+        j = _interrupted(path)
+        assert path.read_bytes().endswith(b"\n")
+        assert j.meta == META
+        assert j.counts() == {"pending": 2, "done": 1, "failed": 1}
+
+        j.record("600000", "appended")
+        j.close()
+        reloaded = RunJournal.load(path)
+        reloaded.close()
+        assert reloaded.entries == j.entries
+        assert reloaded.counts() == {"pending": 1, "done": 2, "failed": 1}
+
+
+def test_resume_and_retry_plans():
+    """select 给出续跑 / 重试的抓取计划（含历史缺口）；重新计划时累计尝试次数。"""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / JOURNAL_FILE
+        j = _interrupted(path)
+
+        assert set(j.select(["pending"])) == {"600000", "600001"}
+        retry = j.select(["failed"])
+        assert list(retry) == ["000002"]
+        pd.testing.assert_index_equal(retry["000002"], _plan()["000002"])
+        assert j.failures() == [("000002", 3, "timeout")]
+
+        j.add(retry)
+        j.record("000002", "filled", attempts=1)
+        j.close()
+        reloaded = RunJournal.load(path)
+        reloaded.close()
+        assert reloaded.entries["000002"]["state"] == "done"
+        assert reloaded.entries["000002"]["attempts"] == 4
+
+
+if __name__ == "__main__":
+    test_load_truncates_partial_last_line()
+    test_resume_and_retry_plans()
+    print("全部测试通过")
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+对冲请求测试脚本
+以回放数据源 replay（主）/ replay2（对冲）注入延迟与故障，验证出错回退、超过 p95 后的对冲，
+thread 模式下主请求在调用线程执行、只有对冲请求进入线程池，以及整次抓取改道后全部完成
+"""
+
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+os.environ.setdefault("TQDM_DISABLE", "1")
+
+import pandas as pd
+
+import fetch_kline as fk
+from kline_store import open_store
+from rate_limit import configure_breakers, configure_limiter
+from replay_source import configure_replay
+
+CODES = 20
+START, END = "20240101", "20240630"
+
+
+def _setup(**primary):
+    """replay 为主数据源（参数由 *primary* 给出）、replay2 为无故障的对冲数据源，两者数据相同。"""
+    configure_breakers(failure_rate=0.5, window=20, min_requests=10, cooldown=30.0)
+    for name in fk.REPLAY_SOURCES:
+        configure_limiter(name, **fk.RATE_LIMITS[name])
+    replay = configure_replay("replay", codes=CODES, jitter=0.0, **primary)
+    replay2 = configure_replay("replay2", codes=CODES, jitter=0.0, fault_seed=1)
+    fk.HEDGE_TO.clear()
+    fk.configure_hedge("replay", "replay2", workers=4)
+    fk.TIMINGS.reset()
+    return replay, replay2
+
+
+def _expected(code: str) -> pd.DataFrame:
+    return fk._normalize_kline(fk._clean_replay(fk.get_replay("replay2").kline(code, START, END), START, END))
+
+
+def _warm_up(replay, n: int = 25) -> None:
+    """先让主数据源积累足够的延迟样本（p95 约 10 ms），对冲才按时间触发。"""
+    replay.latency = 0.01
+    codes = replay.universe()
+    for i in range(n):
+        fk.request_kline(codes[i % len(codes)], START, END, "replay")
+    assert fk._hedge_delay("replay") is not None
+    fk.TIMINGS.reset()
+
+
+def test_failover_on_error():
+    """主数据源出错且对冲尚未发出时，立即在调用线程改走 replay2。"""
+    replay, _ = _setup(error_rate=1.0)
+    code = replay.universe()[0]
+    df = fk.request_kline(code, START, END, "replay")
+    pd.testing.assert_frame_equal(df, _expected(code))
+    assert fk.TIMINGS.counts["failover"] == 1
+    assert fk.TIMINGS.counts["hedge"] == 0
+
+
+def test_hedge_after_p95(monkeypatch):
+    """主请求超过 p95 未返回即发出对冲：主请求慢而成功时用主请求结果，慢而失败时直接采用已完成的对冲结果。"""
+    replay, _ = _setup()
+    _warm_up(replay)
+
+    threads = []
+    once = fk.get_kline_once
+
+    def traced(code, start, end, adjust, datasource, freq_code=4):
+        threads.append((datasource, threading.current_thread().name))
+        return once(code, start, end, adjust, datasource, freq_code)
+
+    monkeypatch.setattr(fk, "get_kline_once", traced)
+    code = replay.universe()[1]
+
+    replay.latency = 0.3
+    df = fk.request_kline(code, START, END, "replay")
+    pd.testing.assert_frame_equal(df, _expected(code))
+    assert fk.TIMINGS.counts["hedge"] == 1 and fk.TIMINGS.counts["hedge_win"] == 0
+    caller = threading.current_thread().name
+    assert ("replay", caller) in threads
+    assert any(ds == "replay2" and name.startswith("hedge") for ds, name in threads)
+
+    replay.error_rate = 1.0
+    t0 = time.monotonic()
+    df = fk.request_kline(code, START, END, "replay")
+    elapsed = time.monotonic() - t0
+    pd.testing.assert_frame_equal(df, _expected(code))
+    assert fk.TIMINGS.counts["hedge"] == 2 and fk.TIMINGS.counts["hedge_win"] == 1
+    assert fk.TIMINGS.counts["failover"] == 0
+    assert elapsed < 0.3 + 0.15               # 主请求出错时对冲结果已就绪，不再从头等待
+
+
+def test_fetch_run_fails_over_to_replay2():
+    """主数据源全部出错（熔断打开后取名额即失败）时，整次 thread / async 抓取都经 replay2 完成。"""
+    for mode in ("thread", "async"):
+        replay, _ = _setup(error_rate=1.0)
+        with tempfile.TemporaryDirectory() as tmp:
+            store = open_store(Path(tmp), "csv", manifest=True)
+            plan = dict.fromkeys(replay.universe())
+            if mode == "thread":
+                stats = fk.fetch_all_threaded(plan, START, END, store, "replay", 4, 4)
+            else:
+                stats = fk.fetch_all_async(plan, START, END, store, "replay", 4, 8)
+            assert stats["written"] == CODES, (mode, stats)
+            for code in replay.universe():
+                pd.testing.assert_frame_equal(store.read(code), _expected(code), check_freq=False)
+        assert fk.TIMINGS.counts["failover"] >= CODES
+    fk.HEDGE_TO.clear()
+
+
+if __name__ == "__main__":
+    import pytest
+
+    raise SystemExit(pytest.main([__file__, "-q"]))
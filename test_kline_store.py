@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+K 线存储测试脚本
+验证 CSV / Feather / Parquet 三种格式的写入、读取、追加与尾部读取往返一致，
+CSV 目录导入列式格式，以及数据清单随写入更新、在目录被外部改动后失效重建
+"""
+
+import os
+import tempfile
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+from kline_store import (
+    MANIFEST_FILE,
+    STORE_FORMATS,
+    CsvStore,
+    Manifest,
+    detect_format,
+    frame_hash,
+    import_csv,
+    normalize,
+    open_store,
+)
+from replay_source import ReplaySource
+
+FORMATS = sorted(STORE_FORMATS)
+
+
+def _frames(n: int = 3):
+    src = ReplaySource(codes=n, seed=5)
+    return {code: src.kline(code, "20220101", "20231231") for code in src.universe()}
+
+
+@pytest.mark.parametrize("fmt", FORMATS)
+def test_write_read_round_trip(fmt):
+    """写入后读回的数据与规范化后的原数据相同（列类型统一为 datetime64[ns] / float64）。"""
+    with tempfile.TemporaryDirectory() as tmp:
+        store = open_store(Path(tmp), fmt)
+        for code, df in _frames().items():
+            store.write(code, df)
+            got = store.read(code)
+            pd.testing.assert_frame_equal(got, normalize(df))
+            assert got["date"].dtype == "datetime64[ns]"
+            assert (got.drop(columns="date").dtypes == "float64").all()
+        assert store.codes() == sorted(_frames())
+        assert detect_format(Path(tmp)) == fmt
+
+
+@pytest.mark.parametrize("fmt", FORMATS)
+def test_append_and_tail(fmt):
+    """分段追加的结果与一次写入相同；tail 与读出整表后取尾部相同。"""
+    with tempfile.TemporaryDirectory() as tmp:
+        store = open_store(Path(tmp), fmt)
+        for code, df in _frames().items():
+            store.append(code, df.iloc[:300])          # 文件不存在时等同 write
+            store.append(code, df.iloc[300:301])
+            store.append(code, df.iloc[301:])
+            pd.testing.assert_frame_equal(store.read(code), normalize(df))
+            for n in (1, 5, 200):
+                pd.testing.assert_frame_equal(store.tail(code, n), normalize(df).tail(n).reset_index(drop=True))
+
+
+@pytest.mark.parametrize("fmt", ["feather", "parquet"])
+def test_import_csv(fmt):
+    """CSV 目录导入列式格式后内容不变；已存在的文件默认跳过。"""
+    with tempfile.TemporaryDirectory() as tmp:
+        src, dst = Path(tmp) / "csv", Path(tmp) / fmt
+        csv = CsvStore(src)
+        for code, df in _frames().items():
+            csv.write(code, df)
+        store = open_store(dst, fmt)
+
+        assert import_csv(src, store) == len(_frames())
+        for code in csv.codes():
+            pd.testing.assert_frame_equal(store.read(code), csv.read(code))
+        assert import_csv(src, store) == 0
+
+
+def _assert_entry_matches(store, code):
+    """清单条目与重新读取文件得到的条目一致（行数、哈希、首末日期、价格区间、末根 K 线）。"""
+    entry = dict(store.manifest.get(code))
+    df = store.read(code)
+    fresh = Manifest(Path("unused"), store.name)
+    fresh.record(code, df, store.path(code))
+    assert entry == fresh.get(code)
+    assert entry["hash"] == frame_hash(df)
+    pd.testing.assert_frame_equal(store.manifest.last_bar(code), store.tail(code, 1), check_like=True)
+
+
+@pytest.mark.parametrize("fmt", FORMATS)
+def test_manifest_tracks_writes(fmt):
+    """write / append 后清单条目与整表重读的结果一致，保存后可原样载入。"""
+    with tempfile.TemporaryDirectory() as tmp:
+        store = open_store(Path(tmp), fmt, manifest=True)
+        frames = _frames()
+        for code, df in frames.items():
+            store.write(code, df.iloc[:200])
+            store.append(code, df.iloc[200:])
+            assert store.manifest.is_fresh(code, store.path(code))
+            _assert_entry_matches(store, code)
+        assert store.manifest.max_last_date() == max(df["date"].iloc[-1] for df in frames.values())
+        store.manifest.save()
+
+        loaded = Manifest.load(Path(tmp) / MANIFEST_FILE, fmt)
+        assert loaded.entries == store.manifest.entries
+        assert Manifest.load(Path(tmp) / MANIFEST_FILE, "other").entries == {}
+
+
+def test_manifest_sync_after_external_change():
+    """清单之外改写 / 删除 / 新增文件后，受影响的条目失效，sync 只重读这些文件。"""
+    with tempfile.TemporaryDirectory() as tmp:
+        store = open_store(Path(tmp), "csv", manifest=True)
+        frames = _frames(4)
+        codes = sorted(frames)
+        for code in codes[:3]:
+            store.write(code, frames[code])
+        assert store.manifest.sync(store) == 0
+
+        # 绕过 store 直接改写一个文件（截掉末尾几行），删除一个，新增一个
+        changed, removed, added = codes[0], codes[1], codes[3]
+        CsvStore(Path(tmp)).write(changed, frames[changed].iloc[:-3])
+        os.utime(store.path(changed), ns=(0, 0))
+        store.path(removed).unlink()
+        CsvStore(Path(tmp)).write(added, frames[added])
+        assert not store.manifest.is_fresh(changed, store.path(changed))
+
+        assert store.manifest.sync(store) == 2
+        assert store.manifest.codes() == sorted([changed, codes[2], added])
+        for code in store.manifest.codes():
+            assert store.manifest.is_fresh(code, store.path(code))
+            _assert_entry_matches(store, code)
+        assert store.manifest.last_date(changed) == frames[changed]["date"].iloc[-4]
+
+
+if __name__ == "__main__":
+    for fmt in FORMATS:
+        test_write_read_round_trip(fmt)
+        test_append_and_tail(fmt)
+        test_manifest_tracks_writes(fmt)
+    test_manifest_sync_after_external_change()
+    for fmt in ("feather", "parquet"):
+        test_import_csv(fmt)
+    print("全部测试通过")
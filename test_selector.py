@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+选股器测试脚本
+在回放数据源合成的固定股票池上，验证向量化指标、指标缓存、面板批量计算等优化
+与原逐行 / 逐股票实现的结果一致
+"""
+
+import json
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+
+import Selector as S
+from panel import Panel
+from replay_source import ReplaySource
+from select_stock import instantiate_selector
+
+CONFIG = Path(__file__).with_name("configs.json")
+
+# 合成股票池上有选股结果的交易日（各 Selector 至少各有一次入选）
+DATES = [
+    pd.Timestamp(d)
+    for d in ("2023-07-04", "2023-07-06", "2023-07-12", "2023-07-14", "2023-07-19", "2023-08-03", "2023-08-11", "2023-08-21")
+]
+
+
+@lru_cache(maxsize=None)
+def _universe() -> Dict[str, pd.DataFrame]:
+    """
+    种子固定的 60 只合成股票（与 select_stock.load_data 一样经 tag_frame 标记）。
+    部分股票有停牌缺口或上市较晚，面板对齐时会出现 NaN 填充。
+    """
+    src = ReplaySource(codes=60, seed=0)
+    data = {}
+    for i, code in enumerate(src.universe()):
+        df = src.kline(code, "20210101", "20231231")
+        if i % 7 == 3:
+            df = df.drop(df.index[-120:-110])          # 停牌两周
+        if i % 11 == 5:
+            df = df.iloc[400:]                         # 上市较晚
+        data[code] = S.tag_frame(df.reset_index(drop=True), code)
+    return data
+
+
+def _kdj_loop(df: pd.DataFrame, n: int = 9) -> pd.DataFrame:
+    """原逐行循环版 KDJ，作为向量化实现的对照。"""
+    low_n = df["low"].rolling(window=n, min_periods=1).min()
+    high_n = df["high"].rolling(window=n, min_periods=1).max()
+    rsv = (df["close"] - low_n) / (high_n - low_n + 1e-9) * 100
+
+    K = np.zeros_like(rsv, dtype=float)
+    D = np.zeros_like(rsv, dtype=float)
+    for i in range(len(df)):
+        if i == 0:
+            K[i] = D[i] = 50.0
+        else:
+            K[i] = 2 / 3 * K[i - 1] + 1 / 3 * rsv.iloc[i]
+            D[i] = 2 / 3 * D[i - 1] + 1 / 3 * K[i]
+    return df.assign(K=K, D=D, J=3 * K - 2 * D)
+
+
+def _bbi_window_loop(bbi: pd.Series, min_window: int, max_window, q_threshold: float):
+    """原逐窗口搜索：自最长窗口向下，返回第一个通过的窗口长度。"""
+    bbi = bbi.dropna()
+    if len(bbi) < min_window:
+        return None
+    for w in range(min(len(bbi), max_window or len(bbi)), min_window - 1, -1):
+        seg = bbi.iloc[-w:]
+        if np.quantile(np.diff((seg / seg.iloc[0]).values), q_threshold) >= 0:
+            return w
+    return None
+
+
+def _selectors() -> List[Tuple[str, object]]:
+    """configs.json 中的全部 Selector，外加一个放宽量能条件的 TePu（默认参数在合成数据上不入选）。"""
+    cfgs = json.loads(CONFIG.read_text(encoding="utf-8"))["selectors"]
+    selectors = [instantiate_selector(cfg) for cfg in cfgs]
+    selectors.append((
+        "TePu(放宽)",
+        S.BreakoutVolumeKDJSelector(
+            j_threshold=10, j_q_threshold=0.10, up_threshold=3.0, volume_threshold=1.0,
+            offset=15, max_window=60, price_range_pct=1,
+        ),
+    ))
+    return selectors
+
+
+def _run_all(cache) -> Dict[tuple, List[str]]:
+    data = _universe()
+    picks = {}
+    with S.use_indicator_cache(cache):
+        for date in DATES:
+            for alias, selector in _selectors():
+                picks[(date, alias)] = selector.select(date, data)
+    return picks
+
+
+@lru_cache(maxsize=None)
+def _frame_picks() -> Dict[tuple, List[str]]:
+    """不用缓存、逐股票 DataFrame 计算的选股结果，作为各项对照的基准。"""
+    return _run_all(None)
+
+
+def test_kdj_matches_loop():
+    """向量化递推与原逐行循环的 K / D / J 逐位相同。"""
+    for code in list(_universe())[:10]:
+        df = _universe()[code].iloc[-300:]
+        got, want = S.compute_kdj(df), _kdj_loop(df)
+        for col in ("K", "D", "J"):
+            np.testing.assert_array_equal(got[col].to_numpy(), want[col].to_numpy())
+
+
+def test_kdj_batch_matches_per_column():
+    """compute_kdj_batch 的每一列与对该列有效部分单独计算的结果相同，列首填充行为 NaN。"""
+    frames = [_universe()[code].iloc[-(120 - 7 * i):] for i, code in enumerate(list(_universe())[:12])]
+    L = max(map(len, frames))
+
+    def stacked(field: str) -> np.ndarray:
+        out = np.full((L, len(frames)), np.nan)
+        for j, df in enumerate(frames):
+            out[L - len(df):, j] = df[field].to_numpy(dtype=float)
+        return out
+
+    K, D, J = S.compute_kdj_batch(stacked("low"), stacked("high"), stacked("close"))
+    for j, df in enumerate(frames):
+        want = _kdj_loop(df)
+        pad = L - len(df)
+        assert np.isnan(J[:pad, j]).all()
+        np.testing.assert_array_equal(K[pad:, j], want["K"].to_numpy())
+        np.testing.assert_array_equal(D[pad:, j], want["D"].to_numpy())
+        np.testing.assert_array_equal(J[pad:, j], want["J"].to_numpy())
+
+
+def test_bbi_window_matches_loop():
+    """单次扫描求出的最长通过窗口（逐股票与批量两种入口）与逐窗口搜索相同。"""
+    rng = np.random.default_rng(1)
+    series = [S.compute_bbi(_universe()[code].iloc[-90:]) for code in list(_universe())[:20]]
+    # 人为构造的平滑上升段，保证较长窗口也有通过的情形
+    series += [pd.Series(np.cumsum(rng.normal(0.3, 1.0, 70)) + 100) for _ in range(20)]
+    params = [(20, 60, 0.3), (2, 60, 0.2), (2, None, 0.0), (5, 30, 0.5)]
+
+    found = 0
+    for min_window, max_window, q in params:
+        L = max(map(len, series))
+        packed = np.full((L, len(series)), np.nan)
+        for j, bbi in enumerate(series):
+            packed[L - len(bbi):, j] = bbi.to_numpy()
+        batch = S.bbi_uptrend_window_batch(packed, min_window=min_window, max_window=max_window, q_threshold=q)
+
+        for j, bbi in enumerate(series):
+            want = _bbi_window_loop(bbi, min_window, max_window, q)
+            got = S.bbi_uptrend_window(bbi, min_window=min_window, max_window=max_window, q_threshold=q)
+            assert got == want, (j, min_window, max_window, q)
+            assert int(batch[j]) == (want or 0), (j, min_window, max_window, q)
+            assert S.bbi_deriv_uptrend(bbi, min_window=min_window, max_window=max_window, q_threshold=q) == (want is not None)
+            found += want is not None
+    assert found > 0
+
+
+def test_indicator_cache_matches_uncached():
+    """共享指标缓存下每个 Selector 在每个交易日的选股结果都与不用缓存时相同。"""
+    plain = _frame_picks()
+    cache = S.IndicatorCache()
+    cached = _run_all(cache)
+    print(f"缓存统计: {cache.stats()}")
+
+    assert cached == plain
+    for cls in {type(selector).__name__ for _, selector in _selectors()}:
+        aliases = [alias for alias, selector in _selectors() if type(selector).__name__ == cls]
+        assert any(plain[(d, a)] for d in DATES for a in aliases), f"{cls} 在测试日期上没有入选股票"
+
+
+def test_superb1_cache_matches_uncached():
+    """SuperB1 在已被其他 Selector 预热的缓存上，逐日选股结果与不用缓存时相同且确有入选。"""
+    data = _universe()
+    selectors = _selectors()
+    superb1 = next(sel for _, sel in selectors if isinstance(sel, S.SuperB1Selector))
+    plain = {d: superb1.select(d, data) for d in DATES}
+
+    with S.use_indicator_cache(S.IndicatorCache()):
+        cached = {}
+        for d in DATES:
+            for _, selector in selectors:
+                if selector is not superb1:
+                    selector.select(d, data)
+            cached[d] = superb1.select(d, data)
+
+    assert cached == plain
+    assert sum(map(len, plain.values())) >= 3
+
+
+def test_panel_matches_frame():
+    """面板引擎 select_panel 与逐股票 select 的选股结果相同（README 中 --engine panel 的承诺）。"""
+    panel = Panel.from_frames(_universe())
+    expected = _frame_picks()
+    for d in DATES:
+        for alias, selector in _selectors():
+            assert sorted(selector.select_panel(d, panel)) == sorted(expected[(d, alias)]), (alias, d)
+
+
+def test_select_dates_matches_select():
+    """select_dates 在区间内逐日批量判定，每一行与当日 select() 的结果一致。"""
+    panel = Panel.from_frames(_universe())
+    expected = _frame_picks()
+    for alias, selector in _selectors():
+        signals = selector.select_dates(DATES[0], DATES[-1], panel)
+        assert set(DATES) <= set(signals.index)
+        for d in DATES:
+            row = signals.loc[d]
+            assert sorted(row.index[row.to_numpy()]) == sorted(expected[(d, alias)]), (alias, d)
+
+
+def test_indicator_cache_prefix_reuse():
+    """起点相同的较短切片直接取缓存前缀，结果与直接计算一致；起点不同则重新计算。"""
+    df = _universe()["000001"]
+    cache = S.IndicatorCache()
+    with S.use_indicator_cache(cache):
+        long = S._indicator(df.iloc[100:400], "kdj", S._kdj_columns)
+        short = S._indicator(df.iloc[100:250], "kdj", S._kdj_columns)
+        shifted = S._indicator(df.iloc[150:250], "kdj", S._kdj_columns)
+
+    assert cache.hits == 1 and cache.misses == 2
+    pd.testing.assert_frame_equal(long, S._kdj_columns(df.iloc[100:400]))
+    pd.testing.assert_frame_equal(short, S._kdj_columns(df.iloc[100:250]))
+    pd.testing.assert_frame_equal(shifted, S._kdj_columns(df.iloc[150:250]))
+
+
+if __name__ == "__main__":
+    test_kdj_matches_loop()
+    test_kdj_batch_matches_per_column()
+    test_bbi_window_matches_loop()
+    test_indicator_cache_matches_uncached()
+    test_superb1_cache_matches_uncached()
+    test_panel_matches_frame()
+    test_select_dates_matches_select()
+    test_indicator_cache_prefix_reuse()
+    print("全部测试通过")